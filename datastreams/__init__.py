@@ -1,6 +1,11 @@
 __author__ = 'stuart'
 
-__all__ = ['DataStream', 'DataSet', 'DictStream', 'DictSet', 'Datum']
+__all__ = ['DataStream', 'DataSet', 'DictStream', 'DictSet', 'Datum', 'PartitionedStream', 'PersistentDataSet',
+           'RollingAggregator', 'TimeWindow', 'record_type']
 
-from .datastreams import DataStream, DataSet, Datum, Nothing
+from .datastreams import DataStream, DataSet, Datum, Nothing, PersistentDataSet
 from .dictstreams import DictStream, DictSet
+from .partitionedstreams import PartitionedStream
+from .rolling import RollingAggregator
+from .windows import TimeWindow
+from .records import record_type
@@ -0,0 +1,69 @@
+""" Runs a pipeline over stdin, writing its rows to stdout, one per line:
+
+    zcat access.log.gz | python -m datastreams ".filter(lambda line: ' 500 ' in line)" | sort
+
+The pipeline is an expression over ``stream``, a :py:class:`DataStream` of stdin's lines (without their newlines);
+expressions starting with ``.`` are applied to ``stream``.  With ``-f module:function``, the function is called with
+``stream`` instead.  Results that aren't streams or lists, like counts, are printed.
+
+Exits with 0 when the reader closes the pipe early, like ``head`` does, as it only means no more rows were wanted.
+"""
+import argparse
+import errno
+from importlib import import_module
+import os
+import sys
+
+import datastreams
+from datastreams import DataStream
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(prog='python -m datastreams', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('expression', nargs='?', default='stream',
+                        help="pipeline expression over `stream`, or starting with '.' to apply to it")
+    parser.add_argument('-f', '--function', help="pipeline function taking `stream`, as module:function")
+    parser.add_argument('-b', '--bytes', action='store_true', help="stream lines as bytes, without decoding them")
+    parser.add_argument('-e', '--encoding', help="text encoding of stdin and stdout")
+    parser.add_argument('--chunk-rows', type=int, default=1000,
+                        help="rows written at a time, lower for less latency (default: %(default)s)")
+    return parser.parse_args(args)
+
+
+def build_pipeline(stream, expression='stream', function=None):
+    """ Applies a pipeline expression or ``module:function`` to a stream """
+    if function is not None:
+        module_name, _, function_name = function.partition(':')
+        return getattr(import_module(module_name), function_name)(stream)
+    if expression.startswith('.'):
+        expression = 'stream' + expression
+    namespace = dict((name, getattr(datastreams, name)) for name in datastreams.__all__)
+    namespace['stream'] = stream
+    return eval(expression, namespace)
+
+
+def main(args=None):
+    options = parse_args(args)
+    sys.path.insert(0, os.getcwd())
+    stream = DataStream.from_stdin(mode='bytes' if options.bytes else 'text', encoding=options.encoding,
+                                   keepends=False)
+    result = build_pipeline(stream, options.expression, options.function)
+    try:
+        if isinstance(result, (list, tuple)):
+            result = DataStream(result)
+        if isinstance(result, DataStream):
+            result.pipe_to_stdout(linesep='\n', encoding=options.encoding, chunk_rows=options.chunk_rows)
+        else:
+            print(result)
+            sys.stdout.flush()
+    except IOError as error:
+        if error.errno != errno.EPIPE:
+            raise
+        # the reader went away, like `head` does; stdout is pointed at devnull so closing it doesn't fail again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+from itertools import islice
+import threading
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+_END = object()
+
+
+class BackgroundReader(object):
+    """ Iterates an iterable on a daemon thread, handing rows over in chunks through a bounded queue.  Errors raised
+    by the iterable are re-raised to the consumer, and closing the reader stops the thread and closes the iterable.
+
+    :param iterable: rows to be read
+    :param int max_pending: number of chunks that may wait in the queue before the thread blocks
+    :param int chunk_size: number of rows handed over at a time
+    """
+
+    def __init__(self, iterable, max_pending=16, chunk_size=1):
+        self._setup(max_pending, chunk_size)
+        self._start([iterable])
+
+    def _setup(self, max_pending, chunk_size):
+        self._chunk_size = chunk_size
+        self._queue = Queue(max_pending)
+        self._stopped = threading.Event()
+        self._finished = False
+        self._threads = []
+        self._running = 0
+
+    @classmethod
+    def merging(cls, iterables, max_pending=16, chunk_size=1):
+        """ Reads several iterables at once, each on its own thread, handing over chunks in whichever order they're
+        read.  The reader is exhausted once every iterable is.
+
+        :rtype: BackgroundReader
+        """
+        reader = cls.__new__(cls)
+        reader._setup(max_pending, chunk_size)
+        reader._start(iterables)
+        return reader
+
+    def _start(self, iterables):
+        iterables = list(iterables)
+        self._running = len(iterables)
+        self._finished = not iterables
+        for iterable in iterables:
+            thread = threading.Thread(target=self._run, args=(iterable,))
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
+
+    def _run(self, iterable):
+        iterator = iter(iterable)
+        try:
+            if self._chunk_size == 1:
+                for row in iterator:
+                    if not self._put([row]):
+                        return
+            else:
+                while True:
+                    chunk = list(islice(iterator, self._chunk_size))
+                    if not chunk or not self._put(chunk):
+                        break
+        except BaseException as error:
+            self._put(_Failure(error))
+            return
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+        self._put(_END)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def get_chunk(self, timeout=None):
+        """ Returns the next chunk of rows, or ``None`` once the iterable is exhausted
+
+        :param float timeout: seconds to wait, raising :py:class:`queue.Empty` if no chunk is ready by then
+        :rtype: list
+        """
+        if self._finished:
+            return None
+        item = self._queue.get(timeout=timeout)
+        while item is _END:
+            self._running -= 1
+            if self._running == 0:
+                self._finished = True
+                return None
+            item = self._queue.get(timeout=timeout)
+        if isinstance(item, _Failure):
+            self._finished = True
+            raise item.error
+        return item
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self.get_chunk()
+                if chunk is None:
+                    return
+                for row in chunk:
+                    yield row
+        finally:
+            self.close()
+
+    def close(self, timeout=1.0):
+        """ Stops reading, discarding any rows that haven't been handed over """
+        self._finished = True
+        self._stopped.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                break
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
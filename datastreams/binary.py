@@ -0,0 +1,366 @@
+from bisect import bisect_right
+from itertools import groupby
+from operator import attrgetter
+import mmap
+import os
+import pickle
+import struct
+import zlib
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+try:
+    from collections import OrderedDict
+except ImportError:
+    from backport_collections import OrderedDict
+
+from .records import record_type, record_token, record_class
+from .sinks import replace, open_replacement
+
+PICKLE_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+
+MAGIC = b'DSBIN'
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct('<5sBB')  # magic, version, serializer
+FRAME_HEADER = struct.Struct('<BIQQ')  # compression, buffer count, body length, serialized length
+BUFFER_LENGTH = struct.Struct('<Q')
+# an offset index after the last frame: a mark, the frame count, each frame's offset and first row, and the row count,
+# found through a trailer of the index's offset and magic
+INDEX_MARK = b'I'
+INDEX_ENTRY = struct.Struct('<QQ')
+INDEX_COUNT = struct.Struct('<Q')
+INDEX_TRAILER = struct.Struct('<Q8s')
+INDEX_MAGIC = b'DSINDEX1'
+
+SERIALIZERS = ['pickle', 'msgpack']
+FRAME_COMPRESSIONS = [None, 'zlib', 'zstd']
+
+# classes for records written before records carried a token, by (name, fields)
+_untokened_record_types = {}
+
+
+def is_slotted_record(cls):
+    """ Whether rows of a class are :py:func:`record_type` style records, which are packed as tuples of values """
+    return hasattr(cls, '_fields') and '__slots__' in vars(cls) and not issubclass(cls, tuple)
+
+
+def pack_rows(rows):
+    """ Splits rows into runs of the same type, packing runs of slotted records as their class's name, fields and
+    :py:func:`record_token`, and a list of value tuples.  Records are smaller and faster to serialize this way, and
+    their (usually generated) classes needn't be importable.
+
+    :rtype: list[tuple]
+    """
+    segments = []
+    for row_type, run in groupby(rows, type):
+        if is_slotted_record(row_type):
+            fields = tuple(row_type._fields)
+            if len(fields) > 1:
+                values = list(map(attrgetter(*fields), run))
+            elif fields:
+                values = [(value,) for value in map(attrgetter(fields[0]), run)]
+            else:
+                values = [() for _ in run]
+            segments.append((row_type.__name__, fields, values, record_token(row_type)))
+        else:
+            segments.append((None, None, list(run)))
+    return segments
+
+
+def unpack_rows(segments):
+    rows = []
+    for segment in segments:
+        name, fields, values = segment[:3]
+        if name is None:
+            rows.extend(values)
+            continue
+        fields = tuple(fields)
+        if len(segment) > 3:
+            cls = record_class(segment[3], fields, name)
+        else:
+            cls = _untokened_record_types.get((name, fields))
+            if cls is None:
+                cls = _untokened_record_types.setdefault((name, fields), record_type(fields, name))
+        rows.extend(cls(*value) for value in values)
+    return rows
+
+
+def compress(data, compression, level=None):
+    if compression == 'zlib':
+        return zlib.compress(data, 6 if level is None else level)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    raise ValueError("Invalid compression: {}, must be zlib, zstd or None".format(compression))
+
+
+def decompress(data, compression):
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    if zstandard is None:
+        raise ValueError("zstd decompression needs the zstandard package")
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def encode_frame(rows, serializer='pickle', compression=None, compression_level=None):
+    """ Encodes a batch of rows as a length-prefixed frame.  With pickle (protocol 5 where available), large buffers
+    like arrays are written out-of-band after the pickle rather than copied into it.
+
+    :return: chunks of the frame, to be written in order
+    :rtype: list[bytes]
+    """
+    segments = pack_rows(rows)
+    buffers = []
+    if serializer == 'pickle':
+        if PICKLE_PROTOCOL >= 5:
+            data = pickle.dumps(segments, PICKLE_PROTOCOL, buffer_callback=buffers.append)
+            buffers = [buffer.raw() for buffer in buffers]
+        else:
+            data = pickle.dumps(segments, PICKLE_PROTOCOL)
+    elif serializer == 'msgpack':
+        if msgpack is None:
+            raise ValueError("The msgpack serializer needs the msgpack package")
+        data = msgpack.packb(segments, use_bin_type=True)
+    else:
+        raise ValueError("Invalid serializer: {}, must be pickle or msgpack".format(serializer))
+    lengths = [buffer.nbytes for buffer in buffers]
+    body = [data] + buffers
+    if compression is not None:
+        body = [compress(b''.join(body), compression, compression_level)]
+    header = FRAME_HEADER.pack(FRAME_COMPRESSIONS.index(compression), len(buffers), sum(map(len, body)), len(data))
+    return [header + b''.join(BUFFER_LENGTH.pack(length) for length in lengths)] + body
+
+
+def _read_exactly(source, size):
+    data = source.read(size)
+    if len(data) < size:
+        raise EOFError("Binary stream ended in the middle of a frame")
+    return data
+
+
+def read_frame(source, serializer='pickle'):
+    """ Reads a frame written by :py:func:`encode_frame` from a binary file object
+
+    :return: the frame's rows, or ``None`` at the end of the file
+    :rtype: list
+    """
+    header = source.read(1)
+    while header in (MAGIC[:1], INDEX_MARK):
+        if header == INDEX_MARK:
+            # an indexed file's offset index, which may be followed by another concatenated file
+            frames, = INDEX_COUNT.unpack(_read_exactly(source, INDEX_COUNT.size))
+            _read_exactly(source, INDEX_ENTRY.size * frames + INDEX_COUNT.size + INDEX_TRAILER.size)
+        # the header of another file or stream, concatenated to this one
+        elif read_header(source, header) != serializer:
+            raise ValueError("Can't read concatenated binary streams with different serializers")
+        header = source.read(1)
+    if not header:
+        return None
+    header += _read_exactly(source, FRAME_HEADER.size - 1)
+    compression, buffer_count, body_length, data_length = FRAME_HEADER.unpack(header)
+    lengths = struct.unpack('<{}Q'.format(buffer_count), _read_exactly(source, BUFFER_LENGTH.size * buffer_count))
+    body = _read_exactly(source, body_length)
+    if compression:
+        body = decompress(body, FRAME_COMPRESSIONS[compression])
+    body = memoryview(body)
+    data = body[:data_length]
+    if serializer == 'msgpack':
+        if msgpack is None:
+            raise ValueError("Reading msgpack frames needs the msgpack package")
+        return unpack_rows(msgpack.unpackb(data, raw=False))
+    if not lengths:
+        return unpack_rows(pickle.loads(data))
+    buffers = []
+    start = data_length
+    for length in lengths:
+        buffers.append(body[start:start + length])
+        start += length
+    return unpack_rows(pickle.loads(data, buffers=buffers))
+
+
+def write_header(target, serializer):
+    target.write(FILE_HEADER.pack(MAGIC, FORMAT_VERSION, SERIALIZERS.index(serializer)))
+
+
+def read_header(source, start=b''):
+    """ Reads the header of a binary file, returning its serializer """
+    magic, version, serializer = FILE_HEADER.unpack(start + _read_exactly(source, FILE_HEADER.size - len(start)))
+    if magic != MAGIC:
+        raise ValueError("Not a datastreams binary file")
+    if version != FORMAT_VERSION:
+        raise ValueError("Unsupported binary format version: {}".format(version))
+    return SERIALIZERS[serializer]
+
+
+class BinaryWriter(object):
+    """ Writes batches of rows to a binary file of length-prefixed frames, one frame per batch.  Paths are written to
+    a temporary file that's renamed into place on :py:func:`close`.
+
+    :param target: path, or binary file object to write to
+    :param str serializer: ``pickle`` for any picklable rows, or ``msgpack`` for plain data (needs ``msgpack``)
+    :param str compression: ``zlib``, ``zstd`` (needs ``zstandard``), or ``None``, applied to each frame
+    :param int compression_level: level passed to the compressor, or its default if ``None``
+    """
+
+    def __init__(self, target, serializer='pickle', compression=None, compression_level=None, buffer_size=1 << 20):
+        if serializer not in SERIALIZERS:
+            raise ValueError("Invalid serializer: {}, must be pickle or msgpack".format(serializer))
+        if compression not in FRAME_COMPRESSIONS:
+            raise ValueError("Invalid compression: {}, must be zlib, zstd or None".format(compression))
+        self.serializer = serializer
+        self.compression = compression
+        self.compression_level = compression_level
+        self.rows_written = 0
+        if hasattr(target, 'write'):
+            self.path = self._temp_path = None
+            self._file = target
+        else:
+            self.path = target
+            self._file, self._temp_path, self._replaced_path = open_replacement(target, buffer_size)
+        write_header(self._file, serializer)
+
+    def write(self, rows):
+        """ Writes a batch of rows as one frame """
+        self._file.writelines(encode_frame(rows, self.serializer, self.compression, self.compression_level))
+        self.rows_written += len(rows)
+
+    def close(self):
+        """ Flushes the file, moving it into place if written to a path """
+        if self.path is None:
+            self._file.flush()
+            return
+        self._file.close()
+        if self._temp_path is not None:
+            replace(self._temp_path, self._replaced_path)
+
+    def abort(self):
+        """ Closes the file, deleting it if written to a path """
+        if self.path is not None:
+            self._file.close()
+            if self._temp_path is not None and os.path.exists(self._temp_path):
+                os.remove(self._temp_path)
+
+
+class IndexedBinaryWriter(BinaryWriter):
+    """ A :py:class:`BinaryWriter` that ends the file with an offset index of its frames on :py:func:`close`, for
+    random access with :py:class:`MappedRows`.  Indexed files are still read by :py:func:`iter_binary`, which skips
+    the index, so they can be concatenated with other binary files.
+    """
+
+    def __init__(self, target, *args, **kwargs):
+        super(IndexedBinaryWriter, self).__init__(target, *args, **kwargs)
+        self._index = []
+
+    def write(self, rows):
+        if rows:
+            self._index.append((self._file.tell(), self.rows_written))
+            super(IndexedBinaryWriter, self).write(rows)
+
+    def close(self):
+        start = self._file.tell()
+        self._file.write(INDEX_MARK + INDEX_COUNT.pack(len(self._index)))
+        self._file.writelines(INDEX_ENTRY.pack(offset, first_row) for offset, first_row in self._index)
+        self._file.write(INDEX_COUNT.pack(self.rows_written) + INDEX_TRAILER.pack(start, INDEX_MAGIC))
+        super(IndexedBinaryWriter, self).close()
+
+
+def read_index(source):
+    """ Reads the offset index of a file written by :py:class:`IndexedBinaryWriter`
+
+    :return: the offset and first row of each frame, and the number of rows
+    :rtype: tuple[list[int], list[int], int]
+    """
+    source.seek(-INDEX_TRAILER.size, os.SEEK_END)
+    start, magic = INDEX_TRAILER.unpack(_read_exactly(source, INDEX_TRAILER.size))
+    if magic != INDEX_MAGIC:
+        raise ValueError("Binary file has no offset index")
+    source.seek(start)
+    if _read_exactly(source, 1) != INDEX_MARK:
+        raise ValueError("Corrupt offset index")
+    frames, = INDEX_COUNT.unpack(_read_exactly(source, INDEX_COUNT.size))
+    entries = struct.unpack('<{}Q'.format(frames * 2), _read_exactly(source, INDEX_ENTRY.size * frames))
+    rows, = INDEX_COUNT.unpack(_read_exactly(source, INDEX_COUNT.size))
+    return list(entries[::2]), list(entries[1::2]), rows
+
+
+class MappedRows(Sequence):
+    """ Read-only sequence of the rows of an indexed binary file, memory mapped so opening it reads only its index.
+    Rows are found by binary search of the index, and their frame decoded; the last ``cached_frames`` decoded frames
+    are kept, so nearby and sequential reads decode each frame once.
+
+    :param str path: file written by :py:class:`IndexedBinaryWriter`
+    :param int cached_frames: number of decoded frames to keep
+    """
+
+    def __init__(self, path, cached_frames=4):
+        self.path = path
+        self.cached_frames = cached_frames
+        with open(path, 'rb') as source_file:
+            self._map = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.serializer = read_header(self._map)
+        self._offsets, self._first_rows, self._length = read_index(self._map)
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return self._length
+
+    def _read(self, frame):
+        self._map.seek(self._offsets[frame])
+        return read_frame(self._map, self.serializer)
+
+    def _frame(self, frame):
+        rows = self._cache.pop(frame, None)
+        if rows is None:
+            rows = self._read(frame)
+            if len(self._cache) >= self.cached_frames:
+                self._cache.popitem(last=False)
+        self._cache[frame] = rows
+        return rows
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(self._length))]
+        if item < 0:
+            item += self._length
+        if not 0 <= item < self._length:
+            raise IndexError("MappedRows index out of range")
+        frame = bisect_right(self._first_rows, item) - 1
+        return self._frame(frame)[item - self._first_rows[frame]]
+
+    def __iter__(self):
+        # frames are read in turn without going through the cache, so iterating doesn't evict it
+        for frame in range(len(self._offsets)):
+            for row in self._read(frame):
+                yield row
+
+    def close(self):
+        self._map.close()
+
+
+def iter_binary(source, buffer_size=1 << 20):
+    """ Yields the rows of a binary file written by :py:class:`BinaryWriter`.  Files can be concatenated and read as
+    one, as long as they use the same serializer.
+
+    :param source: path, or binary file object to read from
+    """
+    if hasattr(source, 'read'):
+        serializer = read_header(source)
+        while True:
+            rows = read_frame(source, serializer)
+            if rows is None:
+                return
+            for row in rows:
+                yield row
+    with open(source, 'rb', buffer_size) as source_file:
+        for row in iter_binary(source_file):
+            yield row
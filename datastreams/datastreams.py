@@ -1,23 +1,56 @@
-from itertools import islice, chain
+from itertools import islice, chain, count
+import codecs
 import csv
-from copy import copy
+from copy import copy, deepcopy
 import random
 import os
+import time
+from operator import attrgetter, methodcaller
+try:
+    from itertools import izip, imap
+except ImportError:
+    izip, imap = zip, map
 try:
     from collections import defaultdict, deque, Counter, namedtuple
 except ImportError:
     from backport_collections import defaultdict, deque, Counter, namedtuple
 import sys
+from .rolling import make_aggregator
+from .windows import iter_time_windows, iter_session_windows
+from .background import BackgroundReader, Empty
+from .sinks import BatchWriter, SqliteWriter, FileSink, encode_lines, write_lines
+from .binary import BinaryWriter, IndexedBinaryWriter, MappedRows, iter_binary
+from .jsonlines import iter_jsonl, json_backend
+from .processstreams import stage_class
+from .remotestreams import remote_class
+from .sources import iter_sql, partition_queries, open_text, iter_lines, iter_files, follow_lines, \
+    iter_stream_lines
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+try:
+    xrange
+except NameError:
+    xrange = range
 try:
     reduce
 except NameError:
     from functools import reduce
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
 
 
 class Nothing(object):
     pass
 
 
+def identity(row):
+    return row
+
+
 class Datum(object):
     def __init__(self, attributes):
         if isinstance(attributes, dict):
@@ -31,6 +64,124 @@ class Datum(object):
         return "Datum({})".format(self.__dict__)
 
 
+def joined_datum(class_name, attrs):
+    return joined_datum_class(class_name)(attrs)
+
+
+def _reduce_joined_datum(datum):
+    return joined_datum, (datum.__class__.__name__, vars(datum))
+
+
+# classes made by DataStream.join_objects by name, so joined rows can be pickled and share a class per pair of classes
+_joined_classes = {}
+
+
+def joined_datum_class(class_name):
+    if class_name not in _joined_classes:
+        _joined_classes[class_name] = type(class_name, (Datum,), {'__reduce__': _reduce_joined_datum})
+    return _joined_classes[class_name]
+
+
+ExecutionStats = namedtuple('ExecutionStats', ['rows', 'elapsed'])
+FilterStats = namedtuple('FilterStats', ['index', 'calls', 'passed', 'pass_rate', 'cost'])
+
+
+class AdaptiveFilter(object):
+    """ Predicate that combines several filter functions, periodically measuring each function's pass rate and time
+    per call, and running them in order of ``cost / (1 - pass_rate)`` so cheap, selective filters reject rows first.
+    Filters are measured in their current order, each only over the rows that reach it.
+
+    Reordering assumes the filters are independent.  If one raises an error after the filters were reordered, as
+    one guarded by an earlier filter like ``lambda row: row is not None`` would, the row is checked again in the
+    given order, which is then kept.
+
+    :param list[function] filter_fns: filter functions to be combined
+    :param int sample_size: number of rows to measure over, starting with the first row
+    :param int resample_interval: number of rows between the end of one measurement and the start of the next
+    """
+
+    def __init__(self, filter_fns, sample_size=1000, resample_interval=100000):
+        self.filter_fns = list(filter_fns)
+        self.sample_size = sample_size
+        self.resample_interval = resample_interval
+        self.order = list(range(len(self.filter_fns)))
+        self._ordered_fns = list(self.filter_fns)
+        self._calls = [0] * len(self.filter_fns)
+        self._passed = [0] * len(self.filter_fns)
+        self._elapsed = [0.0] * len(self.filter_fns)
+        self._countdown = sample_size
+        self._sampling = sample_size > 0
+
+    def __call__(self, row):
+        try:
+            if self._sampling:
+                return self._measure(row)
+            self._countdown -= 1
+            if self._countdown <= 0:
+                self._sampling = True
+                self._countdown = self.sample_size
+            for filter_fn in self._ordered_fns:
+                if not filter_fn(row):
+                    return False
+            return True
+        except Exception:
+            if self._ordered_fns == self.filter_fns:
+                raise
+            # likely a filter that depends on one it was given after, so go back to the given order for good
+            self.order = list(range(len(self.filter_fns)))
+            self._ordered_fns = list(self.filter_fns)
+            self._sampling = False
+            self._countdown = float('inf')
+            return all(filter_fn(row) for filter_fn in self.filter_fns)
+
+    def _measure(self, row):
+        passed = True
+        for i in self.order:
+            started = clock()
+            result = self.filter_fns[i](row)
+            self._elapsed[i] += clock() - started
+            self._calls[i] += 1
+            if not result:
+                passed = False
+                break
+            self._passed[i] += 1
+        self._countdown -= 1
+        if self._countdown <= 0:
+            self.reorder()
+            self._sampling = False
+            self._countdown = self.resample_interval
+        return passed
+
+    def rank(self, i):
+        calls = self._calls[i]
+        if calls == 0:
+            return float('inf')  # no row got past the filters before it
+        cost = self._elapsed[i] / calls
+        rejected = 1.0 - float(self._passed[i]) / calls
+        return cost / rejected if rejected > 0 else float('inf')
+
+    def reorder(self):
+        """ Sorts filters by measured rank """
+        self.order.sort(key=self.rank)
+        self._ordered_fns = [self.filter_fns[i] for i in self.order]
+
+    def stats(self):
+        """ Stats for each filter, in current run order
+
+        :rtype: list[FilterStats]
+        """
+        stats = []
+        for i in self.order:
+            calls = self._calls[i]
+            stats.append(FilterStats(
+                index=i,
+                calls=calls,
+                passed=self._passed[i],
+                pass_rate=float(self._passed[i]) / calls if calls else None,
+                cost=self._elapsed[i] / calls if calls else None))
+        return stats
+
+
 class DataStream(object):
     """ Foundation for the package - :py:class:`DataStream` allows you to chain
     map/filter/reduce/etc style operations together:
@@ -120,7 +271,34 @@ class DataStream(object):
         :param str method: name of method to be called
         :rtype: DataStream
         """
-        return self.map(lambda row: self.getattr(row, method)(*args, **kwargs))
+        return self.map(self.methodcaller(method, *args, **kwargs))
+
+    def decode(self, encoding='utf-8', errors='strict'):
+        """ Decode ``bytes`` or ``memoryview`` rows to text, like those from :py:func:`from_file` in ``bytes`` mode
+
+        >>> DataStream([b'hi', b'yo']).decode().to_list()
+        ... ['hi', 'yo']
+
+        :param str encoding: encoding of the rows
+        :param str errors: error handling scheme, as for :py:func:`codecs.decode`
+        :rtype: DataStream
+        """
+        return self.map(lambda row: codecs.decode(row, encoding, errors))
+
+    def map_partitions(self, function):
+        """ Maps a function over the stream's rows as a whole, for functions that work on iterators of rows, like ones
+        setting up a connection or model before their first row.  Partitioned streams call it once per partition.
+
+        >>> DataStream(range(5)).map_partitions(lambda rows: [sum(rows)]).to_list()
+        ... [10]
+
+        :param function function: function taking an iterator of rows and returning an iterable of rows
+        :rtype: DataStream
+        """
+        def partition_iter():
+            for row in function(iter(self)):
+                yield row
+        return self.Stream(partition_iter())
 
     def concat(self):
         """ Alias for :py:func:`chain`
@@ -164,19 +342,45 @@ class DataStream(object):
         """
         return self.Stream(self, predicate=filter_fn)
 
-    def filters(self, filter_fns):
-        """ Apply a list of filter functions
+    def filters(self, filter_fns, adaptive=False, sample_size=1000, resample_interval=100000):
+        """ Apply a list of filter functions, stopping at the first one that fails
 
         >>> evens_less_than_six = [lambda n: n < 6, lambda n: n % 2 == 0]
         >>> DataStream(range(10)).filters(evens_less_than_six).to_list()
         ... [0, 2, 4]
 
+        With ``adaptive=True`` the filters are timed over the first ``sample_size`` rows (and again every
+        ``resample_interval`` rows), and reordered so cheap, selective filters run first, so they should be
+        independent of each other; see :py:class:`AdaptiveFilter` for filters guarded by others.  Stats are available
+        through :py:func:`filter_stats` on the returned stream:
+
+        >>> filtered = DataStream(range(10000)).filters(evens_less_than_six, adaptive=True, sample_size=100)
+        >>> filtered.execute()
+        >>> filtered.filter_stats()
+        ... [FilterStats(index=0, calls=100, passed=6, pass_rate=0.06, cost=2.1e-07), ...]
+
         :param list[function] filter_fns: list of filter functions
+        :param bool adaptive: reorder filters based on measured selectivity and cost
+        :param int sample_size: number of rows to measure each filter over
+        :param int resample_interval: number of rows between measurements
         :rtype: DataStream
         """
-        predicate = lambda row: all([pred(row) for pred in filter_fns])
+        if adaptive:
+            predicate = AdaptiveFilter(filter_fns, sample_size, resample_interval)
+        else:
+            filter_fns = list(filter_fns)
+            predicate = lambda row: all(pred(row) for pred in filter_fns)
         return self.Stream(self, predicate=predicate)
 
+    def filter_stats(self):
+        """ Returns measured stats for a stream created with ``filters(..., adaptive=True)``, in current run order
+
+        :rtype: list[FilterStats]
+        """
+        if not isinstance(self._predicate, AdaptiveFilter):
+            raise ValueError("filter_stats is only available on streams created with filters(..., adaptive=True)")
+        return self._predicate.stats()
+
     def filter_method(self, method, *args, **kwargs):
         """ Filters using a method of the stream row using passed in args/kwargs
 
@@ -186,28 +390,60 @@ class DataStream(object):
         :param str method: name of method to be called
         :rtype: DataStream
         """
-        return self.filter(lambda row: self.getattr(row, method)(*args, **kwargs))
+        return self.filter(self.methodcaller(method, *args, **kwargs))
 
-    def set(self, name, transfer_func=None, value=None):
+    def set(self, name, transfer_func=None, value=None, inplace=False):
         """ Sets the named attribute of each row in the stream using the supplied function
 
         :param  name: attribute name
         :param transfer_func: function that takes the row and returns the value to be stored at the named attribute
+        :param value: value to be stored at the named attribute if ``transfer_func`` isn't given
+        :param bool inplace: modify rows instead of copying them, for pipelines that own their rows
         :rtype: DataStream
         """
-        if transfer_func is not None:
+        set_attr = self.setattr
+        if transfer_func is None:
+            transfer_func = lambda row: value
+        if inplace:
             def row_setattr(row):
-                new_row = copy(row)
-                self.setattr(new_row, name, transfer_func(row))
-                return new_row
+                set_attr(row, name, transfer_func(row))
+                return row
         else:
             def row_setattr(row):
                 new_row = copy(row)
-                self.setattr(new_row, name, value)
+                set_attr(new_row, name, transfer_func(row))
                 return new_row
 
         return self.map(row_setattr)
 
+    def assign(self, transfer_funcs=None, inplace=False, **more_transfer_funcs):
+        """ Sets several attributes of each row at once.  Every function is called with the original row, and the
+        row is copied once (or not at all with ``inplace=True``), unlike chained calls to :py:func:`set`.
+
+        >>> DataStream(users).assign(first_name=lambda user: user.name.split(' ')[0],
+        ...                          age=lambda user: datetime.now() - user.birthday).to_list()
+        ... [User(name='Amy Smith', first_name='Amy', age=datetime.timedelta(10957)), ...]
+        >>> DataStream(orders).assign({'inplace': lambda order: order.warehouse == 'local'}).to_list()
+        ... [Order(id=1, warehouse='local', inplace=True), ...]
+
+        :param dict transfer_funcs: functions that take the row and return the value to be stored at their key, for
+            any attribute name, including ``inplace``
+        :param bool inplace: modify rows instead of copying them, for pipelines that own their rows
+        :param more_transfer_funcs: functions that take the row and return the value to be stored at the keyword's name
+        :rtype: DataStream
+        """
+        set_attr = self.setattr
+        transfer_funcs = list(dict(transfer_funcs or {}, **more_transfer_funcs).items())
+
+        def row_assign(row):
+            values = [(name, transfer_func(row)) for name, transfer_func in transfer_funcs]
+            new_row = row if inplace else copy(row)
+            for name, value in values:
+                set_attr(new_row, name, value)
+            return new_row
+
+        return self.map(row_assign)
+
     def get(self, name, default=None):
         """ Gets the named attribute of each row in the stream
 
@@ -219,14 +455,17 @@ class DataStream(object):
         :param default: default value to use if attr name not found in row
         :rtype: DataStream
         """
-        def row_getattr(row):
-            return self.getattr(row, name) if self.hasattr(row, name) else default
-        return self.map(row_getattr)
+        return self.map(self.attrgetter(name, default))
+
+    def delete(self, attr, inplace=False):
+        """ Deletes the named attribute for each row in the stream
 
-    def delete(self, attr):
-        """ Deletes the named attribute for each row in the stream """
+        :param str attr: attribute name
+        :param bool inplace: modify rows instead of copying them, for pipelines that own their rows
+        :rtype: DataStream
+        """
         def obj_del(row):
-            new_row = copy(row)
+            new_row = row if inplace else copy(row)
             delattr(new_row, attr)
             return new_row
         return self.map(obj_del)
@@ -249,6 +488,32 @@ class DataStream(object):
             return row
         return self.map(apply_fn)
 
+    def sink_batches(self, write_fn, batch_size=1000, max_latency=None, max_pending=4):
+        """ Hands rows to ``write_fn`` in batches on a background thread, passing rows through like
+        :py:func:`for_each`.  Bulk writes replace one write per row, and run while upstream work continues.  Once the
+        stream is exhausted, the last batch is written and any error from ``write_fn`` is raised.
+
+        >>> DataStream(users).sink_batches(User.objects.bulk_create, batch_size=500).execute()
+        ... ExecutionStats(rows=12000, elapsed=0.84)
+
+        :param function write_fn: called with a list of rows for each batch
+        :param int batch_size: number of rows in each batch
+        :param float max_latency: seconds after which a partial batch is written even if no more rows arrive
+        :param int max_pending: number of full batches that may wait to be written before the stream blocks
+        :rtype: DataStream
+        """
+        def sink_iter():
+            writer = BatchWriter(write_fn, batch_size, max_latency, max_pending)
+            completed = False
+            try:
+                for row in self:
+                    writer.add(row)
+                    yield row
+                completed = True
+            finally:
+                writer.close(raise_errors=completed)
+        return self.Stream(sink_iter())
+
     def print_each(self):
         def printer(row):
             print(row)
@@ -274,7 +539,7 @@ class DataStream(object):
         :param int n: number of rows to be taken
         :rtype: DataSet
         """
-        return self.Set([next(self) for _ in range(n)])
+        return self.Set(list(islice(self, n)))
 
     def drop(self, n):
         """ Drops n rows from the stream
@@ -309,16 +574,20 @@ class DataStream(object):
         return self.map(constructor).collect()
 
     def execute(self):
-        """ Evaluates the stream (nothing happens until a stream is evaluted)
+        """ Evaluates the stream (nothing happens until a stream is evaluted), without keeping any rows in memory
 
         >>> from pprint import pprint
         >>> DataStream(range(3)).for_each(pprint).execute()
         ... 0
         ... 1
         ... 2
-        ... <datastreams.DataStream at 0x7f6995ea4790>
+        ... ExecutionStats(rows=3, elapsed=4.1e-05)
+
+        :rtype: ExecutionStats
         """
-        list(self)
+        started = clock()
+        rows = self.count()
+        return ExecutionStats(rows=rows, elapsed=clock() - started)
 
     def count(self):
         """ Counts the number of rows in this stream.  This will exhaust a stream!
@@ -328,24 +597,137 @@ class DataStream(object):
 
         :rtype: int
         """
-        count = 0
-        for _ in self:
-            count += 1
-        return count
+        # zip pulls from the stream first, so the counter is only advanced for rows that exist
+        counter = count()
+        deque(izip(self, counter), maxlen=0)
+        return next(counter)
 
-    def batch(self, batch_size):
+    def batch(self, batch_size, max_wait=None):
         """ Batches rows of a stream in a given chunk size
 
         >>> DataStream(range(10)).batch(2).to_list()
         ... [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]]
 
+        With ``max_wait``, rows are read on a background thread, and a batch is emitted once it is full or
+        ``max_wait`` seconds after its first row arrived, whichever comes first.  This keeps latency bounded for
+        slow, live sources:
+
+        >>> DataStream(rsvp_source()).batch(500, max_wait=1.0).for_each(save_rsvps).execute()
+
         :param int batch_size: size of each batch
+        :param float max_wait: longest time in seconds a row may wait for its batch to fill
+        :rtype: DataStream
+        """
+        if max_wait is None:
+            return self.window(batch_size, batch_size)
+
+        def batch_iter():
+            reader = BackgroundReader(self, max_pending=batch_size * 2)
+            try:
+                while True:
+                    batch = reader.get_chunk()
+                    if batch is None:
+                        return
+                    deadline = clock() + max_wait
+                    while len(batch) < batch_size:
+                        remaining = deadline - clock()
+                        if remaining <= 0:
+                            break
+                        try:
+                            chunk = reader.get_chunk(remaining)
+                        except Empty:
+                            break
+                        if chunk is None:
+                            break
+                        batch.extend(chunk)
+                    yield self.Set(batch)
+            finally:
+                reader.close()
+        return self.Stream(batch_iter())
+
+    def prefetch(self, rows=1000, chunk_size=100):
+        """ Reads the stream so far on a background thread, up to ``rows`` rows ahead of whatever consumes it, so
+        reading from disk or the network overlaps with downstream work.  Errors upstream are raised downstream, and
+        the thread stops once the stream is exhausted or dropped.
+
+        >>> DataStream.from_files('events-*.jsonl.gz').prefetch(10000).map(expensive_parse).to_file('parsed.txt')
+        ... ['parsed.txt']
+
+        Rows are handed over ``chunk_size`` at a time, so use a small chunk size for slow, live sources.  On a
+        :py:func:`batch` ed stream, ``rows`` counts batches.
+
+        :param int rows: number of rows that may be read ahead
+        :param int chunk_size: number of rows handed over at a time
         :rtype: DataStream
         """
-        return self.window(batch_size, batch_size)
+        chunk_size = max(1, min(chunk_size, rows))
+
+        def prefetch_iter():
+            reader = BackgroundReader(self, max_pending=max(1, rows // chunk_size), chunk_size=chunk_size)
+            try:
+                for row in reader:
+                    yield row
+            finally:
+                reader.close()
+        return self.Stream(prefetch_iter())
+
+    def stage(self, workers=1, kind='thread', batch_size=100, max_pending=None, ordered=True, transport='frames'):
+        """ Starts a pipeline stage: the ``map`` s and ``filter`` s chained after it run on ``workers`` threads or
+        processes, in batches of ``batch_size`` rows, until the next stage or any other operation.  Stages run at the
+        same time, connected by bounded queues, so a pipeline is as fast as its slowest stage rather than the sum of
+        them, and a slow stage holds back the ones before it.
+
+        >>> parsed = DataStream.from_file('events.log').stage(workers=4, kind='process').map(parse).filter(is_valid)
+        >>> enriched = parsed.stage(workers=16).map(enrich_from_api)
+        >>> enriched.stage(workers=2, kind='process').map(score).to_jsonl('scored.jsonl')
+        ... ['scored.jsonl']
+
+        Process stages fork, so their functions can be lambdas and closures, but rows are serialized on the way in and
+        out; thread stages suit I/O bound steps, and functions that release the GIL.  For rows holding large buffers,
+        like arrays, images or big ``bytes``, ``transport='shared_memory'`` passes the buffers through memory-mapped
+        arenas instead of pickling them through a pipe.
+
+        :param int workers: number of threads or processes running the stage
+        :param str kind: ``thread`` or ``process``
+        :param int batch_size: rows handed to a worker at a time
+        :param int max_pending: batches that may wait for and after the workers, ``workers * 2`` by default
+        :param bool ordered: keep rows in order, rather than yielding batches as soon as they're done
+        :param str transport: how process stages pass rows, ``frames`` of the binary format, or ``shared_memory``
+        :rtype: DataStream
+        """
+        # stages of sets stream their results, so they're stages of the set's stream class
+        return stage_class(type(self.Stream([])))(self, workers, kind, batch_size, max_pending, ordered, transport)
+
+    def remote(self, workers, batch_size=1000, max_pending=None, ordered=True, retries=3, authkey=None, timeout=None):
+        """ Starts a stage run by remote workers: the ``map`` s and ``filter`` s chained after it are sent to workers
+        on other machines, started with ``python -m datastreams.worker``, which are sent this stream's rows in
+        batches of ``batch_size`` and send back their results.  Like :py:func:`stage`, any other operation ends it.
+
+        >>> workers = ['10.0.0.5:7370', '10.0.0.6:7370', '10.0.0.6:7370']
+        >>> DataStream.from_file('pages.txt').remote(workers, authkey='secret').map(render).to_file('rendered.txt')
+        ... ['rendered.txt']
+
+        Each address gets one connection, handled by a process of its own on the worker, so list a worker more than
+        once to run more of its cores.  A batch whose worker fails or hangs up is retried on another connection.
+        Functions are sent with ``cloudpickle`` if it's installed, so they can be lambdas and closures; otherwise they
+        must be importable by the workers.
+
+        :param list workers: worker addresses, as ``(host, port)`` or ``'host:port'``
+        :param int batch_size: rows sent to a worker at a time
+        :param int max_pending: batches that may wait for the workers, two per address by default
+        :param bool ordered: keep rows in order, rather than yielding batches as soon as they're done
+        :param int retries: times a batch is retried, and failures in a row before a worker is given up on
+        :param authkey: key the workers were started with
+        :param float timeout: seconds to wait for a worker to connect or reply before retrying its batch elsewhere,
+            forever by default
+        :rtype: DataStream
+        """
+        return remote_class(type(self.Stream([])))(self, workers, batch_size, max_pending, ordered, retries, authkey,
+                                                   timeout)
 
     def window(self, length, interval):
-        """ Windows the rows of a stream in a given length and interval
+        """ Windows the rows of a stream in a given length and interval.  Windows are :py:class:`DataSet` s viewing a
+        shared buffer, so emitting a window doesn't copy its rows.
 
         >>> DataStream(range(5)).window(3, 2).to_list()
         ... [DataSet([0, 1, 2]), DataSet([2, 3, 4])]
@@ -354,24 +736,93 @@ class DataStream(object):
         :param int interval: distance between windows
         :rtype: DataStream
         """
-        queue = deque(maxlen=length)
-
         def window_iter():
-            queue.extend(self.take_now(length))
-            yield self.Set(queue)
-            while True:
-                for _ in range(interval):
-                    queue.popleft()
-                try:
-                    for _ in range(interval):
-                        queue.append(next(self))
-                    yield self.Set(queue)
-                except StopIteration:
-                    if len(queue) != 0:
-                        yield self.Set(queue)
+            rows = iter(self)
+            buffer = list(islice(rows, length))
+            start = 0
+            while len(buffer) > start:
+                yield self.Set(ListView(buffer, start, min(length, len(buffer) - start)))
+                if len(buffer) - start < length:
                     break
+                start += interval
+                if start >= length:
+                    # emitted windows still share this buffer, so start a new one rather than trimming it
+                    if start > len(buffer):
+                        deque(islice(rows, start - len(buffer)), maxlen=0)
+                    buffer = buffer[start:]
+                    start = 0
+                buffer.extend(islice(rows, start + length - len(buffer)))
         return self.Stream(window_iter())
 
+    def time_window(self, ts_fn, size, slide=None, key_fn=None, allowed_lateness=0, late_fn=None):
+        """ Groups rows into tumbling or sliding windows by event time, emitting a :py:class:`TimeWindow` of
+        ``(key, start, end, rows)`` as soon as the watermark (the latest timestamp seen minus ``allowed_lateness``)
+        passes the window's end.  Only open windows are kept in memory, so this works on endless streams.
+
+        >>> events = DataStream([(1, 'a'), (3, 'b'), (2, 'c'), (11, 'd')])
+        >>> events.time_window(lambda event: event[0], 10).to_list()
+        ... [TimeWindow(key=None, start=0, end=10, rows=DataSet([(1, 'a'), (3, 'b'), (2, 'c')])), TimeWindow(key=None, start=10, end=20, rows=DataSet([(11, 'd')]))]
+
+        :param function ts_fn: function that returns a numeric timestamp (like epoch seconds) for a row
+        :param size: length of each window
+        :param slide: distance between window starts, defaults to ``size`` (tumbling windows)
+        :param function key_fn: function returning a hashable value, to window each key separately
+        :param allowed_lateness: how far behind the latest timestamp rows may arrive and still be windowed
+        :param function late_fn: called with rows that arrive after all of their windows were emitted
+        :rtype: DataStream
+        """
+        return self.Stream(iter_time_windows(self, ts_fn, size, slide or size, key_fn, allowed_lateness, late_fn,
+                                             collect=self.Set))
+
+    def session_window(self, ts_fn, gap, key_fn=None, allowed_lateness=0, late_fn=None):
+        """ Groups rows into sessions by event time, where a session ends after ``gap`` passes without rows for its
+        key.  Sessions are emitted as :py:class:`TimeWindow` s once the watermark passes their last timestamp
+        plus ``gap``.
+
+        >>> clicks = DataStream([('amy', 1), ('bob', 2), ('amy', 4), ('amy', 20), ('bob', 30)])
+        >>> clicks.session_window(lambda click: click[1], 5, key_fn=lambda click: click[0]).to_list()
+        ... [TimeWindow(key='bob', start=2, end=7, rows=...), TimeWindow(key='amy', start=1, end=9, rows=...), ...]
+
+        :param function ts_fn: function that returns a numeric timestamp (like epoch seconds) for a row
+        :param gap: inactivity that ends a session
+        :param function key_fn: function returning a hashable value, to track sessions for each key separately
+        :param allowed_lateness: how far behind the latest timestamp rows may arrive and still be windowed
+        :param function late_fn: called with rows that arrive after their session was emitted
+        :rtype: DataStream
+        """
+        return self.Stream(iter_session_windows(self, ts_fn, gap, key_fn, allowed_lateness, late_fn,
+                                                collect=self.Set))
+
+    def rolling(self, length, agg='mean', key_fn=identity, min_periods=None):
+        """ Computes an aggregate over a sliding window of the last ``length`` rows, emitting a result for each row.
+        Aggregates are updated as rows enter and leave the window, so each row costs O(1) however long the window is.
+
+        >>> DataStream([1, 2, 3, 4, 5]).rolling(3, 'mean').to_list()
+        ... [2.0, 3.0, 4.0]
+
+        :param int length: number of rows in the window
+        :param agg: ``count``, ``sum``, ``mean``, ``var``, ``std``, ``min``, ``max``, or a factory for a :py:class:`RollingAggregator`
+        :param function key_fn: function that selects the value to be aggregated from each row
+        :param int min_periods: number of rows needed before results are emitted, defaults to ``length``
+        :rtype: DataStream
+        """
+        if min_periods is None:
+            min_periods = length
+
+        def rolling_iter():
+            aggregator = make_aggregator(agg)
+            add, remove, result = aggregator.add, aggregator.remove, aggregator.result
+            values = deque()
+            for row in self:
+                value = key_fn(row)
+                values.append(value)
+                add(value)
+                if len(values) > length:
+                    remove(values.popleft())
+                if len(values) >= min_periods:
+                    yield result()
+        return self.Stream(rolling_iter())
+
     def dedupe(self, key_fn=lambda a: a):
         """ Removes duplicates from a stream, returning only unique values.
 
@@ -412,7 +863,7 @@ class DataStream(object):
         :param str key: attribute name to group by
         :rtype: DataSet
         """
-        return self.group_by_fn(lambda row: self.getattr(row, key))
+        return self.group_by_fn(self.attrgetter(key))
 
     def group_by_fn(self, key_fn):
         """ Groups a stream by function, returning a :py:class:`DataSet` of ``(K, tuple(V))``
@@ -429,6 +880,28 @@ class DataStream(object):
             grouper[key_fn(ele)].append(ele)
         return self.Set(grouper.items())
 
+    def aggregate_by(self, key_fn, zero, seq_fn, comb_fn):
+        """ Aggregates rows by key, returning a :py:class:`DataSet` of ``(K, aggregate)``.  Each key's aggregate
+        starts as a copy of ``zero``, and ``seq_fn(aggregate, row)`` folds in its rows; partitioned streams fold each
+        partition separately and merge the results with ``comb_fn(aggregate, aggregate)``.
+
+        >>> stream = DataStream(['hi', 'hey', 'yo', 'sup'])
+        >>> stream.aggregate_by(len, 0, lambda total, word: total + 1, lambda a, b: a + b).to_dict()
+        ... {2: 2, 3: 2}
+
+        :param function key_fn: key function returning hashable value to aggregate by
+        :param zero: initial aggregate of each key
+        :param function seq_fn: function adding a row to an aggregate
+        :param function comb_fn: function merging two aggregates
+        :rtype: DataSet
+        """
+        aggregates = {}
+        for row in self:
+            key = key_fn(row)
+            aggregate = aggregates[key] if key in aggregates else deepcopy(zero)
+            aggregates[key] = seq_fn(aggregate, row)
+        return self.Set(aggregates.items())
+
     def to(self, constructor):
         return constructor(self)
 
@@ -441,7 +914,7 @@ class DataStream(object):
 
         :rtype: dict
         """
-        return dict(self.collect())
+        return dict(self)
 
     def to_list(self):
         """ Converts a stream to a :py:class:`list`
@@ -451,7 +924,7 @@ class DataStream(object):
 
         :rtype: list
         """
-        return list(self.collect())
+        return list(self)
 
     def to_set(self):
         """ Converts a stream to a :py:class:`set`
@@ -461,11 +934,34 @@ class DataStream(object):
 
         :rtype: set
         """
-        return set(self.collect())
+        return set(self)
+
+    def pipe_to_stdout(self, linesep='', encoding=None, chunk_rows=1000):
+        """ Pipes stream to stdout, writing ``chunk_rows`` rows at a time through its binary buffer and flushing after
+        each chunk.  Text rows are encoded, bytes are written as is, and anything else is converted with ``str``.
 
-    def pipe_to_stdout(self):
-        """ Pipes stream to stdout using ``sys.stdout.write`` """
-        map(sys.stdout.write, self)
+        >>> DataStream.from_stdin(mode='bytes').filter(lambda line: b'ERROR' in line).pipe_to_stdout()
+        ... ExecutionStats(rows=112, elapsed=0.02)
+
+        :param str linesep: written after each row, nothing by default since lines from :py:func:`from_stdin` keep
+            their newlines
+        :param str encoding: encoding for text rows, defaults to stdout's
+        :param int chunk_rows: number of rows written at a time
+        :rtype: ExecutionStats
+        """
+        started = clock()
+        encoding = encoding or getattr(sys.stdout, 'encoding', None) or 'utf-8'
+        sys.stdout.flush()
+        target = getattr(sys.stdout, 'buffer', None)
+        if target is None:
+            rows = 0
+            for chunk in self.batch(chunk_rows):
+                sys.stdout.write(encode_lines(chunk, encoding, linesep).decode(encoding))
+                sys.stdout.flush()
+                rows += len(chunk)
+        else:
+            rows = write_lines(target, self, encoding, linesep, chunk_rows)
+        return ExecutionStats(rows=rows, elapsed=clock() - started)
 
     def count_frequency(self):
         """ Counts frequency of each row in the stream
@@ -479,7 +975,7 @@ class DataStream(object):
 
     @staticmethod
     def join_objects(left, right):
-        joined_class = type(left.__class__.__name__ + right.__class__.__name__, (Datum,), {})
+        joined_class = joined_datum_class(left.__class__.__name__ + right.__class__.__name__)
         attrs = {}
         attrs.update(get_object_attrs(right))
         attrs.update(get_object_attrs(left))
@@ -536,7 +1032,7 @@ class DataStream(object):
         :param str key: attribute name to join on
         :rtype: DataSet
         """
-        key_fn = lambda ele: self.getattr(ele, key)
+        key_fn = self.attrgetter(key)
         return self.left_join_by(key_fn, key_fn, right)
 
     def left_join_by(self, left_key_fn, right_key_fn, right):
@@ -564,7 +1060,7 @@ class DataStream(object):
         :param str key: attribute name to join on
         :rtype: DataSet
         """
-        key_fn = lambda ele: self.getattr(ele, key)
+        key_fn = self.attrgetter(key)
         return self.right_join_by(key_fn, key_fn, right)
 
     def right_join_by(self, left_key_fn, right_key_fn, right):
@@ -591,7 +1087,7 @@ class DataStream(object):
         :param str key: attribute name to join on
         :rtype: DataSet
         """
-        key_fn = lambda ele: self.getattr(ele, key)
+        key_fn = self.attrgetter(key)
         return self.inner_join_by(key_fn, key_fn, right)
 
     def inner_join_by(self, left_key_fn, right_key_fn, right):
@@ -618,7 +1114,7 @@ class DataStream(object):
         :param str key: attribute name to join on
         :rtype: DataSet
         """
-        key_fn = lambda ele: self.getattr(ele, key)
+        key_fn = self.attrgetter(key)
         return self.outer_join_by(key_fn, key_fn, right)
 
     def outer_join_by(self, left_key_fn, right_key_fn, right):
@@ -655,8 +1151,10 @@ class DataStream(object):
         :param list[str] attr_names: list of attribute names to keep
         :rtype: DataStream
         """
+        getters = [(name, self.attrgetter(name)) for name in attr_names]
+
         def attr_filter(row):
-            return Datum(dict((name, self.getattr(row, name)) for name in attr_names))
+            return Datum([(name, get(row)) for name, get in getters])
         return self.map(attr_filter)
 
     def where(self, name=Nothing):
@@ -681,46 +1179,111 @@ class DataStream(object):
     def hasattr(row, name):
         return hasattr(row, name)
 
+    @staticmethod
+    def attrgetter(name, default=Nothing):
+        """ Builds a function that gets the named attribute of a row, equivalent to ``getattr(row, name)``.
+        Built once per stage, so rows don't pay for a name lookup on every call.
+
+        :param str name: attribute name, or :py:class:`Nothing` for the row itself
+        :param default: value to return when the row has no such attribute, raises if not given
+        :rtype: function
+        """
+        if name is Nothing:
+            return identity
+        if default is Nothing:
+            return attrgetter(name)
+        return lambda row: getattr(row, name, default)
+
+    @staticmethod
+    def methodcaller(name, *args, **kwargs):
+        """ Builds a function that calls the named method of a row with the given args/kwargs
+
+        :param str name: method name
+        :rtype: function
+        """
+        return methodcaller(name, *args, **kwargs)
+
     @staticmethod
     def setattr(row, name, value):
         setattr(row, name, value)
 
     @classmethod
-    def from_file(cls, path):
-        """ Stream lines from a file
+    def from_file(cls, path, compression='infer', encoding=None, mode='text', offset=0):
+        """ Stream lines from a file.  Compressed files are detected by extension or their first bytes, and
+        decompressed on a background thread.
 
-        >>> DataStream.from_file('hamlet.txt').concat_map(str.split).take(7)
+        >>> DataStream.from_file('hamlet.txt.gz').concat_map(str.split).take(7)
         ... ['The', 'Tragedy', 'of', 'Hamlet,', 'Prince', 'of', 'Denmark']
 
+        In ``bytes`` and ``memoryview`` modes, lines aren't decoded, and uncompressed files are memory mapped rather
+        than read, which makes filtering before decoding much cheaper:
+
+        >>> DataStream.from_file('server.log', mode='bytes').filter(lambda line: b'ERROR' in line).decode().take(1)
+        ... ['2016-02-11 12:00:01 ERROR disk full\\n']
+
         :param str path: path to file to be streamed
+        :param str compression: ``gzip``, ``bz2``, ``xz``, ``zstd`` (needs ``zstandard``), ``None``, or ``infer``
+        :param str encoding: text encoding, defaults to the platform's like :py:func:`open`
+        :param str mode: ``text`` for ``str`` lines, ``bytes`` for ``bytes`` lines, or ``memoryview`` for zero-copy
+            views of an uncompressed file
+        :param int offset: byte offset to start streaming from, for uncompressed files
         :rtype: DataStream
         """
-        return cls.Stream(cls.iter_file(path))
+        return cls.Stream(cls.iter_file(path, compression, encoding, mode, offset))
 
     @classmethod
-    def from_files(cls, paths):
-        return cls.Stream(cls.iter_files(paths))
+    def from_files(cls, paths, compression='infer', encoding=None, mode='text', parallel=None, ordered=False,
+                   max_pending=16):
+        """ Stream lines from several files.  Paths may be glob patterns, which stream their matches in sorted order.
+        By default files are read one after another; with ``parallel``, that many are read at once on background
+        threads, which helps when reading many small or compressed files.  See :py:func:`from_file`.
+
+        >>> DataStream.from_files('logs/*.log.gz', parallel=4).filter(lambda line: 'ERROR' in line).count()
+        ... 112
+
+        :param list[str] paths: paths or glob patterns of files to be streamed
+        :param int parallel: number of files read at once, or ``None`` to read them one after another
+        :param bool ordered: when reading in parallel, stream each file's lines together and in path order, instead
+            of as soon as they're read
+        :param int max_pending: chunks of lines each parallel reader may read ahead
+        :rtype: DataStream
+        """
+        return cls.Stream(cls.iter_files(paths, compression, encoding, mode, parallel, ordered, max_pending))
 
     @staticmethod
-    def iter_files(paths):
-        for path in paths:
-            source_file = open(path)
-            for line in source_file:
-                yield line
-            source_file.close()
-        raise StopIteration
+    def iter_files(paths, compression='infer', encoding=None, mode='text', parallel=None, ordered=False,
+                   max_pending=16):
+        return iter_files(paths, compression, encoding, mode, parallel, ordered, max_pending=max_pending)
 
     @staticmethod
-    def iter_file(path):
-        source_file = open(path)
-        for line in source_file:
-            yield line
-        source_file.close()
-        raise StopIteration
+    def iter_file(path, compression='infer', encoding=None, mode='text', offset=0):
+        return iter_lines(path, compression, encoding, mode, offset)
+
+    @classmethod
+    def follow(cls, path, poll_interval=1.0, from_end=True, offset_path=None, mode='text', encoding='utf-8',
+               idle_timeout=None):
+        """ Stream lines from a file as it grows, like ``tail -F``, following it through rotation and truncation.
+        With ``offset_path``, the position of the next unprocessed line is saved, so a restarted pipeline picks up
+        where the last one stopped.
+
+        >>> errors = DataStream.follow('app.log', offset_path='app.log.offset').filter(lambda line: 'ERROR' in line)
+        >>> errors.for_each(send_alert).execute()
+
+        :param str path: path to file to be followed
+        :param float poll_interval: seconds to wait before checking the file again once it's caught up with
+        :param bool from_end: skip the lines already in the file, unless resuming from ``offset_path``
+        :param str offset_path: path to save the file's inode and offset at
+        :param str mode: ``text`` for ``str`` lines, or ``bytes``
+        :param str encoding: text encoding
+        :param float idle_timeout: stop after this many seconds without new lines, or ``None`` to follow forever
+        :rtype: DataStream
+        """
+        return cls.Stream(follow_lines(path, poll_interval, from_end, offset_path, mode, encoding,
+                                       idle_timeout=idle_timeout))
 
     @classmethod
-    def from_csv(cls, path, headers=None, constructor=Datum):
-        """ Stream rows from a csv file
+    def from_csv(cls, path, headers=None, constructor=Datum, compression='infer', encoding=None):
+        """ Stream rows from a csv file, which may be compressed like in :py:func:`from_file`
 
         >>> DataStream.from_csv('payments.csv').to_list()
         ... [Datum({'name': 'joe', 'charge': 174.93}), Datum({'name': 'sally', 'charge': 198.05}), ...]
@@ -728,9 +1291,11 @@ class DataStream(object):
         :param str path: path to csv to be streamed
         :param list[str] headers: manual names for headers - if present, first row is pulled in as data, if ``None``, first row is used as headers
         :param constructor: class or function to construct for each row
+        :param str compression: ``gzip``, ``bz2``, ``xz``, ``zstd`` (needs ``zstandard``), ``None``, or ``infer``
+        :param str encoding: text encoding, defaults to the platform's like :py:func:`open`
         :rtype: DataStream
         """
-        source_file = open(path)
+        source_file = open_text(path, compression, encoding)
         if headers is None:
             headers = [h.strip() for h in source_file.readline().split(",")]
         reader = cls.iter_csv(source_file)
@@ -738,157 +1303,440 @@ class DataStream(object):
 
     @staticmethod
     def iter_csv(source_file):
-        reader = csv.reader(source_file)
-        for row in reader:
-            yield row
-        source_file.close()
-        raise StopIteration
+        try:
+            for row in csv.reader(source_file):
+                yield row
+        finally:
+            source_file.close()
+
+    @classmethod
+    def from_jsonl(cls, source, record=Datum, fields=None, backend='auto', chunk_size=1000, compression='infer'):
+        """ Stream records from JSON lines, decoding ``chunk_size`` lines at a time.  Uses ``orjson`` or ``ujson``
+        when installed, unless ``backend`` says otherwise.
+
+        >>> DataStream.from_jsonl('rsvps.jsonl.gz', fields=['member', 'response'], record='slots').take(1)
+        ... [Record(member={'member_id': 42, 'member_name': 'amy'}, response='yes')]
+
+        :param source: path (possibly compressed), file object, or iterable of lines
+        :param record: class or function constructed from each object, or with ``fields``, ``tuple``, ``list``,
+            ``'slots'``, or a constructor taking ``(name, value)`` pairs
+        :param list[str] fields: names of the only fields to keep, missing ones as ``None``
+        :param str backend: ``orjson``, ``ujson``, ``json``, or ``auto`` for the fastest one installed
+        :param int chunk_size: lines decoded at a time, smaller for lower latency on slow sources
+        :param str compression: ``gzip``, ``bz2``, ``xz``, ``zstd``, ``None``, or ``infer`` for paths
+        :rtype: DataStream
+        """
+        return cls.Stream(iter_jsonl(source, record, fields, backend, chunk_size, compression))
+
+    @classmethod
+    def from_binary(cls, source):
+        """ Stream rows from a binary file written by :py:func:`to_binary`
+
+        :param source: path, or binary file object
+        :rtype: DataStream
+        """
+        return cls.Stream(iter_binary(source))
 
     @classmethod
-    def from_stdin(cls):
-        """ Stream rows from stdin
+    def from_stdin(cls, mode='text', encoding=None, keepends=True):
+        """ Stream lines from stdin, reading its binary buffer in large chunks rather than line by line
+
+        >>> DataStream.from_stdin(keepends=False).filter(lambda line: line.strip()).count()
+        ... 3142
 
+        :param str mode: ``text`` for ``str`` lines, or ``bytes`` to skip decoding them
+        :param str encoding: text encoding, defaults to stdin's
+        :param bool keepends: keep the newline at the end of each line
         :rtype: DataStream
         """
-        return cls.Stream(sys.stdin)
+        source = getattr(sys.stdin, 'buffer', None)
+        if source is None:
+            return cls.Stream(sys.stdin if keepends else (line.rstrip('\n') for line in sys.stdin))
+        encoding = encoding or getattr(sys.stdin, 'encoding', None)
+        return cls.Stream(iter_stream_lines(source, mode, encoding, keepends))
+
+    @classmethod
+    def from_sql(cls, connection, query, params=(), fetch_size=1000, record=tuple, cursor_name=None,
+                 partition_column=None, partitions=1, bounds=None, placeholder='?'):
+        """ Stream rows from a SQL query, fetching ``fetch_size`` rows at a time rather than the whole result
+
+        >>> DictStream.from_sql(sqlite3.connect('payments.db'), 'SELECT * FROM payments WHERE charge > ?', (100,),
+        ...                     record=dict).to_list()
+        ... [{'name': 'joe', 'charge': 174.93}, {'name': 'sally', 'charge': 198.05}, ...]
+
+        Given a connection factory, the query can be split into ranges of a numeric column, each read in parallel
+        on its own connection (rows then arrive in no particular order):
+
+        >>> DataStream.from_sql(lambda: sqlite3.connect('payments.db'), 'SELECT * FROM payments',
+        ...                     partition_column='id', partitions=4)
+
+        :param connection: DB-API connection, or function returning a new connection (closed when done)
+        :param str query: query to be run
+        :param params: query parameters, in the driver's paramstyle
+        :param int fetch_size: number of rows fetched per round trip
+        :param record: ``tuple`` for rows as returned by the driver, ``'slots'`` for slotted records, or a constructor taking ``(column, value)`` pairs, like ``dict`` or ``Datum``
+        :param str cursor_name: name for a server-side cursor, for drivers that support them (like psycopg2)
+        :param str partition_column: numeric column used to split the query
+        :param int partitions: number of partitions read in parallel
+        :param tuple bounds: ``(min, max)`` of the partition column, queried if ``None``
+        :param str placeholder: the driver's parameter placeholder, used in partition queries
+        :rtype: DataStream
+        """
+        if partition_column is None or partitions <= 1:
+            return cls.Stream(iter_sql(connection, query, params, fetch_size, record, cursor_name))
+        if hasattr(connection, 'cursor'):
+            raise ValueError("Partitioned queries need a connection factory, so each partition has its own connection")
+
+        def partitioned_iter():
+            queries = partition_queries(connection, query, params, partition_column, partitions, bounds, placeholder)
+            partition_rows = [iter_sql(connection, partition_query, partition_params, fetch_size, record, cursor_name)
+                              for partition_query, partition_params in queries]
+            for row in BackgroundReader.merging(partition_rows, max_pending=2 * partitions, chunk_size=fetch_size):
+                yield row
+        return cls.Stream(partitioned_iter())
+
+    def to_sqlite(self, path, table, columns=None, batch_size=1000, max_pending=4):
+        """ Inserts rows into a sqlite table in batches, using :py:func:`sink_batches`.  Rows can be dicts, objects,
+        namedtuples, or tuples in column order.  The table is created if it doesn't exist.
+
+        >>> DictStream.from_csv('payments.csv').to_sqlite('payments.db', 'payments')
+        ... ExecutionStats(rows=31245, elapsed=0.21)
+
+        :param str path: path to the sqlite database
+        :param str table: name of the table to insert into
+        :param list[str] columns: column names, inferred from the first row if ``None``
+        :param int batch_size: number of rows inserted per transaction
+        :param int max_pending: number of full batches that may wait to be written before the stream blocks
+        :rtype: ExecutionStats
+        """
+        writer = SqliteWriter(path, table, columns)
+        try:
+            return self.sink_batches(writer.write, batch_size, max_pending=max_pending).execute()
+        finally:
+            writer.close()
+
+    def to_file(self, path, compression='infer', compression_level=None, buffer_size=1 << 20, rotate_bytes=None,
+                rotate_rows=None, atomic=True, append=False, encoding='utf-8', linesep=os.linesep, chunk_rows=1000):
+        """ Writes each row to a file as a line.  Rows are encoded in chunks and written through a large buffer, and
+        files are written to a temporary file that is renamed into place once complete.  Text rows are encoded, bytes
+        are written as is, and anything else is converted with ``str``.
+
+        >>> DataStream.from_file('access.log').filter(is_error).to_file('errors.log.gz')
+        ... ['errors.log.gz']
+        >>> DataStream.from_file('access.log').to_file('access-{index:03d}.log.xz', rotate_rows=1000000)
+        ... ['access-000.log.xz', 'access-001.log.xz', 'access-002.log.xz']
+
+        :param str path: path to write to; when rotating, a template with an ``{index}`` field
+        :param str compression: ``gzip``, ``bz2``, ``xz``, ``zstd`` (needs ``zstandard``), ``None``, or ``infer`` to choose by file extension
+        :param int compression_level: level passed to the compressor, or its default if ``None``
+        :param int buffer_size: bytes collected before they are written
+        :param int rotate_bytes: start a new file once this many (uncompressed) bytes were written to the current one
+        :param int rotate_rows: start a new file once this many rows were written to the current one
+        :param bool atomic: write to a temporary file and rename it into place on completion, over a symlink's target
+            and keeping the replaced file's mode; devices and pipes are always written in place
+        :param bool append: append to existing files instead of replacing them (never atomic)
+        :param str encoding: encoding for text rows
+        :param str linesep: appended to each row
+        :param int chunk_rows: number of rows encoded at a time; with ``buffer_size=0``, 1 writes each row as it arrives
+        :return: paths of the files written
+        :rtype: list[str]
+        """
+        sink = FileSink(path, compression, compression_level, buffer_size, rotate_bytes, rotate_rows, atomic, append,
+                        encoding, linesep, chunk_rows)
+        try:
+            sink.write_rows(self)
+        except BaseException:
+            sink.abort()
+            raise
+        return sink.close()
+
+    def to_jsonl(self, path, backend='auto', **file_options):
+        """ Writes each row to a file as a line of JSON.  :py:class:`Datum` s, records and namedtuples are written as
+        objects.
+
+        >>> DataStream.from_jsonl('rsvps.jsonl').filter(lambda rsvp: rsvp.response == 'yes').to_jsonl('yes.jsonl.gz')
+        ... ['yes.jsonl.gz']
+
+        :param str path: path to write to
+        :param str backend: ``orjson``, ``ujson``, ``json``, or ``auto`` for the fastest one installed
+        :param file_options: options for :py:func:`to_file`, like ``compression``, ``rotate_rows`` or ``append``
+        :return: paths of the files written
+        :rtype: list[str]
+        """
+        dumps = json_backend(backend)[1]
+        return self.map(dumps).to_file(path, linesep='\n', **file_options)
+
+    def to_binary(self, target, batch_size=1000, serializer='pickle', compression=None, compression_level=None,
+                  max_pending=4):
+        """ Writes rows to a compact binary file of length-prefixed frames, each holding a batch of serialized rows.
+        Much faster to read back than text or csv, and keeps rows' types.  Slotted records from
+        :py:func:`record_type` are packed as tuples of values, and paths are written to a temporary file that's
+        renamed into place once complete.
+
+        >>> DataStream.from_csv('payments.csv').to_binary('payments.bin', compression='zlib')
+        ... ExecutionStats(rows=31245, elapsed=0.08)
+        >>> DataStream.from_binary('payments.bin').take(1)
+        ... [Datum({'name': 'joe', 'charge': '174.93'})]
+
+        :param target: path, or binary file object to write to
+        :param int batch_size: number of rows per frame
+        :param str serializer: ``pickle`` for any picklable rows, or ``msgpack`` for plain data (needs ``msgpack``)
+        :param str compression: ``zlib``, ``zstd`` (needs ``zstandard``), or ``None``, applied to each frame
+        :param int compression_level: level passed to the compressor, or its default if ``None``
+        :param int max_pending: number of full batches that may wait to be written before the stream blocks
+        :rtype: ExecutionStats
+        """
+        writer = BinaryWriter(target, serializer, compression, compression_level)
+        try:
+            stats = self.sink_batches(writer.write, batch_size, max_pending=max_pending).execute()
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        return stats
+
+    def persist(self, path, batch_size=1000, serializer='pickle', compression=None, compression_level=None,
+                max_pending=4):
+        """ Writes rows to a binary file like :py:func:`to_binary`, with an offset index at its end, returning a
+        :py:class:`PersistentDataSet` of them.  Rows are written as they're streamed, so datasets needn't fit in
+        memory.
+
+        >>> people = DataStream.from_csv('people.csv').persist('people.bin')
+        >>> len(people), people[-1]
+        ... (2000000, Datum({'name': 'zed', 'age': '34'}))
+
+        :param str path: path to write to
+        :param int batch_size: number of rows per frame, the unit read to get at any one row
+        :return: a :py:class:`PersistentDataSet` of the stream's kind of set, like a ``DictSet`` for a ``DictStream``
+        :rtype: PersistentDataSet
+        """
+        writer = IndexedBinaryWriter(path, serializer, compression, compression_level)
+        try:
+            self.sink_batches(writer.write, batch_size, max_pending=max_pending).execute()
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        return persistent_class(type(self.Set([])))(path)
 
     def write_to_file(self, path):
-        with open(path, 'w') as outfile:
-            for row in self:
-                outfile.write(row + os.linesep)
+        """ Writes each row to a file as a line, overwriting it in place.  See :py:func:`to_file` for more options. """
+        self.to_file(path, atomic=False)
 
     def append_to_file(self, path):
-        with open(path, 'a') as outfile:
-            for row in self:
-                outfile.write(row + os.linesep)
+        """ Appends each row to a file as a line.  See :py:func:`to_file` for more options. """
+        self.to_file(path, append=True)
 
 
 class FilterRadix(object):
     def __init__(self, stream, attr_name):
         self._source = stream
         self.attr_name = attr_name
+        self._getter = stream.attrgetter(attr_name)
 
     def eq(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) == value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) == value)
 
     def neq(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) != value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) != value)
 
     def gt(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) > value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) > value)
 
     def gteq(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) >= value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) >= value)
 
     def lt(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) < value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) < value)
 
     def lteq(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) <= value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) <= value)
 
     def is_in(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) in value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) in value)
 
     def not_in(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) not in value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) not in value)
 
     def has_length(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: len(self._source.getattr(row, name)) == value)
+        get = self._getter
+        return self._source.filter(lambda row: len(get(row)) == value)
 
     def shorter_than(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: len(self._source.getattr(row, name)) < value)
+        get = self._getter
+        return self._source.filter(lambda row: len(get(row)) < value)
 
     def longer_than(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: len(self._source.getattr(row, name)) > value)
+        get = self._getter
+        return self._source.filter(lambda row: len(get(row)) > value)
 
     def truthy(self):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name))
+        get = self._getter
+        return self._source.filter(lambda row: get(row))
 
     def falsey(self):
-        name = self.attr_name
-        return self._source.filter(lambda row: not self._source.getattr(row, name))
+        get = self._getter
+        return self._source.filter(lambda row: not get(row))
 
     def isinstance(self, value):
-        name = self.attr_name
+        get = self._getter
         return self._source.filter(
-            lambda row: isinstance(self._source.getattr(row, name), value))
+            lambda row: isinstance(get(row), value))
 
     def notinstance(self, value):
-        name = self.attr_name
+        get = self._getter
         return self._source.filter(
-            lambda row: not isinstance(self._source.getattr(row, name), value))
+            lambda row: not isinstance(get(row), value))
 
     def is_(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) is value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) is value)
 
     def is_not(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name) is not value)
+        get = self._getter
+        return self._source.filter(lambda row: get(row) is not value)
 
     def contains(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: value in self._source.getattr(row, name))
+        get = self._getter
+        return self._source.filter(lambda row: value in get(row))
 
     def doesnt_contain(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: value not in self._source.getattr(row, name))
+        get = self._getter
+        return self._source.filter(lambda row: value not in get(row))
 
     def startswith(self, substring):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name).startswith(substring))
+        get = self._getter
+        return self._source.filter(lambda row: get(row).startswith(substring))
 
     def endswith(self, substring):
-        name = self.attr_name
-        return self._source.filter(lambda row: self._source.getattr(row, name).endswith(substring))
+        get = self._getter
+        return self._source.filter(lambda row: get(row).endswith(substring))
 
     def len_eq(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: len(self._source.getattr(row, name)) == value)
+        get = self._getter
+        return self._source.filter(lambda row: len(get(row)) == value)
 
     def len_gt(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: len(self._source.getattr(row, name)) > value)
+        get = self._getter
+        return self._source.filter(lambda row: len(get(row)) > value)
 
     def len_lt(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: len(self._source.getattr(row, name)) < value)
+        get = self._getter
+        return self._source.filter(lambda row: len(get(row)) < value)
 
     def len_gteq(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: len(self._source.getattr(row, name)) >= value)
+        get = self._getter
+        return self._source.filter(lambda row: len(get(row)) >= value)
 
     def len_lteq(self, value):
-        name = self.attr_name
-        return self._source.filter(lambda row: len(self._source.getattr(row, name)) <= value)
+        get = self._getter
+        return self._source.filter(lambda row: len(get(row)) <= value)
+
+
+class ListView(Sequence):
+    """ Read-only view of part of a list, sharing the list's storage instead of copying it.  Slicing a view returns
+    another view, so slices, reversals and windows cost O(1) no matter how many rows they cover.
+
+    >>> rows = list(range(10))
+    >>> ListView(rows)[2:8:2]
+    ... ListView([2, 4, 6])
+
+    :param list parent: list (or view) to be viewed
+    :param int start: index in parent of the first row
+    :param int length: number of rows in the view, defaults to the rest of the parent
+    :param int step: distance in parent between consecutive rows
+    """
+    __slots__ = ('_parent', '_start', '_length', '_step')
+
+    def __init__(self, parent, start=0, length=None, step=1):
+        if length is None:
+            length = len(parent) - start
+        if isinstance(parent, ListView):
+            start, step = parent._start + start * parent._step, parent._step * step
+            parent = parent._parent
+        self._parent = parent
+        self._start = start
+        self._length = length
+        self._step = step
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._length)
+            if step > 0:
+                length = max(0, (stop - start + step - 1) // step)
+            else:
+                length = max(0, (start - stop - step - 1) // -step)
+            return ListView(self, start, length, step)
+        if item < 0:
+            item += self._length
+        if not 0 <= item < self._length:
+            raise IndexError("ListView index out of range")
+        return self._parent[self._start + item * self._step]
+
+    def __iter__(self):
+        stop = self._start + self._length * self._step
+        return imap(self._parent.__getitem__, xrange(self._start, stop, self._step))
+
+    def __reversed__(self):
+        return iter(self[::-1])
+
+    def __eq__(self, other):
+        if not isinstance(other, (ListView, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in izip(self, other))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, list(self))
 
 
 class DataSet(DataStream):
     """ Like a :py:class:`DataStream`, but with the source cached as a list.  Able to perform tasks that require the whole source, like sorting and reversing.
+
+    Lists and :py:class:`ListView` s are used as the source directly rather than being copied.
     """
 
     def __init__(self, source):
         super(DataSet, self).__init__(source)
-        self._source = list(source)
+        self._source = source if isinstance(source, (list, ListView)) else list(source)
+
+    def __iter__(self):
+        return iter(self._source)
 
     def __len__(self):
         return len(self._source)
 
+    def count(self):
+        return len(self._source)
+
     def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.view()[item]
         return self._source[item]
 
+    def view(self):
+        """ Returns a :py:class:`ListView` of this dataset's rows
+
+        :rtype: ListView
+        """
+        return ListView(self._source)
+
     def __repr__(self):
         head, tail = ', '.join(map(str, self[:5])), ', '.join(map(str, self[-5:]))
         return "{}([{}, ... {}])".format(self.__class__.__name__, head, tail)
@@ -897,7 +1745,7 @@ class DataSet(DataStream):
         return self.__repr__()
 
     def take_now(self, n):
-        return self.Set([self._source[i] for i in range(n)])
+        return self.Set(self.view()[:n])
 
     def apply(self, function):
         """ Apply a function to the whole dataset
@@ -942,7 +1790,7 @@ class DataSet(DataStream):
 
         :rtype: DataSet
         """
-        return self.Stream(element for element in self._source[::-1])
+        return self.Set(self.view()[::-1])
 
     def to_stream(self):
         """ Streams from this dataset
@@ -952,8 +1800,44 @@ class DataSet(DataStream):
         return self.Stream(iter(self))
 
     @classmethod
-    def from_csv(cls, path, headers=None, constructor=Datum):
-        return cls.Set(DataStream.from_csv(path, headers, constructor))
+    def from_csv(cls, path, headers=None, constructor=Datum, compression='infer', encoding=None):
+        return cls.Set(DataStream.from_csv(path, headers, constructor, compression, encoding))
+
+
+class PersistentDataSet(DataSet):
+    """ A :py:class:`DataSet` kept in an indexed binary file written by :py:func:`DataStream.persist`, instead of in
+    memory.  ``len``, indexing, slicing and iteration read the file through a memory map, so datasets can be far
+    larger than memory, and opening one (again, or in another process) reads only its index.
+
+    >>> people = PersistentDataSet('people.bin')
+    >>> people[1000:1002]
+    ... ListView([Datum({'name': 'amy', 'age': '31'}), Datum({'name': 'bob', 'age': '52'})])
+
+    Operations return in-memory streams and sets, like those of any other :py:class:`DataSet`.
+
+    :param str path: path of the file
+    :param int cached_frames: number of decoded frames kept for random access
+    """
+
+    def __init__(self, path, cached_frames=4):
+        self.path = path
+        self._source = MappedRows(path, cached_frames)
+        self._transform = identity
+        self._predicate = lambda row: True
+
+    def close(self):
+        """ Unmaps the file """
+        self._source.close()
+
+
+_persistent_classes = {DataSet: PersistentDataSet}
+
+
+def persistent_class(set_class):
+    """ The :py:class:`PersistentDataSet` subclass for a set class, like ``DictSet`` """
+    if set_class not in _persistent_classes:
+        _persistent_classes[set_class] = type('Persistent' + set_class.__name__, (PersistentDataSet, set_class), {})
+    return _persistent_classes[set_class]
 
 
 def get_object_attrs(obj):
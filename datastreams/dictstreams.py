@@ -1,4 +1,7 @@
 from datastreams import DataStream, DataSet, Nothing
+from .datastreams import identity
+from operator import methodcaller
+from copy import copy
 
 class DictStream(DataStream):
 
@@ -22,13 +25,32 @@ class DictStream(DataStream):
     def hasattr(row, name):
         return name in row
 
+    @staticmethod
+    def attrgetter(name, default=None):
+        if name is Nothing:
+            return identity
+        return methodcaller('get', name, default)
+
+    @staticmethod
+    def methodcaller(name, *args, **kwargs):
+        def call_item(row):
+            return row.get(name)(*args, **kwargs)
+        return call_item
+
     @staticmethod
     def setattr(row, name, value):
         row[name] = value
 
-    def delete(self, key):
-        transform = lambda row: dict((k, v) for k, v in row.items() if k != key)
-        return self.Stream(self, transform=transform)
+    def delete(self, key, inplace=False):
+        def item_del(row):
+            new_row = row if inplace else copy(row)
+            new_row.pop(key, None)
+            return new_row
+        return self.map(item_del)
+
+    @classmethod
+    def from_jsonl(cls, source, record=dict, fields=None, backend='auto', chunk_size=1000, compression='infer'):
+        return super(DictStream, cls).from_jsonl(source, record, fields, backend, chunk_size, compression)
 
     @staticmethod
     def join_objects(left, right):
@@ -0,0 +1,114 @@
+from itertools import islice
+import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+from .records import record_constructor
+from .sources import iter_lines
+
+
+def plain_value(value):
+    """ Converts records JSON can't encode, like :py:class:`Datum` s, slotted records and namedtuples, to dicts """
+    if hasattr(value, '_asdict'):
+        return value._asdict()
+    if hasattr(value, '_fields'):
+        return dict(zip(value._fields, value))
+    if hasattr(value, '__dict__'):
+        return vars(value)
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+def json_backend(backend='auto'):
+    """ Returns ``(loads, dumps)`` for a JSON library: ``orjson``, ``ujson``, ``json``, or ``auto`` for the fastest
+    one installed.  ``dumps`` may return ``bytes`` or ``str``, and writes compact JSON either way.
+    """
+    if backend == 'auto':
+        backend = 'orjson' if orjson is not None else 'ujson' if ujson is not None else 'json'
+    if backend == 'orjson':
+        if orjson is None:
+            raise ValueError("The orjson backend needs the orjson package")
+        return orjson.loads, lambda row: orjson.dumps(row, default=plain_value)
+    if backend == 'ujson':
+        if ujson is None:
+            raise ValueError("The ujson backend needs the ujson package")
+        return ujson.loads, lambda row: ujson.dumps(row, default=plain_value)
+    if backend == 'json':
+        encoder = json.JSONEncoder(separators=(',', ':'), default=plain_value)
+        return json.loads, encoder.encode
+    raise ValueError("Invalid JSON backend: {}, must be orjson, ujson, json or auto".format(backend))
+
+
+def open_lines(source, compression='infer'):
+    """ Lines from a path (read as bytes), a file object (read through its binary buffer, if it has one), or an
+    iterable of ``str`` or ``bytes`` lines
+    """
+    if isinstance(source, str):
+        return iter_lines(source, compression, mode='bytes')
+    return getattr(source, 'buffer', source)
+
+
+def jsonl_record(record, fields):
+    """ Builds a function making a record from a decoded JSON object, picking only ``fields`` if given """
+    if fields is None:
+        if record is dict:
+            return None
+        if record in (tuple, list, 'slots'):
+            raise ValueError("Reading {} records needs a list of fields".format(record))
+        return record
+    constructor = record_constructor(fields, record)
+    fields = list(fields)
+    return lambda obj: constructor([obj.get(field) for field in fields])
+
+
+def iter_jsonl(source, record=dict, fields=None, backend='auto', chunk_size=1000, compression='infer'):
+    """ Decodes JSON lines ``chunk_size`` at a time, each line on its own so a value can't run on from one line into
+    the next.  Blank lines are skipped.
+
+    :param source: path, file object, or iterable of lines
+    :param record: ``dict``, a constructor taking a dict like :py:class:`Datum`, or with ``fields``, ``tuple``,
+        ``list``, ``'slots'``, or a constructor taking ``(name, value)`` pairs
+    :param list[str] fields: names of the only fields to keep, missing ones as ``None``
+    :param str backend: ``orjson``, ``ujson``, ``json``, or ``auto``
+    :param int chunk_size: lines decoded at a time
+    """
+    loads = json_backend(backend)[0]
+    make_record = jsonl_record(record, fields)
+    return _iter_jsonl(loads, make_record, source, chunk_size, compression)
+
+
+def _iter_jsonl(loads, make_record, source, chunk_size, compression):
+    lines = iter(open_lines(source, compression))
+    line_number = 0
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        chunk_start = line_number
+        line_number += len(chunk)
+        try:
+            objects = [loads(line) for line in chunk if line.strip()]
+        except ValueError:
+            objects = decode_lines(loads, chunk, chunk_start)
+        if make_record is not None:
+            objects = map(make_record, objects)
+        for obj in objects:
+            yield obj
+
+
+def decode_lines(loads, lines, first_line=0):
+    """ Decodes lines one at a time, to find which one is invalid """
+    objects = []
+    for line_number, line in enumerate(lines, first_line + 1):
+        if not line.strip():
+            continue
+        try:
+            objects.append(loads(line))
+        except ValueError as error:
+            raise ValueError("Invalid JSON on line {}: {}".format(line_number, error))
+    return objects
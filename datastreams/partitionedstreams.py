@@ -0,0 +1,521 @@
+__author__ = 'stuart'
+
+from bisect import bisect_right
+from copy import deepcopy
+from functools import partial
+from itertools import chain, islice
+import os
+import random
+import shutil
+import tempfile
+try:
+    from itertools import imap, ifilter
+except ImportError:
+    imap, ifilter = map, filter
+try:
+    from collections import defaultdict, Counter
+except ImportError:
+    from backport_collections import defaultdict, Counter
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+from .binary import BinaryWriter, iter_binary
+from .datastreams import DataStream, DataSet
+from .processstreams import fork_context, identity, always
+from .sources import detect_compression, expand_paths, iter_lines, iter_line_range
+
+JOINS = ('left', 'right', 'inner', 'outer')
+
+
+class SpillDirectory(object):
+    """ Temporary directory of spill files, removed once nothing refers to it.  Forked workers inherit it, but only
+    the process that made it removes it.
+    """
+
+    def __init__(self, dir=None):
+        self.path = tempfile.mkdtemp(prefix='datastreams-spill-', dir=dir)
+        self._pid = os.getpid()
+
+    def file(self, *names):
+        return os.path.join(self.path, '-'.join(map(str, names)) + '.bin')
+
+    def __del__(self):
+        if os.getpid() == self._pid:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def open_source(source):
+    """ Rows of a partition's source: a spill file path, or a function returning an iterator """
+    if isinstance(source, str):
+        return iter_binary(source)
+    return source()
+
+
+class Partition(object):
+    """ One partition of a :py:class:`PartitionedStream`: where its rows come from, and the steps applied to them.
+    Sources are grouped in sides, each side's sources read one after the other; ``combine`` turns the sides into
+    rows, like the reduce side of a shuffle or the two sides of a join.
+
+    :param list[list] sides: lists of spill file paths, or of functions returning iterators
+    :param function combine: function taking an iterator per side and returning rows, or ``None`` to chain them
+    :param tuple ops: ``(kind, function)`` steps, kind being ``map``, ``filter``, ``concat_map`` or
+        ``map_partitions``
+    :param tuple spills: :py:class:`SpillDirectory` s the sources are in, kept until the partition is gone
+    """
+
+    def __init__(self, sides, combine=None, ops=(), spills=()):
+        self.sides = sides
+        self.combine = combine
+        self.ops = tuple(ops)
+        self.spills = tuple(spills)
+
+    def then(self, kind, function):
+        return Partition(self.sides, self.combine, self.ops + ((kind, function),), self.spills)
+
+    def __iter__(self):
+        sides = [chain.from_iterable(imap(open_source, side)) for side in self.sides]
+        rows = iter(self.combine(*sides)) if self.combine is not None else chain.from_iterable(sides)
+        for kind, function in self.ops:
+            if kind == 'map':
+                rows = imap(function, rows)
+            elif kind == 'filter':
+                rows = ifilter(function, rows)
+            elif kind == 'map_partitions':
+                rows = iter(function(rows))
+            else:
+                rows = chain.from_iterable(imap(function, rows))
+        return rows
+
+
+_task = None
+
+
+def _run_task(index):
+    return _task(index)
+
+
+def run_tasks(task, count, workers):
+    """ Calls ``task(i)`` for ``i`` in ``range(count)`` on up to ``workers`` forked processes, returning the results
+    in order.  Processes inherit the task rather than having it pickled, so it can be a closure; its results are
+    pickled, so they should be small, like spill file paths.  With one worker, tasks run in this process.
+    """
+    global _task
+    if workers <= 1 or count <= 1:
+        return [task(index) for index in range(count)]
+    _task = task
+    try:
+        pool = fork_context().Pool(min(workers, count))
+    finally:
+        _task = None
+    try:
+        return pool.map(_run_task, range(count), chunksize=1)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def write_buckets(pairs, paths, batch_size=1000):
+    """ Writes ``(bucket, row)`` pairs to the binary spill file at ``paths[bucket]``, ``batch_size`` rows a frame
+
+    :return: the path of each bucket, or ``None`` for buckets without rows
+    :rtype: list[str]
+    """
+    buffers = [[] for _ in paths]
+    files = [None] * len(paths)
+    writers = [None] * len(paths)
+
+    def flush(bucket):
+        if writers[bucket] is None:
+            files[bucket] = open(paths[bucket], 'wb')
+            writers[bucket] = BinaryWriter(files[bucket])
+        writers[bucket].write(buffers[bucket])
+        buffers[bucket] = []
+
+    try:
+        for bucket, row in pairs:
+            buffer = buffers[bucket]
+            buffer.append(row)
+            if len(buffer) >= batch_size:
+                flush(bucket)
+        for bucket, buffer in enumerate(buffers):
+            if buffer:
+                flush(bucket)
+        for writer in writers:
+            if writer is not None:
+                writer.close()
+    finally:
+        for spill_file in files:
+            if spill_file is not None:
+                spill_file.close()
+    return [path if writer is not None else None for path, writer in zip(paths, writers)]
+
+
+def count_rows(rows):
+    counts = Counter(rows)
+    return iter(counts.items())
+
+
+def sum_counts(pairs):
+    counts = defaultdict(int)
+    for row, frequency in pairs:
+        counts[row] += frequency
+    return iter(counts.items())
+
+
+def group_rows(key_fn, rows):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[key_fn(row)].append(row)
+    return iter(groups.items())
+
+
+def merge_groups(pairs):
+    groups = defaultdict(list)
+    for key, rows in pairs:
+        groups[key].extend(rows)
+    return iter(groups.items())
+
+
+def aggregate_rows(key_fn, zero, seq_fn, rows):
+    aggregates = {}
+    for row in rows:
+        key = key_fn(row)
+        aggregates[key] = seq_fn(aggregates[key] if key in aggregates else deepcopy(zero), row)
+    return iter(aggregates.items())
+
+
+def combine_aggregates(comb_fn, pairs):
+    aggregates = {}
+    for key, aggregate in pairs:
+        aggregates[key] = comb_fn(aggregates[key], aggregate) if key in aggregates else aggregate
+    return iter(aggregates.items())
+
+
+def unique_rows(key_fn, rows):
+    seen = set()
+    for row in rows:
+        key = key_fn(row)
+        if key not in seen:
+            seen.add(key)
+            yield row
+
+
+def sorted_rows(key_fn, descending, rows):
+    return sorted(rows, key=key_fn, reverse=descending)
+
+
+def join_sides(how, left_key_fn, right_key_fn, left, right):
+    return DataStream(left).join_by(how, left_key_fn, right_key_fn, DataStream(right))
+
+
+def slice_rows(rows, start, stop):
+    return iter(rows[start:stop])
+
+
+class PartitionedStream(DataStream):
+    """ A :py:class:`DataStream` split into partitions, each run by a local worker process - map-reduce across the
+    cores of one machine, without Spark.  Like :py:class:`RddStream`, ``map``, ``filter`` and ``concat_map`` (and
+    anything built on them) are recorded and applied to each partition by its worker, while ``group_by_fn``,
+    ``count_frequency``, ``dedupe``, joins and ``sort_by`` shuffle rows between partitions through spill files in
+    a temporary directory, combining them on the map side first where they can.
+
+    >>> word_counts = PartitionedStream.from_file('shakespeare_complete.txt', partitions=8)
+    >>> word_counts.concat_map(str.split).count_frequency().sort_by(lambda pair: pair[1]).take(3).to_list()
+    ... [('the', 27361), ('and', 26028), ('i', 20681)]
+
+    Workers are forked, so functions can be lambdas and closures, but rows are pickled between steps and back to
+    this process, and keys are partitioned with :py:func:`hash`, which forked workers share.  Any other operation
+    reads the rows back and carries on as a plain :py:class:`DataStream`.  Row order is kept for lists and files,
+    and by ``sort_by``, but not through shuffles, or for other iterables, which are dealt out to the partitions.
+
+    :param source: rows to partition; sequences are sliced, other iterables spilled to the partitions in batches
+    :param int partitions: number of partitions, ``workers`` by default
+    :param int workers: number of worker processes, the number of CPUs by default
+    :param int batch_size: rows written to spill files at a time
+    :param str spill_dir: directory for spill files, the system's temporary directory by default
+    """
+
+    def __init__(self, source, partitions=None, workers=None, batch_size=1000, spill_dir=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.partitions = partitions or self.workers
+        self.batch_size = batch_size
+        self.spill_dir = spill_dir
+        self._partitions = self._split(source)
+        self._rows = None
+        self._transform = identity
+        self._predicate = always
+
+    def _split(self, source):
+        if isinstance(source, PartitionedStream):
+            return source._partitions
+        if isinstance(source, DataSet):
+            source = source._source
+        n = self.partitions
+        if isinstance(source, Sequence):
+            size = len(source)
+            return [Partition([[partial(slice_rows, source, size * i // n, size * (i + 1) // n)]]) for i in range(n)]
+        spill = SpillDirectory(self.spill_dir)
+        batch_size = self.batch_size
+        pairs = ((i // batch_size % n, row) for i, row in enumerate(source))
+        paths = write_buckets(pairs, [spill.file(i) for i in range(n)], batch_size)
+        return [Partition([[path] if path is not None else []], spills=[spill]) for path in paths]
+
+    def _with_partitions(self, partitions):
+        stream = self.__class__.__new__(self.__class__)
+        stream.workers = self.workers
+        stream.partitions = self.partitions
+        stream.batch_size = self.batch_size
+        stream.spill_dir = self.spill_dir
+        stream._partitions = partitions
+        stream._rows = None
+        stream._transform = identity
+        stream._predicate = always
+        return stream
+
+    def _then(self, kind, function):
+        return self._with_partitions([partition.then(kind, function) for partition in self._partitions])
+
+    def _run(self, task):
+        return run_tasks(task, len(self._partitions), self.workers)
+
+    def _shuffle(self, bucket_fn, buckets, map_side=None):
+        """ Runs the map side of a shuffle: each partition's rows, through ``map_side`` if given, are written to
+        spill files by ``bucket_fn(row)``.
+
+        :return: the spill files of each bucket, and the directory they're in
+        """
+        spill = SpillDirectory(self.spill_dir)
+        batch_size = self.batch_size
+
+        def task(index):
+            rows = iter(self._partitions[index])
+            if map_side is not None:
+                rows = map_side(rows)
+            paths = [spill.file(index, bucket) for bucket in range(buckets)]
+            return write_buckets(((bucket_fn(row), row) for row in rows), paths, batch_size)
+
+        written = self._run(task)
+        return [[paths[bucket] for paths in written if paths[bucket] is not None] for bucket in range(buckets)], spill
+
+    def _hash_shuffle(self, key_fn, map_side=None, combine=None):
+        n = self.partitions
+        sides, spill = self._shuffle(lambda row: hash(key_fn(row)) % n, n, map_side)
+        return self._with_partitions([Partition([side], combine, spills=[spill]) for side in sides])
+
+    @property
+    def _source(self):
+        if self._rows is None:
+            self._rows = self._collect()
+        return self._rows
+
+    def _collect(self):
+        if self.workers <= 1:
+            return chain.from_iterable(self._partitions)
+        spill = SpillDirectory(self.spill_dir)
+        batch_size = self.batch_size
+
+        def task(index):
+            return write_buckets(((0, row) for row in self._partitions[index]), [spill.file(index)], batch_size)[0]
+
+        return self._read_spilled(self._run(task), spill)
+
+    @staticmethod
+    def _read_spilled(paths, spill):
+        # the generator holds on to the spill directory until it's done with
+        for path in paths:
+            if path is not None:
+                for row in iter_binary(path):
+                    yield row
+
+    def __repr__(self):
+        return "{}(partitions={}, workers={})".format(self.__class__.__name__, len(self._partitions), self.workers)
+
+    def map(self, function):
+        return self._then('map', function)
+
+    def filter(self, filter_fn):
+        return self._then('filter', filter_fn)
+
+    def concat_map(self, function):
+        return self._then('concat_map', function)
+
+    def chain(self):
+        return self._then('concat_map', identity)
+
+    def map_partitions(self, function):
+        return self._then('map_partitions', function)
+
+    def count(self):
+        """ Counts the rows of each partition in its worker
+
+        :rtype: int
+        """
+        return sum(self._run(lambda index: DataStream(self._partitions[index]).count()))
+
+    def repartition(self, partitions):
+        """ Deals rows out to a number of partitions, through a shuffle
+
+        :param int partitions: number of partitions
+        :rtype: PartitionedStream
+        """
+        batch_size = self.batch_size
+
+        def dealt(rows):
+            for i, row in enumerate(rows):
+                yield i // batch_size, row
+
+        sides, spill = self._shuffle(lambda pair: pair[0] % partitions, partitions, dealt)
+        stream = self._with_partitions([Partition([side], spills=[spill], ops=[('map', lambda pair: pair[1])])
+                                        for side in sides])
+        stream.partitions = partitions
+        return stream
+
+    def group_by_fn(self, key_fn):
+        """ Groups rows by function, returning a :py:class:`PartitionedStream` of ``(K, list(V))``.  Rows are grouped
+        in each partition before the shuffle, so only one pair per key and partition is spilled.
+
+        :param function key_fn: key function returning hashable value to group by
+        :rtype: PartitionedStream
+        """
+        return self._hash_shuffle(lambda pair: pair[0], partial(group_rows, key_fn), merge_groups)
+
+    def aggregate_by(self, key_fn, zero, seq_fn, comb_fn):
+        """ Aggregates rows by key, returning a :py:class:`PartitionedStream` of ``(K, aggregate)``.  Each partition's
+        rows are folded with ``seq_fn`` before the shuffle, and the partial aggregates merged with ``comb_fn`` after.
+
+        :rtype: PartitionedStream
+        """
+        return self._hash_shuffle(lambda pair: pair[0], partial(aggregate_rows, key_fn, zero, seq_fn),
+                                  partial(combine_aggregates, comb_fn))
+
+    def count_frequency(self):
+        """ Counts the frequency of each row, returning a :py:class:`PartitionedStream` of ``(row, count)``.  Each
+        partition is counted before the shuffle, and the counts summed after it.
+
+        :rtype: PartitionedStream
+        """
+        return self._hash_shuffle(lambda pair: pair[0], count_rows, sum_counts)
+
+    def dedupe(self, key_fn=identity):
+        """ Removes duplicates, in each partition and again after a shuffle by key
+
+        :param function key_fn: function returning a hashable value used to determine uniqueness
+        :rtype: PartitionedStream
+        """
+        return self._hash_shuffle(key_fn, partial(unique_rows, key_fn), partial(unique_rows, key_fn))
+
+    def sort_by(self, key_fn, descending=True, sample_size=1000):
+        """ Sorts rows by key.  Keys are sampled from each partition to split them into ranges of about the same
+        size, rows are shuffled into their range's partition, and each partition is sorted by its worker.
+
+        :param function key_fn: function used to select the key used to sort
+        :param bool descending: sorts descending if ``True``
+        :param int sample_size: number of keys sampled from each partition
+        :rtype: PartitionedStream
+        """
+        spill = SpillDirectory(self.spill_dir)
+        batch_size = self.batch_size
+
+        def sampled(index):
+            sample = []
+            generator = random.Random(index)
+
+            def sampling(rows):
+                # reservoir sampling, so each key is as likely to be in the sample
+                for i, row in enumerate(rows):
+                    if i < sample_size:
+                        sample.append(key_fn(row))
+                    else:
+                        slot = generator.randint(0, i)
+                        if slot < sample_size:
+                            sample[slot] = key_fn(row)
+                    yield 0, row
+
+            path = write_buckets(sampling(self._partitions[index]), [spill.file(index)], batch_size)[0]
+            return path, sample
+
+        written = self._run(sampled)
+        keys = sorted(chain.from_iterable(sample for _, sample in written))
+        n = self.partitions
+        bounds = [keys[len(keys) * i // n] for i in range(1, n)] if keys else []
+        spilled = self._with_partitions([Partition([[path] if path is not None else []], spills=[spill])
+                                         for path, _ in written])
+        sides, sorted_spill = spilled._shuffle(lambda row: bisect_right(bounds, key_fn(row)), len(bounds) + 1)
+        partitions = [Partition([side], partial(sorted_rows, key_fn, descending), spills=[sorted_spill])
+                      for side in sides]
+        if descending:
+            partitions.reverse()
+        return self._with_partitions(partitions)
+
+    def join_by(self, how, left_key_fn, right_key_fn, right):
+        """ Joins with another stream by key functions.  Both sides are shuffled into the same partitions by key,
+        then each partition is joined by its worker, like :py:func:`DataStream.join_by`.
+
+        :param str how: ``left``, ``right``, ``outer``, or ``inner``
+        :param DataStream right: stream to be joined with, partitioned like this one if it isn't already
+        :param function left_key_fn: key function that produces a hashable value from left stream
+        :param function right_key_fn: key function that produces a hashable value from right stream
+        :rtype: PartitionedStream
+        """
+        if how not in JOINS:
+            raise ValueError("Invalid value for how: {}, must be left, right, "
+                             "inner, or outer.".format(str(how)))
+        if not isinstance(right, PartitionedStream):
+            right = PartitionedStream(right, self.partitions, self.workers, self.batch_size, self.spill_dir)
+        n = self.partitions
+        left_sides, left_spill = self._shuffle(lambda row: hash(left_key_fn(row)) % n, n)
+        right_sides, right_spill = right._shuffle(lambda row: hash(right_key_fn(row)) % n, n)
+        combine = partial(join_sides, how, left_key_fn, right_key_fn)
+        return self._with_partitions([Partition([left_side, right_side], combine, spills=[left_spill, right_spill])
+                                      for left_side, right_side in zip(left_sides, right_sides)])
+
+    def left_join_by(self, left_key_fn, right_key_fn, right):
+        return self.join_by('left', left_key_fn, right_key_fn, right)
+
+    def right_join_by(self, left_key_fn, right_key_fn, right):
+        return self.join_by('right', left_key_fn, right_key_fn, right)
+
+    def inner_join_by(self, left_key_fn, right_key_fn, right):
+        return self.join_by('inner', left_key_fn, right_key_fn, right)
+
+    def outer_join_by(self, left_key_fn, right_key_fn, right):
+        return self.join_by('outer', left_key_fn, right_key_fn, right)
+
+    @classmethod
+    def from_file(cls, path, partitions=None, workers=None, compression='infer', encoding=None, mode='text',
+                  **options):
+        """ Partitions the lines of a file.  Uncompressed files are split into byte ranges, each read by its
+        partition's worker; compressed ones, and pipes, are read here and dealt out to the partitions.
+
+        :param str mode: ``text`` for ``str`` lines, or ``bytes``
+        :rtype: PartitionedStream
+        """
+        if compression == 'infer':
+            compression = detect_compression(path)
+        if compression is not None or not os.path.isfile(path):
+            return cls(iter_lines(path, compression, encoding, mode), partitions, workers, **options)
+        stream = cls([], partitions, workers, **options)
+        size = os.path.getsize(path)
+        n = stream.partitions
+        stream._partitions = [Partition([[partial(iter_line_range, path, size * i // n, size * (i + 1) // n, mode,
+                                                  encoding)]])
+                              for i in range(n)]
+        return stream
+
+    @classmethod
+    def from_files(cls, paths, partitions=None, workers=None, compression='infer', encoding=None, mode='text',
+                   **options):
+        """ Partitions the lines of several files, each file read whole by one partition's worker.  Paths can be
+        glob patterns.
+
+        :rtype: PartitionedStream
+        """
+        paths = expand_paths(paths)
+        stream = cls([], partitions, workers, **options)
+        n = stream.partitions
+        stream._partitions = [Partition([[partial(iter_lines, path, compression, encoding, mode)
+                                          for path in islice(paths, i, None, n)]])
+                              for i in range(n)]
+        return stream
@@ -1 +1,365 @@
 __author__ = 'stuart'
+
+from itertools import islice
+import io
+import mmap
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import traceback
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+from .binary import encode_frame, read_frame, pack_rows, unpack_rows
+
+STAGE_KINDS = ('thread', 'process')
+TRANSPORTS = ('frames', 'shared_memory')
+
+
+def identity(row):
+    return row
+
+
+def always(row):
+    return True
+
+
+def apply_ops(ops, rows):
+    """ Applies a stage's ``(transform, predicate)`` steps to a batch of rows, one step at a time """
+    for transform, predicate in ops:
+        if predicate is always:
+            rows = [transform(row) for row in rows]
+        elif transform is identity:
+            rows = [row for row in rows if predicate(row)]
+        else:
+            rows = [transform(row) for row in rows if predicate(row)]
+    return rows
+
+
+def fork_context():
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        raise ValueError("Process stages need the fork start method, use kind='thread' on this platform")
+
+
+class StageError(Exception):
+    """ Raised for errors in process workers that can't be sent back as they are """
+
+
+def pack_error(error):
+    try:
+        return pickle.dumps(error)
+    except Exception:
+        return pickle.dumps(StageError(''.join(traceback.format_exception_only(type(error), error)).strip()))
+
+
+class FrameTransport(object):
+    """ Sends batches of rows between processes as frames of the binary format, which handles slotted records """
+
+    def pack(self, rows):
+        return b''.join(encode_frame(rows))
+
+    def unpack(self, data):
+        return read_frame(io.BytesIO(data))
+
+
+if hasattr(pickle, 'PickleBuffer'):
+    class _ArenaPickler(pickle.Pickler):
+        """ Pickles large ``bytes`` as out-of-band buffers, like ``bytearray`` s and arrays already are """
+
+        def __init__(self, file, threshold, buffer_callback):
+            super(_ArenaPickler, self).__init__(file, 5, buffer_callback=buffer_callback)
+            self.threshold = threshold
+
+        def reducer_override(self, obj):
+            if type(obj) is bytes and len(obj) >= self.threshold:
+                return bytes, (pickle.PickleBuffer(obj),)
+            return NotImplemented
+else:
+    _ArenaPickler = None
+
+
+def shared_memory_dir():
+    """ Where arenas are kept: ``/dev/shm`` when it exists, so they're never written to disk """
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedMemoryTransport(object):
+    """ Sends batches between processes with their large buffers (``bytes``, ``bytearray`` s, and buffer protocol
+    arrays like NumPy's, of at least ``threshold`` bytes) in a memory-mapped arena file rather than in the pickle, so
+    only the pickle and the arena's name go through the queue.  The receiver maps the arena and removes its file
+    straight away; unpickled arrays are views of the map, which is freed once the last of them is garbage collected.
+    Large ``bytes`` are copied out of the map, but never pickled or sent through a pipe.
+
+    :param int threshold: size in bytes from which buffers go in the arena
+    """
+
+    def __init__(self, threshold=1 << 16):
+        if _ArenaPickler is None:
+            raise ValueError("The shared memory transport needs pickle protocol 5, from Python 3.8")
+        self.threshold = threshold
+        self.arena_dir = tempfile.mkdtemp(prefix='datastreams-', dir=shared_memory_dir())
+
+    def pack(self, rows):
+        buffers = []
+
+        def keep_small_in_band(buffer):
+            if buffer.raw().nbytes < self.threshold:
+                return True
+            buffers.append(buffer.raw())
+            return False
+
+        data = io.BytesIO()
+        _ArenaPickler(data, self.threshold, keep_small_in_band).dump(pack_rows(rows))
+        if not buffers:
+            return data.getvalue(), None, ()
+        descriptor, path = tempfile.mkstemp(dir=self.arena_dir)
+        with os.fdopen(descriptor, 'wb', 0) as arena:
+            for buffer in buffers:
+                arena.write(buffer)
+        return data.getvalue(), path, tuple(buffer.nbytes for buffer in buffers)
+
+    def unpack(self, payload):
+        data, path, lengths = payload
+        if path is None:
+            return unpack_rows(pickle.loads(data))
+        with open(path, 'rb') as arena:
+            # copy on write, so unpickled arrays are writable without changing what other views see
+            mapped = mmap.mmap(arena.fileno(), 0, access=mmap.ACCESS_COPY)
+        os.remove(path)
+        view = memoryview(mapped)
+        buffers = []
+        start = 0
+        for length in lengths:
+            buffers.append(view[start:start + length])
+            start += length
+        return unpack_rows(pickle.loads(data, buffers=buffers))
+
+    def close(self):
+        """ Removes arenas that were never received, like those of batches in flight when a stage is closed """
+        shutil.rmtree(self.arena_dir, ignore_errors=True)
+
+
+class DirectTransport(object):
+    """ Hands batches between threads as they are """
+
+    def pack(self, rows):
+        return rows
+
+    def unpack(self, rows):
+        return rows
+
+
+def _put(queue, item, stopped):
+    while not stopped.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _get(queue, stopped):
+    while not stopped.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            pass
+    return None
+
+
+def run_worker(ops, transport, inputs, outputs, stopped):
+    """ Takes ``(seq, batch)`` off ``inputs`` until it gets ``None``, putting ``('rows', seq, batch)`` or
+    ``('error', seq, pickled error)`` on ``outputs``
+    """
+    while True:
+        item = _get(inputs, stopped)
+        if item is None:
+            return
+        seq, batch = item
+        try:
+            result = ('rows', seq, transport.pack(apply_ops(ops, transport.unpack(batch))))
+        except Exception as error:
+            result = ('error', seq, pack_error(error))
+        if not _put(outputs, result, stopped):
+            return
+
+
+def check_stage_options(kind, transport):
+    if kind not in STAGE_KINDS:
+        raise ValueError("Invalid stage kind: {}, must be thread or process".format(kind))
+    if transport not in TRANSPORTS:
+        raise ValueError("Invalid transport: {}, must be frames or shared_memory".format(transport))
+
+
+class StageRunner(object):
+    """ Runs a stage: a feeder thread reads the upstream stream in batches, ``workers`` threads or processes apply
+    the stage's steps to them, and :py:func:`__iter__` yields the results.  At most ``max_pending`` batches wait in
+    each queue, and at most ``max_pending * 2 + workers`` are between the feeder and the consumer, so a slow stage
+    holds back the ones before it rather than letting batches pile up.
+    """
+
+    def __init__(self, upstream, ops, workers=1, kind='thread', batch_size=100, max_pending=None, ordered=True,
+                 transport='frames'):
+        check_stage_options(kind, transport)
+        self.workers = workers
+        self.kind = kind
+        self.batch_size = batch_size
+        self.max_pending = max_pending or workers * 2
+        self.ordered = ordered
+        self._upstream = upstream
+        self._ops = ops
+        self._stopped = threading.Event()
+        self._in_flight = threading.Semaphore(self.max_pending * 2 + workers)
+        if kind == 'process':
+            context = fork_context()
+            self._transport = SharedMemoryTransport() if transport == 'shared_memory' else FrameTransport()
+            self._inputs = context.Queue(self.max_pending)
+            self._outputs = context.Queue(self.max_pending)
+            # processes never see this process's events, they're terminated instead
+            worker_stopped = context.Event()
+            self._workers = [context.Process(target=run_worker, args=(ops, self._transport, self._inputs,
+                                                                      self._outputs, worker_stopped))
+                             for _ in range(workers)]
+        else:
+            self._transport = DirectTransport()
+            self._inputs = Queue(self.max_pending)
+            self._outputs = Queue(self.max_pending)
+            self._workers = [threading.Thread(target=run_worker, args=(ops, self._transport, self._inputs,
+                                                                       self._outputs, self._stopped))
+                             for _ in range(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+        self._feeder = threading.Thread(target=self._feed)
+        self._feeder.daemon = True
+        self._feeder.start()
+
+    def _feed(self):
+        rows = iter(self._upstream)
+        seq = 0
+        try:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                while not self._in_flight.acquire(timeout=0.1):
+                    if self._stopped.is_set():
+                        return
+                if not _put(self._inputs, (seq, self._transport.pack(batch)), self._stopped):
+                    return
+                seq += 1
+        except BaseException as error:
+            _put(self._outputs, ('error', None, pack_error(error)), self._stopped)
+            return
+        finally:
+            for _ in self._workers:
+                _put(self._inputs, None, self._stopped)
+        _put(self._outputs, ('end', seq, None), self._stopped)
+
+    def _results(self):
+        while True:
+            try:
+                return self._outputs.get(timeout=0.5)
+            except Empty:
+                for worker in self._workers:
+                    if self.kind == 'process' and worker.exitcode not in (None, 0):
+                        raise StageError("A stage worker process died with exit code {}".format(worker.exitcode))
+
+    def __iter__(self):
+        try:
+            pending = {}
+            next_seq = 0
+            received = 0
+            total = None
+            while total is None or received < total:
+                kind, seq, payload = self._results()
+                if kind == 'end':
+                    total = seq
+                    continue
+                if kind == 'error':
+                    raise pickle.loads(payload)
+                received += 1
+                if not self.ordered:
+                    self._in_flight.release()
+                    for row in self._transport.unpack(payload):
+                        yield row
+                    continue
+                pending[seq] = payload
+                while next_seq in pending:
+                    rows = self._transport.unpack(pending.pop(next_seq))
+                    next_seq += 1
+                    self._in_flight.release()
+                    for row in rows:
+                        yield row
+        finally:
+            self.close()
+
+    def close(self):
+        """ Stops the feeder and workers, terminating worker processes """
+        self._stopped.set()
+        if self.kind == 'process':
+            for worker in self._workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+            for queue in (self._inputs, self._outputs):
+                queue.cancel_join_thread()
+                queue.close()
+            if hasattr(self._transport, 'close'):
+                self._transport.close()
+        else:
+            for worker in self._workers:
+                worker.join(1.0)
+        if self._feeder is not threading.current_thread():
+            self._feeder.join(1.0)
+
+
+class StageStream(object):
+    """ Mixin for the stream returned by :py:func:`DataStream.stage`.  ``map`` and ``filter`` (and anything else built
+    as a ``transform`` or ``predicate`` on this stream) are recorded as steps of the stage, run by its workers; any
+    other operation, or another :py:func:`DataStream.stage`, ends the stage.
+    """
+
+    def __init__(self, upstream, workers=1, kind='thread', batch_size=100, max_pending=None, ordered=True,
+                 transport='frames', ops=()):
+        check_stage_options(kind, transport)
+        self._upstream = upstream
+        self._options = dict(workers=workers, kind=kind, batch_size=batch_size, max_pending=max_pending,
+                             ordered=ordered, transport=transport)
+        self._ops = list(ops)
+        self._transform = identity
+        self._predicate = always
+        self._runner = None
+
+    def Stream(self, iterable, transform=identity, predicate=always):
+        if iterable is self:
+            return type(self)(self._upstream, ops=self._ops + [(transform, predicate)], **self._options)
+        return super(StageStream, self).Stream(iterable, transform=transform, predicate=predicate)
+
+    @property
+    def _source(self):
+        if self._runner is None:
+            self._runner = iter(StageRunner(self._upstream, self._ops, **self._options))
+        return self._runner
+
+    def __repr__(self):
+        return "{}(workers={workers}, kind={kind!r}, steps={steps})".format(
+            self.__class__.__name__, steps=len(self._ops), **self._options)
+
+
+_stage_classes = {}
+
+
+def stage_class(stream_class):
+    """ The :py:class:`StageStream` subclass for a stream class, like ``DictStream`` """
+    if stream_class not in _stage_classes:
+        _stage_classes[stream_class] = type('Stage' + stream_class.__name__, (StageStream, stream_class), {})
+    return _stage_classes[stream_class]
@@ -1,11 +1,23 @@
 __author__ = 'stuart'
 
-from datastreams import DataStream
-from datastreams import join_objects
-from itertools import product
+from operator import add
+
+from .datastreams import DataStream
+
+
+def count_one(row):
+    return row, 1
+
+
+def first(left, right):
+    return left
 
 
 class RddStream(DataStream):
+    """ A :py:class:`DataStream` backed by a Spark RDD.  Aggregations and joins are keyed so Spark can combine values
+    on the map side and shuffle only what's needed, rather than grouping whole datasets or collecting them to the
+    driver.
+    """
 
     def __init__(self, source_rdd):
         self._source = source_rdd
@@ -17,6 +29,14 @@ class RddStream(DataStream):
     def map(self, function):
         return self.Stream(self._source.map(function))
 
+    def map_partitions(self, function):
+        """ Maps a function over the rows of each partition, with ``mapPartitions``
+
+        :param function function: function taking an iterator of rows and returning an iterable of rows
+        :rtype: RddStream
+        """
+        return self.Stream(self._source.mapPartitions(function))
+
     def chain(self):
         return self.Stream(self._source.flatMap(lambda x: x))
 
@@ -52,10 +72,25 @@ class RddStream(DataStream):
                                   "StreamingRddStream!")
 
     def group_by_fn(self, key_fn):
-        return self.Stream(self._source.groupBy(key_fn))
+        return self.Stream(self._source.groupBy(key_fn).mapValues(list))
+
+    def aggregate_by(self, key_fn, zero, seq_fn, comb_fn):
+        """ Aggregates rows by key with ``aggregateByKey``, folding each partition's rows on the map side
+
+        :rtype: RddStream
+        """
+        return self.Stream(self._source.keyBy(key_fn).aggregateByKey(zero, seq_fn, comb_fn))
 
     def count_frequency(self):
-        return self.Stream(self.rdd(self._source.countByValue().items()))
+        """ Counts rows with ``reduceByKey``, so counts are summed in each partition before the shuffle and never
+        collected to the driver
+
+        :rtype: RddStream
+        """
+        return self.Stream(self._source.map(count_one).reduceByKey(add))
+
+    def count(self):
+        return self._source.count()
 
     def apply(self, function):
         return self.Stream(function(self))
@@ -66,44 +101,44 @@ class RddStream(DataStream):
     def sort_by(self, key_fn, descending=True):
         return self.Stream(self._source.sortBy(ascending=not descending, keyfunc=key_fn))
 
-    def dedupe(self):
-        return self.Stream(self._source.distinct())
+    def dedupe(self, key_fn=None):
+        if key_fn is None:
+            return self.Stream(self._source.distinct())
+        return self.Stream(self._source.keyBy(key_fn).reduceByKey(first).values())
 
     def reverse(self):
-        return self.Stream(self.rdd(self._source.takeOrdered(len(self), key=lambda x: -x)))
+        """ Reverses the order of rows, by sorting on their ``zipWithIndex`` position
 
-    @staticmethod
-    def combine_joined(joined):
-        def product_pairs(group_pair):
-            groupa = group_pair[0] or [None]
-            groupb = group_pair[1] or [None]
-            return product(groupa, groupb)
+        :rtype: RddStream
+        """
+        indexed = self._source.zipWithIndex()
+        return self.Stream(indexed.sortBy(lambda pair: pair[1], ascending=False).keys())
 
-        return joined \
-            .map(lambda kvpair: kvpair[1]) \
-            .flatMap(product_pairs) \
-            .map(lambda pair: join_objects(pair[0], pair[1]))
+    def _keyed(self, left_key_fn, right_key_fn, right):
+        if not isinstance(right, RddStream):
+            right = RddStream(self.rdd(list(right)))
+        return self._source.keyBy(left_key_fn), right._source.keyBy(right_key_fn)
 
     def left_join_by(self, left_key_fn, right_key_fn, right):
-        right_grouped = right._source.groupBy(right_key_fn)
-        left_grouped = self._source.groupBy(left_key_fn)
-        results = self.combine_joined(left_grouped.leftOuterJoin(right_grouped))
-        return self.Stream(results)
+        left, right = self._keyed(left_key_fn, right_key_fn, right)
+        join_objects = self.join_objects
+        return self.Stream(left.leftOuterJoin(right).values().map(lambda pair: join_objects(pair[0], pair[1])))
 
     def right_join_by(self, left_key_fn, right_key_fn, right):
-        right_grouped = right._source.groupBy(right_key_fn)
-        left_grouped = self._source.groupBy(left_key_fn)
-        results = self.combine_joined(left_grouped.rightOuterJoin(right_grouped))
-        return self.Stream(results)
+        left, right = self._keyed(left_key_fn, right_key_fn, right)
+        join_objects = self.join_objects
+        # right rows come first, like DataStream.right_join_by
+        return self.Stream(left.rightOuterJoin(right).values().map(lambda pair: join_objects(pair[1], pair[0])))
 
     def inner_join_by(self, left_key_fn, right_key_fn, right):
-        right_grouped = right._source.groupBy(right_key_fn)
-        left_grouped = self._source.groupBy(left_key_fn)
-        results = self.combine_joined(left_grouped.join(right_grouped))
-        return self.Stream(results)
+        left, right = self._keyed(left_key_fn, right_key_fn, right)
+        join_objects = self.join_objects
+        return self.Stream(left.join(right).values().map(lambda pair: join_objects(pair[0], pair[1])))
 
     def outer_join_by(self, left_key_fn, right_key_fn, right):
-        raise NotImplementedError
+        left, right = self._keyed(left_key_fn, right_key_fn, right)
+        join_objects = self.join_objects
+        return self.Stream(left.fullOuterJoin(right).values().map(lambda pair: join_objects(pair[0], pair[1])))
 
     def to_list(self):
         return self._source.collect()
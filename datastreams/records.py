@@ -0,0 +1,101 @@
+from keyword import iskeyword
+import re
+import uuid
+import weakref
+
+# record classes by token, for finding the exact class of serialized records
+_records_by_token = weakref.WeakValueDictionary()
+
+
+def record_type(fields, name='Record'):
+    """ Builds a mutable record class with ``__slots__`` for the given field names.  Slotted records are smaller and
+    faster to build than :py:class:`Datum` s, and work with attribute based operations like ``where`` and ``set``.
+
+    >>> Person = record_type(['name', 'age'])
+    >>> Person('amy', 31)
+    ... Record(name='amy', age=31)
+
+    :param list[str] fields: field names, which must be valid identifiers
+    :param str name: class name
+    :rtype: type
+    """
+    fields = tuple(fields)
+    for field in fields:
+        if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', field) or iskeyword(field):
+            raise ValueError("Invalid field name for a slotted record: {!r}, use dict or Datum "
+                             "records instead".format(field))
+    namespace = {}
+    source = 'def __init__(self{}):\n{}'.format(
+        ''.join(', ' + field for field in fields),
+        ''.join('    self.{0} = {0}\n'.format(field) for field in fields) or '    pass\n')
+    exec(source, namespace)
+
+    def __repr__(self):
+        values = ', '.join('{}={!r}'.format(field, getattr(self, field)) for field in fields)
+        return '{}({})'.format(self.__class__.__name__, values)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, field) == getattr(other, field) for field in fields)
+
+    def __ne__(self, other):
+        return not __eq__(self, other)
+
+    def __iter__(self):
+        return (getattr(self, field) for field in fields)
+
+    cls = type(name, (object,), {
+        '__slots__': fields,
+        '_fields': fields,
+        '__init__': namespace['__init__'],
+        '__repr__': __repr__,
+        '__eq__': __eq__,
+        '__ne__': __ne__,
+        '__hash__': None,
+        '__iter__': __iter__,
+    })
+    # tokened as it's made, so processes forked from this one know it by the same token
+    record_token(cls)
+    return cls
+
+
+def record_token(cls):
+    """ A token unique to a record class, written with serialized records so that this process, and ones forked from
+    it, read them back as exactly that class, rather than another with the same name and fields
+    """
+    token = cls.__dict__.get('__record_token__')
+    if token is None:
+        token = uuid.uuid4().hex
+        cls.__record_token__ = token
+        _records_by_token[token] = cls
+    return token
+
+
+def record_class(token, fields, name='Record'):
+    """ The record class known by ``token``, or, for records serialized by an unrelated process, a new
+    :py:func:`record_type` that later records with the same token share
+    """
+    cls = _records_by_token.get(token)
+    if cls is None:
+        cls = record_type(fields, name)
+        cls.__record_token__ = token
+        _records_by_token[token] = cls
+    return cls
+
+
+def record_constructor(fields, record):
+    """ Builds a function that makes a record from a sequence of values, in field order
+
+    :param list[str] fields: field names
+    :param record: ``tuple`` or ``list`` for positional rows, ``'slots'`` for a :py:func:`record_type`, or a
+        constructor taking ``(name, value)`` pairs, like ``dict`` or ``Datum``
+    :rtype: function
+    """
+    if record is tuple:
+        return tuple
+    if record is list:
+        return list
+    if record == 'slots':
+        slotted = record_type(fields)
+        return lambda values: slotted(*values)
+    fields = list(fields)
+    return lambda values: record(zip(fields, values))
@@ -0,0 +1,398 @@
+""" Runs stages of a :py:class:`DataStream` on worker processes on other machines, over plain TCP.  Start a worker on
+each machine:
+
+    python -m datastreams.worker --host 0.0.0.0 --port 7370 --authkey secret
+
+then send them work with :py:func:`DataStream.remote`.  Workers unpickle the functions they're sent, so only run them
+on trusted networks, with an authkey.
+"""
+from hashlib import sha256
+import hmac
+import io
+import ipaddress
+from itertools import islice
+import os
+import pickle
+import socket
+import struct
+import threading
+import time
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+try:
+    import cloudpickle
+except ImportError:
+    cloudpickle = None
+
+from .binary import encode_frame, read_frame
+from .processstreams import StageStream, apply_ops, pack_error, identity, always, _put
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 7370
+MESSAGE_HEADER = struct.Struct('<cQ')  # kind, payload length
+
+# messages: the worker's authentication challenge and its answer, the stage's steps, the worker's acknowledgement,
+# a batch of rows in, a batch of rows out, and an error
+CHALLENGE, TASK, READY, BATCH, ROWS, ERROR = b'C', b'T', b'K', b'B', b'R', b'E'
+
+
+class RemoteError(Exception):
+    """ Raised when remote workers can't be reached, or a batch failed on every attempt """
+
+
+class TaskRejected(RemoteError):
+    """ Raised when a worker answers a stage's steps with an error, like a refused authkey or steps it can't unpickle,
+    rather than the connection failing.  ``payload`` is the worker's pickled error.
+    """
+
+    def __init__(self, payload):
+        super(TaskRejected, self).__init__("Worker rejected the stage's steps")
+        self.payload = payload
+
+
+def send_message(target, kind, payload=b''):
+    target.write(MESSAGE_HEADER.pack(kind, len(payload)))
+    target.write(payload)
+    target.flush()
+
+
+def read_message(source):
+    """ Reads a message from a binary file object
+
+    :return: ``(kind, payload)``, or ``None`` if the connection was closed between messages
+    """
+    header = source.read(MESSAGE_HEADER.size)
+    if not header:
+        return None
+    if len(header) < MESSAGE_HEADER.size:
+        raise EOFError("Connection closed in the middle of a message")
+    kind, length = MESSAGE_HEADER.unpack(header)
+    payload = source.read(length)
+    if len(payload) < length:
+        raise EOFError("Connection closed in the middle of a message")
+    return kind, payload
+
+
+def answer(authkey, challenge):
+    return hmac.new(authkey, challenge, sha256).digest()
+
+
+def as_bytes(authkey):
+    if authkey is None or isinstance(authkey, bytes):
+        return authkey
+    return authkey.encode('utf-8')
+
+
+def parse_address(address):
+    """ Parses a worker address, ``(host, port)`` or ``'host:port'`` """
+    if isinstance(address, str):
+        host, _, port = address.rpartition(':')
+        return host, int(port)
+    return tuple(address)
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """ Handles one coordinator connection: a challenge, the stage's steps, then batches of rows, answering each batch
+    with its results or error until the coordinator hangs up
+    """
+
+    def handle(self):
+        authkey = self.server.authkey
+        challenge = os.urandom(32) if authkey else b''
+        send_message(self.wfile, CHALLENGE, challenge)
+        message = read_message(self.rfile)
+        if message is None:
+            return
+        if challenge and not hmac.compare_digest(message[1], answer(authkey, challenge)):
+            send_message(self.wfile, ERROR, pack_error(RemoteError("Worker authentication failed")))
+            return
+        message = read_message(self.rfile)
+        if message is None:
+            return
+        try:
+            version, ops = pickle.loads(message[1])
+            if version != PROTOCOL_VERSION:
+                raise RemoteError("Unsupported protocol version: {}".format(version))
+        except Exception as error:
+            send_message(self.wfile, ERROR, pack_error(error))
+            return
+        send_message(self.wfile, READY)
+        while True:
+            message = read_message(self.rfile)
+            if message is None:
+                return
+            try:
+                rows = apply_ops(ops, read_frame(io.BytesIO(message[1])))
+                reply = ROWS, b''.join(encode_frame(rows))
+            except Exception as error:
+                reply = ERROR, pack_error(error)
+            send_message(self.wfile, *reply)
+
+
+_ServerMixIn = socketserver.ForkingMixIn if hasattr(os, 'fork') else socketserver.ThreadingMixIn
+
+
+class WorkerServer(_ServerMixIn, socketserver.TCPServer):
+    """ Serves remote stage workers, each connection handled by its own forked process (or thread, where processes
+    can't be forked), so a machine runs as many batches at once as coordinators connect to it
+
+    :param tuple address: ``(host, port)`` to listen on, port 0 for any free port
+    :param authkey: key coordinators must prove they have, or ``None`` to accept anyone
+    :param bool insecure: listen on interfaces other hosts can reach without an authkey, letting anyone who can
+        connect run code on this machine
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', DEFAULT_PORT), authkey=None, insecure=False):
+        self.authkey = as_bytes(authkey)
+        socketserver.TCPServer.__init__(self, address, WorkerHandler)
+        if not self.authkey and not insecure and not ipaddress.ip_address(self.server_address[0]).is_loopback:
+            self.server_close()
+            raise RemoteError("Workers reachable from other hosts need an authkey, as they run any steps they're sent")
+
+
+class WorkerConnection(object):
+    """ Coordinator side of a connection to a worker, running a stage's steps on batches of rows """
+
+    def __init__(self, address, task, authkey=None, timeout=None):
+        self.socket = socket.create_connection(address, timeout)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.socket.makefile('rwb')
+        kind, challenge = self._read()
+        if challenge and not authkey:
+            self.close()
+            raise RemoteError("Worker {}:{} needs an authkey".format(*address))
+        if authkey and not challenge:
+            # a worker without the authkey, or something posing as one, isn't sent the stage's steps
+            self.close()
+            raise TaskRejected(pack_error(RemoteError("Worker {}:{} didn't ask for the authkey".format(*address))))
+        send_message(self.file, CHALLENGE, answer(authkey, challenge) if challenge else b'')
+        send_message(self.file, TASK, task)
+        kind, payload = self._read()
+        if kind != READY:
+            self.close()
+            raise TaskRejected(payload)
+
+    def _read(self):
+        message = read_message(self.file)
+        if message is None:
+            raise EOFError("Worker closed the connection")
+        return message
+
+    def run(self, batch):
+        """ Sends a batch, returning ``('rows', rows)`` or ``('error', pickled error)`` """
+        send_message(self.file, BATCH, b''.join(encode_frame(batch)))
+        kind, payload = self._read()
+        if kind == ROWS:
+            return 'rows', read_frame(io.BytesIO(payload))
+        return 'error', payload
+
+    def close(self):
+        for closeable in (self.file, self.socket):
+            try:
+                closeable.close()
+            except (IOError, OSError):
+                pass
+
+
+def dump_task(ops):
+    """ Pickles a stage's steps for workers, with ``cloudpickle`` if it's installed so lambdas and closures can be
+    sent; otherwise functions must be importable by the workers
+    """
+    return (cloudpickle or pickle).dumps((PROTOCOL_VERSION, ops))
+
+
+class RemoteRunner(object):
+    """ Runs a stage on remote workers: a feeder thread reads the upstream stream in batches, a thread per worker
+    address sends them to its worker one at a time, and :py:func:`__iter__` yields the results.  A batch whose worker
+    fails or hangs up is retried on another connection, up to ``retries`` times, and a worker is given up on after
+    ``retries`` failures in a row.
+    """
+
+    def __init__(self, upstream, ops, workers, batch_size=1000, max_pending=None, ordered=True, retries=3,
+                 authkey=None, timeout=None):
+        self.addresses = [parse_address(address) for address in workers]
+        if not self.addresses:
+            raise ValueError("Remote stages need at least one worker address")
+        self.batch_size = batch_size
+        self.max_pending = max_pending or len(self.addresses) * 2
+        self.ordered = ordered
+        self.retries = retries
+        self.authkey = as_bytes(authkey)
+        self.timeout = timeout
+        self._upstream = upstream
+        self._task = dump_task(ops)
+        self._stopped = threading.Event()
+        self._in_flight = threading.Semaphore(self.max_pending * 2 + len(self.addresses))
+        self._inputs = Queue(self.max_pending)
+        self._retried = Queue()
+        self._outputs = Queue()
+        self._last_failure = None
+        self._workers = [threading.Thread(target=self._work, args=(address,)) for address in self.addresses]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+        self._feeder = threading.Thread(target=self._feed)
+        self._feeder.daemon = True
+        self._feeder.start()
+
+    def _feed(self):
+        rows = iter(self._upstream)
+        seq = 0
+        try:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                while not self._in_flight.acquire(timeout=0.1):
+                    if self._stopped.is_set():
+                        return
+                if not _put(self._inputs, (seq, batch, 0), self._stopped):
+                    return
+                seq += 1
+        except BaseException as error:
+            self._outputs.put(('error', None, pack_error(error)))
+            return
+        self._outputs.put(('end', seq, None))
+
+    def _next_batch(self):
+        while not self._stopped.is_set():
+            try:
+                return self._retried.get_nowait()
+            except Empty:
+                pass
+            try:
+                return self._inputs.get(timeout=0.1)
+            except Empty:
+                pass
+        return None
+
+    def _work(self, address):
+        connection = None
+        failures = 0
+        while True:
+            item = self._next_batch()
+            if item is None:
+                break
+            seq, batch, attempts = item
+            try:
+                if connection is None:
+                    connection = WorkerConnection(address, self._task, self.authkey, self.timeout)
+                result = connection.run(batch)
+            except TaskRejected as rejected:
+                # the worker's own error, even an OSError, fails the same way on every worker
+                self._outputs.put(('error', seq, rejected.payload))
+                break
+            except (EOFError, IOError, OSError) as error:
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                self._last_failure = "{}:{}: {!r}".format(address[0], address[1], error)
+                if attempts >= self.retries:
+                    self._outputs.put(('error', seq, pack_error(RemoteError(
+                        "Batch {} failed {} times, last on {}".format(seq, attempts + 1, self._last_failure)))))
+                else:
+                    self._retried.put((seq, batch, attempts + 1))
+                failures += 1
+                if failures > self.retries:
+                    break
+                time.sleep(min(0.1 * 2 ** failures, 2.0))
+                continue
+            except Exception as error:
+                self._outputs.put(('error', seq, pack_error(error)))
+                break
+            failures = 0
+            self._outputs.put((result[0], seq, result[1]))
+        if connection is not None:
+            connection.close()
+
+    def _results(self):
+        while True:
+            try:
+                return self._outputs.get(timeout=0.5)
+            except Empty:
+                if not any(worker.is_alive() for worker in self._workers):
+                    raise RemoteError("All remote workers failed, last on {}".format(self._last_failure))
+
+    def __iter__(self):
+        try:
+            pending = {}
+            next_seq = 0
+            received = 0
+            total = None
+            while total is None or received < total:
+                kind, seq, payload = self._results()
+                if kind == 'end':
+                    total = seq
+                    continue
+                if kind == 'error':
+                    raise pickle.loads(payload)
+                received += 1
+                if not self.ordered:
+                    self._in_flight.release()
+                    for row in payload:
+                        yield row
+                    continue
+                pending[seq] = payload
+                while next_seq in pending:
+                    rows = pending.pop(next_seq)
+                    next_seq += 1
+                    self._in_flight.release()
+                    for row in rows:
+                        yield row
+        finally:
+            self.close()
+
+    def close(self):
+        """ Stops the feeder and worker threads, closing their connections """
+        self._stopped.set()
+        for worker in self._workers:
+            if worker is not threading.current_thread():
+                worker.join(1.0)
+        if self._feeder is not threading.current_thread():
+            self._feeder.join(1.0)
+
+
+class RemoteStream(StageStream):
+    """ Mixin for the stream returned by :py:func:`DataStream.remote`, recording ``map`` s and ``filter`` s as steps
+    run by remote workers, like :py:class:`StageStream`
+    """
+
+    def __init__(self, upstream, workers, batch_size=1000, max_pending=None, ordered=True, retries=3, authkey=None,
+                 timeout=None, ops=()):
+        if not workers:
+            raise ValueError("Remote stages need at least one worker address")
+        self._upstream = upstream
+        self._options = dict(workers=list(workers), batch_size=batch_size, max_pending=max_pending, ordered=ordered,
+                             retries=retries, authkey=authkey, timeout=timeout)
+        self._ops = list(ops)
+        self._transform = identity
+        self._predicate = always
+        self._runner = None
+
+    @property
+    def _source(self):
+        if self._runner is None:
+            self._runner = iter(RemoteRunner(self._upstream, self._ops, **self._options))
+        return self._runner
+
+    def __repr__(self):
+        return "{}(workers={}, steps={})".format(self.__class__.__name__, len(self._options['workers']),
+                                                 len(self._ops))
+
+
+_remote_classes = {}
+
+
+def remote_class(stream_class):
+    """ The :py:class:`RemoteStream` subclass for a stream class, like ``DictStream`` """
+    if stream_class not in _remote_classes:
+        _remote_classes[stream_class] = type('Remote' + stream_class.__name__, (RemoteStream, stream_class), {})
+    return _remote_classes[stream_class]
@@ -0,0 +1,155 @@
+try:
+    from collections import deque
+except ImportError:
+    from backport_collections import deque
+
+
+class RollingAggregator(object):
+    """ Protocol for aggregates that are updated incrementally as rows enter and leave a window.  Rows always leave
+    in the order they entered, so ``remove`` is called with the oldest value still in the window.
+    """
+
+    def add(self, value):
+        raise NotImplementedError
+
+    def remove(self, value):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class RollingCount(RollingAggregator):
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+
+    def remove(self, value):
+        self.count -= 1
+
+    def result(self):
+        return self.count
+
+
+class RollingSum(RollingAggregator):
+    def __init__(self):
+        self.total = 0
+
+    def add(self, value):
+        self.total += value
+
+    def remove(self, value):
+        self.total -= value
+
+    def result(self):
+        return self.total
+
+
+class RollingMean(RollingAggregator):
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        self.total += value
+        self.count += 1
+
+    def remove(self, value):
+        self.total -= value
+        self.count -= 1
+
+    def result(self):
+        return float(self.total) / self.count if self.count else None
+
+
+class RollingVariance(RollingAggregator):
+    """ Welford's online variance, extended to remove values as they leave the window
+
+    :param int ddof: delta degrees of freedom, ``1`` for sample variance, ``0`` for population variance
+    """
+
+    def __init__(self, ddof=1):
+        self.ddof = ddof
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        old_mean = self.mean
+        self.count -= 1
+        self.mean = (old_mean * (self.count + 1) - value) / self.count
+        self.m2 -= (value - old_mean) * (value - self.mean)
+
+    def result(self):
+        if self.count <= self.ddof:
+            return None
+        return max(self.m2, 0.0) / (self.count - self.ddof)
+
+
+class RollingStd(RollingVariance):
+    def result(self):
+        variance = super(RollingStd, self).result()
+        return None if variance is None else variance ** 0.5
+
+
+class RollingMin(RollingAggregator):
+    """ Keeps a deque of values that could still become the minimum, smallest first, giving O(1) amortized updates """
+
+    def __init__(self):
+        self.candidates = deque()
+
+    def beats(self, value, other):
+        return value < other
+
+    def add(self, value):
+        candidates = self.candidates
+        while candidates and self.beats(value, candidates[-1]):
+            candidates.pop()
+        candidates.append(value)
+
+    def remove(self, value):
+        # equal values are kept in arrival order, so a match at the front is the value leaving
+        if self.candidates and self.candidates[0] == value:
+            self.candidates.popleft()
+
+    def result(self):
+        return self.candidates[0] if self.candidates else None
+
+
+class RollingMax(RollingMin):
+    def beats(self, value, other):
+        return value > other
+
+
+AGGREGATORS = {
+    'count': RollingCount,
+    'sum': RollingSum,
+    'mean': RollingMean,
+    'var': RollingVariance,
+    'std': RollingStd,
+    'min': RollingMin,
+    'max': RollingMax,
+}
+
+
+def make_aggregator(agg):
+    """ Builds a rolling aggregator from a name in :py:data:`AGGREGATORS` or a factory (like a
+    :py:class:`RollingAggregator` subclass)
+    """
+    if agg in AGGREGATORS:
+        return AGGREGATORS[agg]()
+    if callable(agg):
+        return agg()
+    raise ValueError("Invalid aggregator: {}, must be one of {} or a factory for "
+                     "RollingAggregators".format(agg, ', '.join(sorted(AGGREGATORS))))
@@ -0,0 +1,422 @@
+from itertools import islice
+from operator import attrgetter, itemgetter
+import bz2
+import errno
+import gzip
+import os
+import sqlite3
+import stat
+import threading
+from uuid import uuid4
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+_END = object()
+
+
+class BatchWriter(object):
+    """ Groups rows into batches and hands them to ``write_fn`` on a background flusher thread.  At most
+    ``max_pending`` full batches wait for the flusher; past that, :py:func:`add` blocks until one is written.
+
+    :param function write_fn: called with a list of rows for each batch
+    :param int batch_size: number of rows in a full batch
+    :param float max_latency: seconds after which a partial batch is written even if no more rows arrive
+    :param int max_pending: number of full batches that may wait to be written
+    """
+
+    def __init__(self, write_fn, batch_size=1000, max_latency=None, max_pending=4):
+        self.write_fn = write_fn
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.rows_written = 0
+        self.batches_written = 0
+        self._queue = Queue(max_pending)
+        self._lock = threading.Lock()
+        self._batch = []
+        self._batch_started = None
+        self._queueing = 0
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, row):
+        """ Adds a row to the current batch, raising any error the flusher has hit so far """
+        if self._error is not None:
+            raise self._error
+        with self._lock:
+            batch = self._batch
+            if not batch:
+                self._batch_started = clock()
+            batch.append(row)
+            if len(batch) < self.batch_size:
+                return
+            self._batch = []
+            self._queueing += 1
+        self._queue.put(batch)
+        with self._lock:
+            self._queueing -= 1
+
+    def _take_stale_batch(self):
+        with self._lock:
+            # full batches still queued, or on their way to the queue, hold earlier rows and are written first
+            if self._queueing or not self._queue.empty():
+                return None
+            if self._batch and clock() - self._batch_started >= self.max_latency:
+                batch, self._batch = self._batch, []
+                return batch
+
+    def _run(self):
+        poll_interval = self.max_latency / 2.0 if self.max_latency else None
+        while True:
+            try:
+                batch = self._queue.get(timeout=poll_interval)
+            except Empty:
+                batch = self._take_stale_batch()
+                if batch is None:
+                    continue
+            if batch is _END:
+                return
+            # after an error, batches are still taken off the queue so add() never blocks forever
+            if self._error is None:
+                try:
+                    self.write_fn(batch)
+                    self.rows_written += len(batch)
+                    self.batches_written += 1
+                except Exception as error:
+                    self._error = error
+
+    def close(self, raise_errors=True):
+        """ Writes the last partial batch, waits for the flusher to finish, and raises any error it hit """
+        with self._lock:
+            batch, self._batch = self._batch, []
+        if batch:
+            self._queue.put(batch)
+        self._queue.put(_END)
+        self._thread.join()
+        if raise_errors and self._error is not None:
+            raise self._error
+
+
+def quote_identifier(name):
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+
+def row_columns(row):
+    """ Infers column names from a dict, namedtuple or object row """
+    if isinstance(row, dict):
+        return list(row.keys())
+    if hasattr(row, '_fields'):
+        return list(row._fields)
+    if hasattr(row, '__dict__'):
+        return list(vars(row).keys())
+    if hasattr(row, '__slots__'):
+        return list(row.__slots__)
+    raise ValueError("Can't infer column names from {!r}, pass columns explicitly".format(row))
+
+
+def row_values_getter(row, columns):
+    """ Builds a function that returns a row's values as a tuple, in column order """
+    if isinstance(row, (tuple, list)):
+        return tuple
+    getter = itemgetter(*columns) if isinstance(row, dict) else attrgetter(*columns)
+    if len(columns) == 1:
+        return lambda row: (getter(row),)
+    return getter
+
+
+class SqliteWriter(object):
+    """ Writes batches of rows into a sqlite table with ``executemany``, one transaction per batch.  The table is
+    created (with untyped columns) if it doesn't exist.
+
+    :param str path: path to the sqlite database
+    :param str table: name of the table to insert into
+    :param list[str] columns: column names, inferred from the first row if ``None``
+    """
+
+    def __init__(self, path, table, columns=None):
+        self.table = table
+        self.columns = columns
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._statement = None
+        self._values = None
+
+    def _prepare(self, row):
+        if self.columns is None:
+            self.columns = row_columns(row)
+        self._values = row_values_getter(row, self.columns)
+        table = quote_identifier(self.table)
+        columns = ', '.join(map(quote_identifier, self.columns))
+        self._connection.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(table, columns))
+        self._statement = "INSERT INTO {} ({}) VALUES ({})".format(
+            table, columns, ', '.join('?' * len(self.columns)))
+
+    def write(self, batch):
+        if self._statement is None:
+            self._prepare(batch[0])
+        with self._connection:
+            self._connection.executemany(self._statement, map(self._values, batch))
+
+    def close(self):
+        self._connection.close()
+
+
+replace = getattr(os, 'replace', os.rename)
+
+
+def create_temp_file(path):
+    """ Creates a temporary file next to ``path`` to be renamed over it, with the mode ``open`` would give a new
+    file there under the current umask
+
+    :return: ``(descriptor, temporary path)``
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp_path = os.path.join(directory, '.{}.{}.tmp'.format(name, uuid4().hex[:12]))
+        try:
+            return os.open(temp_path, flags, 0o666), temp_path
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+
+
+def open_replacement(path, buffer_size=-1):
+    """ Opens a file to replace ``path`` atomically: a temporary file next to it, to be renamed over it once complete.
+    Symlinks are followed, so their target is replaced rather than the link, and a file being replaced keeps its mode
+    (and owner, where that can be set).  Paths that aren't regular files, like devices and pipes, are written in place.
+
+    :return: ``(file, temporary path, path to rename it over)``, the temporary path ``None`` when written in place
+    """
+    target = os.path.realpath(path)
+    try:
+        existing = os.stat(target)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        existing = None
+    if existing is not None and not stat.S_ISREG(existing.st_mode):
+        return open(path, 'wb', buffer_size), None, target
+    descriptor, temp_path = create_temp_file(target)
+    if existing is not None:
+        os.chmod(temp_path, stat.S_IMODE(existing.st_mode))
+        if hasattr(os, 'chown'):
+            try:
+                os.chown(temp_path, existing.st_uid, existing.st_gid)
+            except OSError:
+                pass
+    return os.fdopen(descriptor, 'wb', buffer_size), temp_path, target
+
+
+COMPRESSION_EXTENSIONS = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+    '.lzma': 'xz',
+    '.zst': 'zstd',
+}
+
+
+def infer_compression(path):
+    """ Guesses compression from a path's extension, returning ``None`` for uncompressed files """
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def compressing_writer(raw, compression, level=None):
+    """ Wraps a binary file object so writes to it are compressed """
+    if compression is None:
+        return raw
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9 if level is None else level)
+    if compression == 'bz2':
+        return bz2.BZ2File(raw, 'wb', compresslevel=9 if level is None else level)
+    if compression == 'xz':
+        if lzma is None:
+            raise ValueError("xz compression needs the lzma module")
+        return lzma.LZMAFile(raw, 'wb', preset=level)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(raw)
+    raise ValueError("Invalid compression: {}, must be gzip, bz2, xz, zstd, infer or None".format(compression))
+
+
+def encode_lines(rows, encoding='utf-8', linesep=os.linesep):
+    """ Encodes a chunk of rows as lines, all at once when they're all text.  Bytes are kept as they are, and anything
+    else is converted with ``str``.
+
+    :rtype: bytes
+    """
+    if all(isinstance(row, text_type) for row in rows):
+        return (linesep.join(rows) + linesep).encode(encoding)
+    newline = linesep.encode(encoding)
+    return b''.join((row if isinstance(row, bytes) else text_type(row).encode(encoding)) + newline for row in rows)
+
+
+def write_lines(target, rows, encoding='utf-8', linesep=os.linesep, chunk_rows=1000):
+    """ Writes rows as lines to a binary file object, a chunk at a time, flushing after each chunk so readers on the
+    other end of a pipe see them without waiting for a full buffer
+
+    :return: number of rows written
+    :rtype: int
+    """
+    rows = iter(rows)
+    written = 0
+    while True:
+        chunk = list(islice(rows, chunk_rows))
+        if not chunk:
+            return written
+        target.write(encode_lines(chunk, encoding, linesep))
+        target.flush()
+        written += len(chunk)
+
+
+class FileSink(object):
+    """ Writes rows as lines to one or more files, encoding them in chunks and writing through a large buffer with
+    ``writelines`` rather than one write per row.  Files are written to a temporary file and renamed into place when
+    complete, so readers never see partial output.
+
+    :param str path: path to write to; when rotating, a template with an ``{index}`` field like ``'out-{index:04d}.gz'``
+    :param str compression: ``gzip``, ``bz2``, ``xz``, ``zstd``, ``None``, or ``infer`` to choose by file extension
+    :param int compression_level: level passed to the compressor, or its default if ``None``
+    :param int buffer_size: bytes collected before they are written
+    :param int rotate_bytes: start a new file once this many (uncompressed) bytes were written to the current one
+    :param int rotate_rows: start a new file once this many rows were written to the current one
+    :param bool atomic: write to a temporary file and rename it into place on completion, over a symlink's target
+        and keeping the replaced file's mode; devices and pipes are always written in place
+    :param bool append: append to existing files instead of replacing them (never atomic)
+    :param str encoding: encoding for text rows
+    :param str linesep: appended to each row
+    :param int chunk_rows: number of rows encoded at a time
+    """
+
+    def __init__(self, path, compression='infer', compression_level=None, buffer_size=1 << 20, rotate_bytes=None,
+                 rotate_rows=None, atomic=True, append=False, encoding='utf-8', linesep=os.linesep, chunk_rows=1000):
+        rotating = rotate_bytes is not None or rotate_rows is not None
+        if rotating and '{index' not in path:
+            raise ValueError("Rotating files needs a path template with an {index} field, like 'out-{index:04d}.txt'")
+        self.path = path
+        self.compression = compression
+        self.compression_level = compression_level
+        self.buffer_size = buffer_size
+        self.rotate_bytes = rotate_bytes
+        self.rotate_rows = rotate_rows
+        self.atomic = atomic and not append
+        self.append = append
+        self.encoding = encoding
+        self.linesep = linesep
+        self.chunk_rows = chunk_rows
+        self.paths = []
+        self.rows_written = 0
+        self._bytes_written = 0
+        self._index = 0
+        self._file = None
+
+    def _open(self):
+        path = self.path.format(index=self._index) if '{index' in self.path else self.path
+        self._index += 1
+        compression = infer_compression(path) if self.compression == 'infer' else self.compression
+        if self.atomic:
+            self._raw, self._temp_path, self._replaced_path = open_replacement(path, self.buffer_size)
+        else:
+            self._temp_path = None
+            self._raw = open(path, 'ab' if self.append else 'wb', self.buffer_size)
+        self._file = compressing_writer(self._raw, compression, self.compression_level)
+        self._final_path = path
+        self._file_bytes = 0
+        self._file_rows = 0
+        self._pending = []
+        self._pending_bytes = 0
+
+    def _flush(self):
+        if self._pending:
+            self._file.writelines(self._pending)
+            self._pending = []
+            self._pending_bytes = 0
+
+    def write_rows(self, rows):
+        """ Writes every row from an iterable """
+        rows = iter(rows)
+        while True:
+            chunk_rows = self.chunk_rows
+            file_rows, file_bytes = (self._file_rows, self._file_bytes) if self._file is not None else (0, 0)
+            if self.rotate_rows is not None:
+                chunk_rows = min(chunk_rows, self.rotate_rows - file_rows)
+            if self.rotate_bytes is not None:
+                # size chunks from the average row so far, so files end close to rotate_bytes
+                row_bytes = float(self._bytes_written) / self.rows_written if self.rows_written else None
+                fitting_rows = int((self.rotate_bytes - file_bytes) / row_bytes) if row_bytes else 1
+                chunk_rows = max(1, min(chunk_rows, fitting_rows))
+            chunk = list(islice(rows, chunk_rows))
+            if not chunk:
+                return
+            if self._file is None:
+                self._open()
+            encoded = encode_lines(chunk, self.encoding, self.linesep)
+            self._pending.append(encoded)
+            self._pending_bytes += len(encoded)
+            self._file_bytes += len(encoded)
+            self._file_rows += len(chunk)
+            self._bytes_written += len(encoded)
+            self.rows_written += len(chunk)
+            if self._pending_bytes >= self.buffer_size:
+                self._flush()
+            if ((self.rotate_rows is not None and self._file_rows >= self.rotate_rows) or
+                    (self.rotate_bytes is not None and self._file_bytes >= self.rotate_bytes)):
+                self._commit()
+
+    def _commit(self):
+        self._flush()
+        self._file.close()
+        self._raw.close()
+        if self._temp_path is not None:
+            replace(self._temp_path, self._replaced_path)
+        self.paths.append(self._final_path)
+        self._file = None
+
+    def close(self):
+        """ Writes any buffered rows and moves completed files into place
+
+        :return: paths of the files written
+        :rtype: list[str]
+        """
+        if self._file is None and not self.paths:
+            self._open()
+        if self._file is not None:
+            self._commit()
+        return self.paths
+
+    def abort(self):
+        """ Closes the current file, deleting it if it was being written atomically.  Rows written to a file in place
+        are kept, so an interrupted append loses none of the rows it was given.
+        """
+        if self._file is None:
+            return
+        try:
+            if self._temp_path is None:
+                self._flush()
+            self._file.close()
+            self._raw.close()
+        finally:
+            if self._temp_path is not None and os.path.exists(self._temp_path):
+                os.remove(self._temp_path)
+            self._file = None
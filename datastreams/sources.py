@@ -0,0 +1,593 @@
+from collections import deque
+from itertools import islice
+import bz2
+import glob
+import gzip
+import io
+import json
+import locale
+import mmap
+import os
+import re
+import stat
+import time
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .background import BackgroundReader, Queue, Empty
+from .records import record_constructor
+from .sinks import infer_compression, replace
+
+
+def connect(connection_or_factory):
+    """ Returns ``(connection, owned)``, calling the factory if given one instead of a DB-API connection """
+    if hasattr(connection_or_factory, 'cursor'):
+        return connection_or_factory, False
+    return connection_or_factory(), True
+
+
+def iter_sql(connection_or_factory, query, params=(), fetch_size=1000, record=tuple, cursor_name=None):
+    """ Streams the results of a query with ``fetchmany``, so only ``fetch_size`` rows are held at a time """
+    connection, owned = connect(connection_or_factory)
+    try:
+        cursor = connection.cursor(cursor_name) if cursor_name else connection.cursor()
+        try:
+            cursor.arraysize = fetch_size
+            cursor.execute(query, params)
+            constructor = record_constructor([column[0] for column in cursor.description], record)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield constructor(row)
+        finally:
+            cursor.close()
+    finally:
+        if owned:
+            connection.close()
+
+
+def partition_queries(connection_factory, query, params, column, partitions, bounds=None, placeholder='?'):
+    """ Splits a query into ``partitions`` queries over consecutive ranges of a numeric ``column``.  Without
+    ``bounds``, the range is the column's minimum and maximum in the query's results.  Rows where the column is
+    ``NULL`` aren't in any partition.
+
+    :rtype: list[(str, tuple)]
+    """
+    params = tuple(params)
+    if bounds is None:
+        bounds_query = "SELECT MIN({0}), MAX({0}) FROM ({1}) ds_bounds".format(column, query)
+        bounds = next(iter_sql(connection_factory, bounds_query, params))
+    low, high = bounds
+    if low is None:
+        return [(query, params)]
+    partition_query = "SELECT * FROM ({}) ds_partition WHERE {} >= {} AND {} {} {}"
+    queries = []
+    for i in range(partitions):
+        start = low + (high - low) * i / float(partitions)
+        end = low + (high - low) * (i + 1) / float(partitions)
+        last = i == partitions - 1
+        queries.append((partition_query.format(query, column, placeholder, column, '<=' if last else '<',
+                                               placeholder), params + (start, end)))
+    return queries
+
+
+MAGIC_NUMBERS = [
+    (re.compile(re.escape(b'\x1f\x8b')), 'gzip'),
+    # a block or the end of the stream follows bz2's header, so text starting 'BZh' isn't taken for it
+    (re.compile(b'BZh[1-9](1AY&SY|\x17rE8P\x90)'), 'bz2'),
+    (re.compile(re.escape(b'\xfd7zXZ\x00')), 'xz'),
+    (re.compile(re.escape(b'\x28\xb5\x2f\xfd')), 'zstd'),
+]
+MAGIC_LENGTH = 10
+
+
+def sniff_compression(source_file):
+    """ Detects compression from the first bytes of a buffered binary file, peeking so they're still read after """
+    head = source_file.peek(MAGIC_LENGTH)[:MAGIC_LENGTH]
+    for magic, compression in MAGIC_NUMBERS:
+        if magic.match(head):
+            return compression
+    return None
+
+
+def detect_compression(path):
+    """ Detects compression from a path's extension, or failing that a regular file's first bytes.  Pipes and other
+    files that can only be read once aren't sniffed, and are taken to be uncompressed.
+    """
+    compression = infer_compression(path)
+    if compression is not None or not os.path.isfile(path):
+        return compression
+    with open(path, 'rb') as source_file:
+        return sniff_compression(source_file)
+
+
+def decompressing_reader(path, compression):
+    """ Opens a compressed file as a binary file object of decompressed bytes """
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(path, 'rb')
+    if compression == 'xz':
+        if lzma is None:
+            raise ValueError("xz decompression needs the lzma module")
+        return lzma.LZMAFile(path, 'rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd decompression needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    raise ValueError("Invalid compression: {}, must be gzip, bz2, xz, zstd, infer or None".format(compression))
+
+
+def iter_chunks(source_file, chunk_size=1 << 20):
+    """ Reads a binary file in chunks, closing it when done """
+    try:
+        while True:
+            chunk = source_file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        source_file.close()
+
+
+class ChunkReader(io.RawIOBase):
+    """ Raw binary stream over chunks of bytes handed over by a :py:class:`BackgroundReader` """
+
+    def __init__(self, reader):
+        self._reader = reader
+        self._chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not len(self._chunk):
+            chunk = self._reader.get_chunk()
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk[0])
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._reader.close()
+        super(ChunkReader, self).close()
+
+
+def open_binary(path, compression='infer', background=True, chunk_size=1 << 20, max_pending=4):
+    """ Opens a possibly compressed file for reading bytes.  Compressed files are decompressed on a background
+    thread, ``chunk_size`` bytes at a time, so decompression overlaps with whatever is done with the lines.
+
+    :param str path: path to the file
+    :param str compression: ``gzip``, ``bz2``, ``xz``, ``zstd``, ``None``, or ``infer`` to detect from the
+        extension or first bytes
+    :param bool background: decompress on a background thread
+    :param int chunk_size: bytes decompressed at a time
+    :param int max_pending: decompressed chunks that may wait to be read
+    :rtype: io.BufferedIOBase
+    """
+    if compression == 'infer':
+        compression = infer_compression(path)
+        if compression is None:
+            source_file = open(path, 'rb')
+            if not stat.S_ISREG(os.fstat(source_file.fileno()).st_mode):
+                return source_file
+            compression = sniff_compression(source_file)
+            if compression is None:
+                return source_file
+            source_file.close()
+    if compression is None:
+        return open(path, 'rb')
+    decompressed = decompressing_reader(path, compression)
+    if not background:
+        return decompressed
+    reader = BackgroundReader(iter_chunks(decompressed, chunk_size), max_pending=max_pending)
+    return io.BufferedReader(ChunkReader(reader), chunk_size)
+
+
+def open_text(path, compression='infer', encoding=None, background=True, chunk_size=1 << 20):
+    """ Opens a possibly compressed file for reading text, like :py:func:`open`.  See :py:func:`open_binary`. """
+    if compression is None:
+        return io.open(path, 'r', encoding=encoding)
+    return io.TextIOWrapper(open_binary(path, compression, background, chunk_size), encoding=encoding)
+
+
+FILE_MODES = ('text', 'bytes', 'memoryview')
+
+
+def iter_mapped_lines(path, offset=0, as_memoryview=False):
+    """ Yields the lines of an uncompressed file, newlines included, by finding line boundaries in a memory map of
+    it.  Lines are ``bytes``, or with ``as_memoryview`` zero-copy ``memoryview`` slices of the map, which stays
+    mapped until the last of them is released.
+
+    :param str path: path to the file
+    :param int offset: byte offset to start reading from, normally the start of a line
+    :param bool as_memoryview: yield ``memoryview`` slices instead of ``bytes``
+    """
+    with open(path, 'rb') as source_file:
+        size = os.fstat(source_file.fileno()).st_size
+        if size <= offset:
+            return
+        mapped = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+    lines = memoryview(mapped) if as_memoryview else mapped
+    find = mapped.find
+    start = offset
+    try:
+        while start < size:
+            end = find(b'\n', start) + 1 or size
+            yield lines[start:end]
+            start = end
+    finally:
+        if as_memoryview:
+            lines.release()
+        try:
+            mapped.close()
+        except BufferError:
+            pass  # slices are still held, the map is closed once they're garbage collected
+
+
+def iter_lines(path, compression='infer', encoding=None, mode='text', offset=0):
+    """ Yields the lines of a possibly compressed file.  Uncompressed files read in ``bytes`` or ``memoryview`` mode
+    are memory mapped, see :py:func:`iter_mapped_lines`.
+
+    :param str path: path to the file
+    :param str compression: ``gzip``, ``bz2``, ``xz``, ``zstd``, ``None``, or ``infer``
+    :param str encoding: text encoding for ``text`` mode
+    :param str mode: ``text`` for ``str`` lines, ``bytes`` or ``memoryview`` for undecoded lines
+    :param int offset: byte offset to start reading from, only for uncompressed files
+    """
+    if mode not in FILE_MODES:
+        raise ValueError("Invalid mode: {}, must be one of {}".format(mode, ', '.join(FILE_MODES)))
+    # the file isn't touched until the first line is read, so streams that are never read don't open it
+    return _iter_lines(path, compression, encoding, mode, offset)
+
+
+def _iter_lines(path, compression, encoding, mode, offset):
+    if compression == 'infer':
+        compression = detect_compression(path)
+    if compression is not None and (offset or mode == 'memoryview'):
+        raise ValueError("Offsets and memoryview mode need an uncompressed file, {} is {}".format(path, compression))
+    if compression is None and mode != 'text' and (offset or mode == 'memoryview' or os.path.isfile(path)):
+        lines = iter_mapped_lines(path, offset, mode == 'memoryview')
+    else:
+        lines = _iter_file_lines(path, compression, encoding, mode, offset)
+    try:
+        for line in lines:
+            yield line
+    finally:
+        lines.close()
+
+
+def _iter_file_lines(path, compression, encoding, mode, offset):
+    if offset:
+        source_file = io.open(path, 'rb')
+        source_file.seek(offset)
+        source_file = io.TextIOWrapper(source_file, encoding=encoding)
+    elif mode == 'bytes':
+        source_file = open_binary(path, compression)
+    else:
+        source_file = open_text(path, compression, encoding)
+    with source_file:
+        for line in source_file:
+            yield line
+
+
+def iter_line_range(path, start, end, mode='text', encoding=None):
+    """ Yields the lines starting in the byte range ``[start, end)`` of an uncompressed file, so ranges that split a
+    file between them read each of its lines exactly once
+
+    :param str mode: ``text`` for ``str`` lines, or ``bytes``
+    """
+    encoding = encoding or locale.getpreferredencoding(False)
+    with io.open(path, 'rb') as source_file:
+        if start:
+            # the line running into the range belongs to the range before
+            source_file.seek(start - 1)
+            source_file.readline()
+        position = source_file.tell()
+        while position < end:
+            line = source_file.readline()
+            if not line:
+                return
+            position += len(line)
+            yield line if mode == 'bytes' else line.decode(encoding)
+
+
+def expand_paths(paths):
+    """ Expands glob patterns in a path or list of paths, each pattern's matches in sorted order.  Paths without
+    wildcards are kept as they are, even if they don't exist.
+
+    :rtype: list[str]
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    expanded = []
+    for path in paths:
+        if any(wildcard in path for wildcard in '*?['):
+            expanded.extend(sorted(glob.glob(path)))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def iter_files(paths, compression='infer', encoding=None, mode='text', parallel=None, ordered=False,
+               chunk_size=1000, max_pending=16):
+    """ Yields the lines of several files.  With ``parallel``, up to that many files are read at once on background
+    threads, each reading ahead at most ``max_pending`` chunks of ``chunk_size`` lines.  Unordered, lines are yielded
+    as soon as any file has them; ordered, files are still yielded one after another, in path order.
+
+    Files are closed as soon as they're read, and closing the iterator (or dropping it) stops the threads and closes
+    any files still open.
+
+    :param paths: path, glob pattern, or list of them
+    :param int parallel: number of files read at once, or ``None`` to read them one after another on this thread
+    :param bool ordered: keep the lines of each file together, in path order
+    """
+    paths = expand_paths(paths)
+    if not parallel:
+        return _iter_serial(paths, compression, encoding, mode)
+    if ordered:
+        return _iter_ordered(paths, parallel, compression, encoding, mode, chunk_size, max_pending)
+    return _iter_unordered(paths, parallel, compression, encoding, mode, chunk_size, max_pending)
+
+
+def _iter_serial(paths, compression, encoding, mode):
+    for path in paths:
+        lines = iter_lines(path, compression, encoding, mode)
+        try:
+            for line in lines:
+                yield line
+        finally:
+            if hasattr(lines, 'close'):
+                lines.close()
+
+
+def _iter_ordered(paths, parallel, compression, encoding, mode, chunk_size, max_pending):
+    paths = iter(paths)
+    readers = deque()
+
+    def read_ahead():
+        for path in islice(paths, parallel - len(readers)):
+            lines = _iter_serial([path], compression, encoding, mode)
+            readers.append(BackgroundReader(lines, max_pending=max_pending, chunk_size=chunk_size))
+
+    try:
+        read_ahead()
+        while readers:
+            for line in readers[0]:
+                yield line
+            readers.popleft()
+            read_ahead()
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+def _iter_unordered(paths, parallel, compression, encoding, mode, chunk_size, max_pending):
+    # each thread takes the next unread path off a shared queue
+    queue = Queue()
+    for path in paths:
+        queue.put(path)
+
+    def read_queued():
+        while True:
+            try:
+                path = queue.get_nowait()
+            except Empty:
+                return
+            lines = _iter_serial([path], compression, encoding, mode)
+            try:
+                for line in lines:
+                    yield line
+            finally:
+                lines.close()
+
+    # the reader starts on the first read, so a stream dropped before then has no threads or files to close
+    threads = min(parallel, queue.qsize())
+    reader = BackgroundReader.merging([read_queued() for _ in range(threads)], max_pending=max_pending,
+                                      chunk_size=chunk_size)
+    try:
+        for line in reader:
+            yield line
+    finally:
+        reader.close()
+
+
+def read_follow_offset(offset_path):
+    """ Reads the ``{'inode': ..., 'offset': ...}`` saved by :py:func:`follow_lines`, or ``None`` if there isn't one """
+    try:
+        with open(offset_path) as offset_file:
+            return json.load(offset_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_follow_offset(offset_path, inode, offset):
+    temp_path = offset_path + '.tmp'
+    with open(temp_path, 'w') as offset_file:
+        json.dump({'inode': inode, 'offset': offset}, offset_file)
+    replace(temp_path, offset_path)
+
+
+def follow_lines(path, poll_interval=1.0, from_end=True, offset_path=None, mode='text', encoding='utf-8',
+                 chunk_size=1 << 20, checkpoint_interval=1.0, idle_timeout=None):
+    """ Yields lines from a file as it grows, like ``tail -F``.  The file is read in chunks of ``chunk_size`` bytes,
+    and polled every ``poll_interval`` seconds once there's nothing new.  When the path is moved away and recreated
+    (rotated), the old file is read to its end before following the new one from its start; when the file shrinks
+    (truncated), it's followed from its start again.  A partial last line is held back until its newline arrives.
+
+    With ``offset_path``, the inode and byte offset of the next unprocessed line are saved there at most every
+    ``checkpoint_interval`` seconds, whenever the file is caught up with, and when the iterator is closed; following
+    the same file again with the same ``offset_path`` resumes from there.  A line counts as processed once the next
+    one is asked for, so only a line that was being processed when the pipeline stopped is read again.
+
+    :param str path: path to the file
+    :param float poll_interval: seconds to wait before checking the file again
+    :param bool from_end: start at the file's current end, rather than its start, unless resuming
+    :param str offset_path: path to save the offset at
+    :param str mode: ``text`` for ``str`` lines, or ``bytes``
+    :param str encoding: encoding for ``text`` mode, which must encode newlines as ``\\n`` bytes
+    :param int chunk_size: bytes read at a time
+    :param float checkpoint_interval: seconds between saving offsets
+    :param float idle_timeout: stop after this many seconds without new lines, or ``None`` to follow forever
+    """
+    if mode not in ('text', 'bytes'):
+        raise ValueError("Invalid mode: {}, must be text or bytes".format(mode))
+    start = read_follow_offset(offset_path) if offset_path else None
+    if start is None and from_end:
+        try:
+            stat = os.stat(path)
+            start = {'inode': stat.st_ino, 'offset': stat.st_size}
+        except (IOError, OSError):
+            pass  # followed from its start once it exists
+    return _follow_lines(path, start, poll_interval, offset_path, mode, encoding, chunk_size, checkpoint_interval,
+                         idle_timeout)
+
+
+def _follow_lines(path, start, poll_interval, offset_path, mode, encoding, chunk_size, checkpoint_interval,
+                  idle_timeout):
+    source_file = None
+    inode = None
+    position = 0  # offset of the first line that hasn't been processed yet
+    saved_position = None
+    checkpointed = time.time()
+    idle_since = time.time()
+    buffer = b''
+
+    def checkpoint(force=False):
+        if offset_path is not None and inode is not None and position != saved_position and \
+                (force or time.time() - checkpointed >= checkpoint_interval):
+            write_follow_offset(offset_path, inode, position)
+            return position, time.time()
+        return saved_position, checkpointed
+
+    def emit(line):
+        return line.decode(encoding) if mode == 'text' else line
+
+    try:
+        while True:
+            if source_file is None:
+                try:
+                    source_file = open(path, 'rb')
+                except (IOError, OSError):
+                    if idle_timeout is not None and time.time() - idle_since >= idle_timeout:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+                stat = os.fstat(source_file.fileno())
+                inode = stat.st_ino
+                # a start in another inode means the file was rotated since, so the new one is read from its start
+                if start is not None and start.get('inode') == inode and start.get('offset', 0) <= stat.st_size:
+                    position = start['offset']
+                else:
+                    position = 0
+                start = None
+                source_file.seek(position)
+                buffer = b''
+
+            chunk = source_file.read(chunk_size)
+            if chunk:
+                lines = (buffer + chunk).split(b'\n')
+                buffer = lines.pop()
+                for line in lines:
+                    line += b'\n'
+                    yield emit(line)
+                    position += len(line)
+                    saved_position, checkpointed = checkpoint()
+                idle_since = time.time()
+                continue
+
+            saved_position, checkpointed = checkpoint(force=True)
+            try:
+                stat = os.stat(path)
+            except (IOError, OSError):
+                stat = None
+            if stat is not None and stat.st_ino != inode:
+                # rotated: whatever was written to the old file before it was moved is read, last line and all
+                lines = (buffer + source_file.read()).split(b'\n')
+                last = lines.pop()
+                for line in [line + b'\n' for line in lines] + ([last] if last else []):
+                    yield emit(line)
+                    position += len(line)
+                    saved_position, checkpointed = checkpoint()
+                source_file.close()
+                source_file = None
+                continue
+            if stat is not None and stat.st_size < source_file.tell():
+                source_file.seek(0)
+                position = 0
+                buffer = b''
+                continue
+            if idle_timeout is not None and time.time() - idle_since >= idle_timeout:
+                return
+            time.sleep(poll_interval)
+    finally:
+        if source_file is not None:
+            source_file.close()
+        checkpoint(force=True)
+
+
+def decode_newlines(block, encoding):
+    """ Decodes a block of lines, translating ``'\\r\\n'`` and ``'\\r'`` newlines to ``'\\n'`` """
+    block = block.decode(encoding)
+    if '\r' in block:
+        block = block.replace('\r\n', '\n').replace('\r', '\n')
+    return block
+
+
+def iter_stream_lines(source, mode='text', encoding=None, keepends=True, chunk_size=1 << 20):
+    """ Yields lines from a binary file object like ``sys.stdin.buffer``, taking up to ``chunk_size`` bytes at a time
+    of whatever is available and decoding and splitting each chunk's complete lines all at once.  Text lines end in
+    ``'\\n'`` whether they ended in ``'\\r\\n'``, ``'\\r'`` or ``'\\n'``, like text read from stdin with universal
+    newlines; bytes lines are left as they are.
+
+    :param source: binary file object
+    :param str mode: ``text`` for ``str`` lines, or ``bytes``
+    :param str encoding: text encoding, defaults to the locale's
+    :param bool keepends: keep the newline at the end of each line
+    :param int chunk_size: bytes read at a time
+    """
+    if mode not in ('text', 'bytes'):
+        raise ValueError("Invalid mode: {}, must be text or bytes".format(mode))
+    encoding = encoding or locale.getpreferredencoding(False)
+    read = getattr(source, 'read1', source.read)
+    newline = '\n' if mode == 'text' else b'\n'
+    remainder = b''
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            if mode == 'text':
+                # the last line, and any ended by a lone '\r' since the last '\n', are split from each other here
+                remainder = decode_newlines(remainder, encoding)
+                lines = remainder.split(newline)
+                remainder = lines.pop()
+                for line in lines:
+                    yield line + newline if keepends else line
+            if remainder:
+                yield remainder
+            return
+        end = chunk.rfind(b'\n') + 1
+        if not end:
+            remainder += chunk
+            continue
+        block = remainder + chunk[:end]
+        remainder = chunk[end:]
+        if mode == 'text':
+            block = decode_newlines(block, encoding)
+        lines = block.split(newline)
+        lines.pop()
+        if keepends:
+            lines = [line + newline for line in lines]
+        for line in lines:
+            yield line
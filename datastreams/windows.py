@@ -0,0 +1,98 @@
+from heapq import heappush, heappop
+from itertools import count
+try:
+    from collections import namedtuple
+except ImportError:
+    from backport_collections import namedtuple
+
+
+TimeWindow = namedtuple('TimeWindow', ['key', 'start', 'end', 'rows'])
+
+
+def iter_time_windows(rows, ts_fn, size, slide, key_fn=None, allowed_lateness=0, late_fn=None, collect=list):
+    """ Assigns rows to tumbling (``slide == size``) or sliding windows aligned to multiples of ``slide``, emitting
+    each window once the watermark (latest timestamp seen, minus ``allowed_lateness``) passes its end.  Rows that
+    arrive for windows that were already emitted are passed to ``late_fn``, or dropped.
+    """
+    windows = {}
+    closing = []
+    sequence = count()
+    watermark = None
+    for row in rows:
+        ts = ts_fn(row)
+        if watermark is None or ts - allowed_lateness > watermark:
+            watermark = ts - allowed_lateness
+        key = key_fn(row) if key_fn is not None else None
+        start = ts - ts % slide
+        placed = False
+        while start + size > ts:
+            end = start + size
+            if end > watermark:
+                window = windows.get((key, start))
+                if window is None:
+                    window = windows[(key, start)] = []
+                    heappush(closing, (end, next(sequence), key, start))
+                window.append(row)
+                placed = True
+            start -= slide
+        if not placed and late_fn is not None:
+            late_fn(row)
+        while closing and closing[0][0] <= watermark:
+            end, _, key, start = heappop(closing)
+            yield TimeWindow(key, start, end, collect(windows.pop((key, start))))
+    while closing:
+        end, _, key, start = heappop(closing)
+        yield TimeWindow(key, start, end, collect(windows.pop((key, start))))
+
+
+def iter_session_windows(rows, ts_fn, gap, key_fn=None, allowed_lateness=0, late_fn=None, collect=list):
+    """ Groups rows into sessions per key, where a session ends after ``gap`` without rows.  Sessions are emitted once
+    the watermark (latest timestamp seen, minus ``allowed_lateness``) passes the session's last timestamp plus
+    ``gap``.  Out of order rows can extend sessions or merge neighbouring ones until then.
+    """
+    sessions = {}
+    closing = []
+    sequence = count()
+    watermark = None
+    for row in rows:
+        ts = ts_fn(row)
+        if watermark is None or ts - allowed_lateness > watermark:
+            watermark = ts - allowed_lateness
+        key = key_fn(row) if key_fn is not None else None
+        # sessions are [start, last, rows, open]
+        merging, remaining = [], []
+        for session in sessions.get(key, ()):
+            (merging if session[0] - gap < ts < session[1] + gap else remaining).append(session)
+        if not merging and ts + gap <= watermark:
+            if late_fn is not None:
+                late_fn(row)
+        else:
+            session = [ts, ts, [], True]
+            for merged in merging:
+                merged[3] = False
+                session[0] = min(session[0], merged[0])
+                session[1] = max(session[1], merged[1])
+                session[2].extend(merged[2])
+            session[2].append(row)
+            remaining.append(session)
+            sessions[key] = remaining
+            heappush(closing, (session[1] + gap, next(sequence), key, session))
+        while closing and closing[0][0] <= watermark:
+            for window in _close_session(closing, sessions, gap, collect):
+                yield window
+    while closing:
+        for window in _close_session(closing, sessions, gap, collect):
+            yield window
+
+
+def _close_session(closing, sessions, gap, collect):
+    end, _, key, session = heappop(closing)
+    # sessions that were merged or extended leave stale entries behind
+    if session[3] and session[1] + gap == end:
+        session[3] = False
+        remaining = [other for other in sessions[key] if other is not session]
+        if remaining:
+            sessions[key] = remaining
+        else:
+            del sessions[key]
+        yield TimeWindow(key, session[0], end, collect(session[2]))
@@ -0,0 +1,43 @@
+""" Serves workers for remote stages, see :py:func:`DataStream.remote`.  Workers unpickle the functions they're sent,
+so by default they only listen on localhost, and won't listen where other hosts can reach them without an authkey.
+"""
+import argparse
+import os
+import sys
+
+from datastreams.remotestreams import RemoteError, WorkerServer, DEFAULT_PORT
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(prog='python -m datastreams.worker',
+                                     description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1', help="interface to listen on, '' for all (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="port to listen on (default: %(default)s)")
+    parser.add_argument('--authkey', default=os.environ.get('DATASTREAMS_AUTHKEY'),
+                        help="key coordinators must have (default: $DATASTREAMS_AUTHKEY)")
+    parser.add_argument('--insecure', action='store_true',
+                        help="listen on other interfaces without an authkey, letting anyone who connects run code")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    options = parse_args(args)
+    try:
+        server = WorkerServer((options.host, options.port), options.authkey, options.insecure)
+    except RemoteError as error:
+        sys.stderr.write("{}; pass --authkey, or --insecure to listen anyway\n".format(error))
+        return 2
+    host, port = server.server_address[:2]
+    print("Serving remote stage workers on {}:{}".format(host or '*', port))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
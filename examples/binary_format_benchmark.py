@@ -0,0 +1,56 @@
+__author__ = 'stuart'
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from datastreams import DataStream, Datum, record_type
+
+N_ROWS = 200000
+
+Person = record_type(['name', 'age', 'height'])
+
+
+def people(record):
+    return DataStream(range(N_ROWS)).map(lambda n: record('person{}'.format(n), n % 90, 150.0 + n % 50))
+
+
+def timed(label, round_trip):
+    started = datetime.now()
+    rows = round_trip()
+    print("{:<36} {} ({} rows)".format(label, datetime.now() - started, rows))
+
+
+workdir = tempfile.mkdtemp()
+
+
+def csv_round_trip():
+    path = os.path.join(workdir, 'people.csv')
+    people(lambda *values: ','.join(map(str, values))).to_file(path, linesep='\n')
+    return DataStream.from_csv(path, headers=Person._fields).count()
+
+
+def jsonl_round_trip():
+    path = os.path.join(workdir, 'people.jsonl')
+    people(Person).to_jsonl(path)
+    return DataStream.from_jsonl(path, fields=Person._fields, record='slots').count()
+
+
+def binary_round_trip(record, compression=None):
+    def round_trip():
+        path = os.path.join(workdir, 'people.bin')
+        people(record).to_binary(path, compression=compression)
+        return DataStream.from_binary(path).count()
+    return round_trip
+
+
+try:
+    timed("csv, to_file + from_csv", csv_round_trip)
+    timed("json lines, to_jsonl + from_jsonl", jsonl_round_trip)
+    timed("binary, Datum rows", binary_round_trip(lambda name, age, height: Datum({'name': name, 'age': age,
+                                                                                   'height': height})))
+    timed("binary, tuples", binary_round_trip(lambda *values: values))
+    timed("binary, slotted records", binary_round_trip(Person))
+    timed("binary, slotted records with zlib", binary_round_trip(Person, 'zlib'))
+finally:
+    shutil.rmtree(workdir)
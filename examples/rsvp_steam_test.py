@@ -1,4 +1,4 @@
-import websocket, json
+import websocket
 from datastreams import *
 from pprint import pprint
 
@@ -8,16 +8,12 @@ def rsvp_source():
     while True:
         yield ws.recv()
 
-def log(rsvp):
-    with open('rsvps.json', 'a') as log:
-        log.write(json.dumps(rsvp) + '\n')
-
-DataStream(rsvp_source())\
-    .filter(lambda s: 'seattle' in s.lower())\
-    .map(json.loads)\
-    .for_each(log)\
+# filter on the raw text before decoding, and decode each rsvp as it arrives rather than waiting for a chunk;
+# rsvps are appended to the log as they arrive, through one open file instead of reopening it for each one
+seattle_rsvps = DataStream(rsvp_source()).filter(lambda s: 'seattle' in s.lower())
+DictStream.from_jsonl(seattle_rsvps, chunk_size=1)\
     .for_each(pprint)\
-    .execute()
+    .to_jsonl('rsvps.json', append=True, chunk_rows=1, buffer_size=0)
 
 
 ################################################################################
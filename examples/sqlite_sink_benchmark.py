@@ -0,0 +1,39 @@
+__author__ = 'stuart'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+from datastreams import DataStream, Datum
+
+N_ROWS = 20000
+
+
+def people():
+    return DataStream(range(N_ROWS)).map(lambda n: Datum({'name': 'person{}'.format(n), 'age': n % 90}))
+
+
+def save_one(connection):
+    def save(person):
+        with connection:
+            connection.execute('INSERT INTO people (name, age) VALUES (?, ?)', (person.name, person.age))
+    return save
+
+
+workdir = tempfile.mkdtemp()
+try:
+    per_row_path = os.path.join(workdir, 'per_row.db')
+    connection = sqlite3.connect(per_row_path)
+    connection.execute('CREATE TABLE people (name, age)')
+    started = datetime.now()
+    people().for_each(save_one(connection)).execute()
+    connection.close()
+    print("for_each, one transaction per row: {}".format(datetime.now() - started))
+
+    batched_path = os.path.join(workdir, 'batched.db')
+    started = datetime.now()
+    stats = people().to_sqlite(batched_path, 'people', batch_size=5000)
+    print("to_sqlite, {} rows in batches of 5000: {}".format(stats.rows, datetime.now() - started))
+finally:
+    shutil.rmtree(workdir)
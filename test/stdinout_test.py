@@ -1,3 +1,4 @@
 from datastreams.datastreams import *
 
-DataStream.from_stdin().map(lambda line: line.upper()).pipe_to_stdout()
+if __name__ == '__main__':
+    DataStream.from_stdin().map(lambda line: line.upper()).pipe_to_stdout()
@@ -5,7 +5,39 @@ currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentfram
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir)
 
-from datastreams import DataSet, DataStream, Datum, DictSet, DictStream
+from datastreams import DataSet, DataStream, Datum, DictSet, DictStream, PartitionedStream, PersistentDataSet, \
+    RollingAggregator, record_type
+import bz2
+import gc
+import gzip
+import io
+import multiprocessing
+import random
+import shutil
+import socket
+import sqlite3
+import stat
+import subprocess
+import tempfile
+import threading
+import time
+from operator import attrgetter
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import pyspark
+except ImportError:
+    pyspark = None
+try:
+    import cloudpickle
+except ImportError:
+    cloudpickle = None
 if sys.version_info[0] == 2 and sys.version_info[1] < 7:
     import unittest2 as unittest
 else:
@@ -107,6 +139,47 @@ class StreamTests(unittest.TestCase):
         filtered = list(stream.filters([odd_filter, gt5filter]))
         self.assertListEqual(filtered, [7, 9, 11, 13])
 
+    def test_filters_short_circuit(self):
+        calls = []
+
+        def never(num):
+            calls.append(num)
+            return False
+
+        DataStream(range(10)).filters([never, never]).execute()
+        self.assertEqual(len(calls), 10)
+
+    def test_filters_adaptive(self):
+        slow_calls = []
+
+        def slow_filter(num):
+            slow_calls.append(num)
+            return sum(range(200)) > 0
+
+        rare_filter = lambda num: num % 10 == 0
+        stream = DataStream(range(1000))\
+            .filters([slow_filter, rare_filter], adaptive=True, sample_size=100)
+        self.assertListEqual(stream.to_list(), list(range(0, 1000, 10)))
+
+        stats = stream.filter_stats()
+        self.assertEqual(stats[0].index, 1)
+        self.assertEqual(stats[0].calls, 100)
+        self.assertAlmostEqual(stats[0].pass_rate, 0.1)
+        self.assertEqual(len(slow_calls), 100 + 90)
+
+    def test_filters_adaptive_guard(self):
+        guarded = [lambda row: row is not None, lambda row: row['x'] > 5]
+        rows = [{'x': n % 20} for n in range(100)] + [None] + [{'x': 10}] * 10
+        self.assertEqual(DataStream(rows).filters(guarded).count(), 80)
+        for sample_size in (10, 200):
+            stream = DataStream(rows).filters(guarded, adaptive=True, sample_size=sample_size)
+            self.assertEqual(stream.count(), 80)
+            self.assertListEqual([stats.index for stats in stream.filter_stats()], [0, 1])
+
+        broken = DataStream([{'x': 1}] * 20 + [{}]).filters([lambda row: True, lambda row: row['x'] > 5],
+                                                            adaptive=True, sample_size=5)
+        self.assertRaises(KeyError, broken.execute)
+
     def test_filter_builtin(self):
         stream = DataStream(range(14))
         odds = list(filter(lambda num: num % 2, stream))
@@ -164,6 +237,81 @@ class StreamTests(unittest.TestCase):
         batched = DataStream(range(4)).batch(2).to_list()
         self.assertEqual(len(batched), 2)
 
+    def test_batch_max_wait(self):
+        resumed = threading.Event()
+
+        def trickle():
+            for num in range(5):
+                yield num
+            resumed.wait(10)
+            yield 5
+
+        batched = DataStream(trickle()).batch(100, max_wait=0.05)
+        self.assertListEqual(next(batched).to_list(), [0, 1, 2, 3, 4])
+        # the partial batch came out while the source was still stalled
+        self.assertFalse(resumed.is_set())
+        resumed.set()
+        self.assertListEqual(next(batched).to_list(), [5])
+        self.assertRaises(StopIteration, next, batched)
+
+        full = DataStream(range(9)).batch(4, max_wait=10).map(lambda batch: batch.to_list())
+        self.assertListEqual(full.to_list(), [[0, 1, 2, 3], [4, 5, 6, 7], [8]])
+
+    def test_batch_max_wait_error(self):
+        def broken():
+            yield 1
+            raise ValueError("broken source")
+
+        batched = DataStream(broken()).batch(10, max_wait=0.05)
+        self.assertRaises(ValueError, batched.to_list)
+
+    def test_map_partitions_and_aggregate_by(self):
+        self.assertListEqual(DataStream(range(5)).map_partitions(lambda rows: [sum(rows)]).to_list(), [10])
+        calls = []
+        summed = DataStream(range(5)).map_partitions(lambda rows: calls.append(1) or [sum(rows)])
+        self.assertListEqual(calls, [])
+        self.assertListEqual(summed.to_list(), [10])
+        words = DataStream(['hi', 'hey', 'yo', 'sup', 'hello'])
+        lengths = words.aggregate_by(len, [], lambda seen, word: seen + [word[0]], lambda a, b: a + b).to_dict()
+        self.assertDictEqual(lengths, {2: ['h', 'y'], 3: ['h', 's'], 5: ['h']})
+
+    def test_prefetch(self):
+        read_ahead = threading.Event()
+        overlapped = []
+
+        def source():
+            for num in range(20):
+                if num == 3:
+                    read_ahead.set()
+                yield num
+
+        def slow_map(num):
+            # without prefetching the source can't get past the row being mapped
+            if num == 0:
+                overlapped.append(read_ahead.wait(10))
+            return num * 2
+
+        self.assertListEqual(DataStream(source()).prefetch(5, chunk_size=1).map(slow_map).to_list(),
+                             [num * 2 for num in range(20)])
+        self.assertListEqual(overlapped, [True])
+        self.assertListEqual(DataStream(range(1000)).prefetch(10).batch(300).map(len).to_list(), [300, 300, 300, 100])
+
+    def test_prefetch_error_and_early_exit(self):
+        def broken():
+            yield 1
+            raise ValueError("broken source")
+
+        self.assertRaises(ValueError, DataStream(broken()).prefetch().to_list)
+        threads = threading.active_count()
+        self.assertListEqual(DataStream(range(100000)).prefetch(100).take(3).to_list(), [0, 1, 2])
+        gc.collect()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_window_short_source(self):
+        self.assertListEqual(DataStream(range(2)).window(5, 1).map(lambda window: window.to_list()).to_list(),
+                             [[0, 1]])
+        self.assertListEqual(DataStream([]).window(5, 1).to_list(), [])
+
     def test_window(self):
         stream = DataStream(range(10))
         windowed = stream.window(3, 2)
@@ -173,6 +321,15 @@ class StreamTests(unittest.TestCase):
         self.assertSequenceEqual(next(windowed).to_list(), [6, 7, 8])
         self.assertSequenceEqual(next(windowed).to_list(), [8, 9])
 
+    def test_window_long(self):
+        windows = DataStream(range(1000)).window(100, 1).map(lambda window: window.to_list())
+        for start, window in enumerate(windows.take(901)):
+            self.assertListEqual(window, list(range(start, start + 100)))
+
+    def test_window_wide_interval(self):
+        windowed = DataStream(range(10)).window(2, 4).map(lambda window: window.to_list())
+        self.assertListEqual(windowed.to_list(), [[0, 1], [4, 5], [8, 9]])
+
     def test_concat(self):
         stream = DataStream([[], [1], [2, 3]])
         flattened = stream.concat()
@@ -261,6 +418,31 @@ class StreamTests(unittest.TestCase):
         self.assertEqual(brad.name, 'brad')
         self.assertEqual(brad.age, 30)
 
+    def test_assign(self):
+        original = Datum({'name': 'b-rad', 'age': 21})
+        stream = DataStream([original]) \
+            .assign(name=lambda row: 'brad', age=lambda row: row.age + 1, was=lambda row: row.name)
+
+        brad = next(stream)
+        self.assertEqual(brad.name, 'brad')
+        self.assertEqual(brad.age, 22)
+        self.assertEqual(brad.was, 'b-rad')
+        self.assertEqual(original.name, 'b-rad')
+
+    def test_assign_inplace(self):
+        original = Datum({'name': 'b-rad'})
+        brad = next(DataStream([original]).assign(inplace=True, name=lambda row: 'brad'))
+        self.assertIs(brad, original)
+        self.assertEqual(original.name, 'brad')
+
+    def test_assign_dict(self):
+        original = Datum({'name': 'b-rad'})
+        brad = next(DataStream([original]).assign({'inplace': lambda row: False, 'name': lambda row: 'brad'}, age=lambda row: 22))
+        self.assertIsNot(brad, original)
+        self.assertFalse(brad.inplace)
+        self.assertEqual(brad.name, 'brad')
+        self.assertEqual(brad.age, 22)
+
     def test_map_method(self):
         class Brad(object):
             def __init__(self, name, height, age):
@@ -306,6 +488,11 @@ class StreamTests(unittest.TestCase):
         self.assertEqual(_test_execute_count, 20)
         del _test_execute_count
 
+    def test_execute_stats(self):
+        stats = DataStream(range(20)).filter(lambda num: num % 2).execute()
+        self.assertEqual(stats.rows, 10)
+        self.assertGreaterEqual(stats.elapsed, 0)
+
     def test_pick_attrs(self):
         def test_attrs(obj):
             self.assertIn('b', dir(obj))
@@ -316,6 +503,17 @@ class StreamTests(unittest.TestCase):
             .for_each(test_attrs)\
             .execute()
 
+    def test_get(self):
+        stream = DataStream([Datum({'a': 1}), Datum({'b': 2})])
+        self.assertListEqual(stream.get('a', 0).to_list(), [1, 0])
+
+    def test_attrgetter(self):
+        get_a = DataStream.attrgetter('a')
+        self.assertEqual(get_a(Datum({'a': 1})), 1)
+        self.assertRaises(AttributeError, get_a, Datum({}))
+        self.assertEqual(DataStream.attrgetter('a', 5)(Datum({})), 5)
+        self.assertEqual(DataStream.methodcaller('upper')('hi'), 'HI')
+
     def test_dedupe(self):
         stream = DataStream([[0, 1], [0, 2], [1, 1]])
         deduped = stream.dedupe(lambda row: row[0])
@@ -351,7 +549,1010 @@ class StreamTests(unittest.TestCase):
         self.assertEqual(stream.count(), 11)
 
 
+class RollingTests(unittest.TestCase):
+
+    def test_rolling_matches_windows(self):
+        rng = random.Random(31)
+        values = [rng.randint(-50, 50) for _ in range(300)]
+        mean = lambda window: float(sum(window)) / len(window)
+        variance = lambda window: sum((value - mean(window)) ** 2 for value in window) / (len(window) - 1)
+        expected = {
+            'sum': sum, 'mean': mean, 'var': variance, 'std': lambda window: variance(window) ** 0.5,
+            'min': min, 'max': max, 'count': len}
+        for agg, agg_fn in expected.items():
+            windows = DataStream(values).window(7, 1).filter(lambda window: len(window) == 7)
+            rolled = DataStream(values).rolling(7, agg).to_list()
+            for rolled_value, window in zip(rolled, windows):
+                self.assertAlmostEqual(rolled_value, agg_fn(window.to_list()))
+
+    def test_rolling_min_periods(self):
+        rolled = DataStream([3, 1, 2]).rolling(2, 'min', min_periods=1).to_list()
+        self.assertListEqual(rolled, [3, 1, 1])
+
+    def test_rolling_key_fn(self):
+        rows = [Datum({'price': price}) for price in [1, 2, 3, 4]]
+        rolled = DataStream(rows).rolling(2, 'sum', key_fn=lambda row: row.price).to_list()
+        self.assertListEqual(rolled, [3, 5, 7])
+
+    def test_rolling_custom(self):
+        class Product(RollingAggregator):
+            def __init__(self):
+                self.product = 1
+
+            def add(self, value):
+                self.product *= value
+
+            def remove(self, value):
+                self.product //= value
+
+            def result(self):
+                return self.product
+
+        rolled = DataStream([1, 2, 3, 4]).rolling(2, Product).to_list()
+        self.assertListEqual(rolled, [2, 6, 12])
+
+    def test_rolling_invalid(self):
+        self.assertRaises(ValueError, DataStream([1]).rolling(2, 'median').to_list)
+
+
+class TimeWindowTests(unittest.TestCase):
+
+    @staticmethod
+    def summarize(windows):
+        return [(window.key, window.start, window.end, window.rows.to_list()) for window in windows]
+
+    def test_tumbling(self):
+        windows = DataStream([1, 3, 2, 11, 25]).time_window(lambda ts: ts, 10)
+        self.assertListEqual(self.summarize(windows),
+                             [(None, 0, 10, [1, 3, 2]), (None, 10, 20, [11]), (None, 20, 30, [25])])
+
+    def test_sliding(self):
+        windows = DataStream([1, 6, 12]).time_window(lambda ts: ts, 10, slide=5)
+        self.assertListEqual(self.summarize(windows), [
+            (None, -5, 5, [1]), (None, 0, 10, [1, 6]), (None, 5, 15, [6, 12]), (None, 10, 20, [12])])
+
+    def test_lateness(self):
+        late = []
+        windows = DataStream([1, 11, 8, 13, 4]).time_window(lambda ts: ts, 10, allowed_lateness=3, late_fn=late.append)
+        self.assertListEqual(self.summarize(windows), [(None, 0, 10, [1, 8]), (None, 10, 20, [11, 13])])
+        self.assertListEqual(late, [4])
+
+    def test_emits_on_watermark(self):
+        def endless():
+            ts = 0
+            while True:
+                yield ts
+                ts += 1
+
+        windows = DataStream(endless()).time_window(lambda ts: ts, 100, key_fn=lambda ts: ts % 2)
+        self.assertListEqual(self.summarize(windows.take(2)), [
+            (0, 0, 100, list(range(0, 100, 2))), (1, 0, 100, list(range(1, 100, 2)))])
+
+    def test_session_merge(self):
+        clicks = DataStream([('amy', 1), ('bob', 2), ('amy', 11), ('amy', 6), ('amy', 30), ('bob', 40)])
+        sessions = clicks.session_window(lambda click: click[1], 6, key_fn=lambda click: click[0], allowed_lateness=10)
+        self.assertListEqual(self.summarize(sessions), [
+            ('bob', 2, 8, [('bob', 2)]),
+            ('amy', 1, 17, [('amy', 1), ('amy', 11), ('amy', 6)]),
+            ('amy', 30, 36, [('amy', 30)]),
+            ('bob', 40, 46, [('bob', 40)])])
+
+
+class SqlSourceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'numbers.db')
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE numbers (id INTEGER, name TEXT)')
+        connection.executemany('INSERT INTO numbers VALUES (?, ?)', [(i, str(i)) for i in range(1000)])
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def test_from_sql(self):
+        connection = self.connect()
+        stream = DataStream.from_sql(connection, 'SELECT * FROM numbers WHERE id < ?', (10,), fetch_size=3)
+        self.assertListEqual(stream.to_list(), [(i, str(i)) for i in range(10)])
+        connection.close()
+
+    def test_from_sql_records(self):
+        query = 'SELECT * FROM numbers WHERE id = 5'
+        self.assertListEqual(DictStream.from_sql(self.connect, query, record=dict).to_list(), [{'id': 5, 'name': '5'}])
+        self.assertEqual(DataStream.from_sql(self.connect, query, record=Datum).get('name').to_list(), ['5'])
+        slotted = next(DataStream.from_sql(self.connect, query, record='slots'))
+        self.assertEqual((slotted.id, slotted.name), (5, '5'))
+        self.assertFalse(hasattr(slotted, '__dict__'))
+
+    def test_from_sql_partitioned(self):
+        stream = DataStream.from_sql(self.connect, 'SELECT * FROM numbers', partition_column='id', partitions=4,
+                                     fetch_size=50)
+        self.assertListEqual(sorted(stream.to_list()), [(i, str(i)) for i in range(1000)])
+
+        connection = self.connect()
+        self.assertRaises(ValueError, DataStream.from_sql, connection, 'SELECT * FROM numbers',
+                          partition_column='id', partitions=4)
+        connection.close()
+
+    def test_record_type(self):
+        Person = record_type(['name', 'age'])
+        person = Person('amy', 31)
+        self.assertEqual(person, Person('amy', 31))
+        self.assertEqual(next(DataStream([person]).set('age', value=32)).age, 32)
+        self.assertEqual(person.age, 31)
+        self.assertRaises(ValueError, record_type, ['COUNT(*)'])
+
+
+class SinkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_sink_batches(self):
+        batches = []
+        stats = DataStream(range(10)).sink_batches(batches.append, batch_size=4).execute()
+        self.assertEqual(stats.rows, 10)
+        self.assertListEqual(batches, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+
+    def test_sink_batches_max_latency(self):
+        batches = []
+
+        def trickle():
+            yield 1
+            time.sleep(0.3)
+            self.assertListEqual(batches, [[1]])
+            yield 2
+
+        DataStream(trickle()).sink_batches(batches.append, batch_size=100, max_latency=0.05).execute()
+        self.assertListEqual(batches, [[1], [2]])
+
+    def test_sink_batches_in_order(self):
+        from datastreams.sinks import BatchWriter
+        written = []
+        writer = BatchWriter(written.extend, batch_size=5, max_latency=0.001)
+        get = writer._queue.get
+
+        def late_get(*args, **kwargs):
+            # full batches are queued while the flusher is between finding the queue empty and taking a stale batch
+            try:
+                return get(*args, **kwargs)
+            except Empty:
+                time.sleep(0.002)
+                raise
+
+        writer._queue.get = late_get
+        for num in range(500):
+            writer.add(num)
+            time.sleep(0.0002)
+        writer.close()
+        self.assertListEqual(written, list(range(500)))
+
+    def test_sink_batches_error(self):
+        def broken_write(batch):
+            raise IOError("disk full")
+
+        stream = DataStream(range(10)).sink_batches(broken_write, batch_size=3, max_pending=1)
+        self.assertRaises(IOError, stream.execute)
+
+    def test_to_file(self):
+        path = os.path.join(self.tempdir, 'out.txt')
+        paths = DataStream(['a', b'b', 3]).to_file(path)
+        self.assertListEqual(paths, [path])
+        with open(path, 'rb') as written:
+            self.assertEqual(written.read(), os.linesep.join(['a', 'b', '3', '']).encode())
+        DataStream(['c']).append_to_file(path)
+        with open(path) as written:
+            self.assertListEqual([line.strip() for line in written], ['a', 'b', '3', 'c'])
+
+    def test_to_file_compressed(self):
+        rows = [str(num) for num in range(5000)]
+        gzip_path = os.path.join(self.tempdir, 'out.txt.gz')
+        DataStream(rows).to_file(gzip_path, linesep='\n')
+        with gzip.open(gzip_path, 'rt') as written:
+            self.assertListEqual(written.read().splitlines(), rows)
+
+        bz2_path = os.path.join(self.tempdir, 'out.bz2')
+        DataStream(rows).to_file(bz2_path, linesep='\n', buffer_size=100)
+        self.assertListEqual(bz2.BZ2File(bz2_path).read().decode().splitlines(), rows)
+
+    def test_to_file_rotate(self):
+        template = os.path.join(self.tempdir, 'out-{index:02d}.txt')
+        paths = DataStream(range(25)).to_file(template, rotate_rows=10)
+        self.assertListEqual([os.path.basename(path) for path in paths], ['out-00.txt', 'out-01.txt', 'out-02.txt'])
+        written = []
+        for path in paths:
+            with open(path) as rotated:
+                written.extend(int(line) for line in rotated)
+        self.assertListEqual(written, list(range(25)))
+
+        paths = DataStream(['x' * 99] * 10).to_file(template, rotate_bytes=200, linesep='\n')
+        self.assertEqual(len(paths), 5)
+        self.assertRaises(ValueError, DataStream(range(3)).to_file, 'out.txt', rotate_rows=2)
+
+    def test_to_file_atomic(self):
+        path = os.path.join(self.tempdir, 'out.txt')
+
+        def broken():
+            yield 'a'
+            raise ValueError("broken source")
+
+        self.assertRaises(ValueError, DataStream(broken()).to_file, path)
+        self.assertListEqual(os.listdir(self.tempdir), [])
+
+        self.assertRaises(ValueError, DataStream(broken()).to_file, path, append=True, linesep='\n', chunk_rows=1)
+        with open(path) as written:
+            self.assertEqual(written.read(), 'a\n')
+
+    def test_to_file_replaces_in_place(self):
+        real_path = os.path.join(self.tempdir, 'real.txt')
+        link_path = os.path.join(self.tempdir, 'link.txt')
+        with open(real_path, 'w') as real:
+            real.write('old\n')
+        os.chmod(real_path, 0o600)
+        os.symlink(real_path, link_path)
+        self.assertListEqual(DataStream(['new']).to_file(link_path, linesep='\n'), [link_path])
+        self.assertTrue(os.path.islink(link_path))
+        with open(real_path) as real:
+            self.assertEqual(real.read(), 'new\n')
+        self.assertEqual(stat.S_IMODE(os.stat(real_path).st_mode), 0o600)
+        DataStream([1, 2]).to_binary(link_path)
+        self.assertTrue(os.path.islink(link_path))
+        self.assertListEqual(DataStream.from_binary(real_path).to_list(), [1, 2])
+
+        DataStream(['in place']).write_to_file(link_path)
+        self.assertTrue(os.path.islink(link_path))
+        self.assertSetEqual(set(os.listdir(self.tempdir)), {'real.txt', 'link.txt'})
+        with open(real_path) as real:
+            self.assertEqual(real.read(), 'in place' + os.linesep)
+
+        fifo_path = os.path.join(self.tempdir, 'fifo')
+        os.mkfifo(fifo_path)
+        read = []
+
+        def read_fifo():
+            with open(fifo_path) as fifo:
+                read.append(fifo.read())
+
+        reader = threading.Thread(target=read_fifo)
+        reader.start()
+        DataStream(['piped']).to_file(fifo_path, linesep='\n')
+        reader.join()
+        self.assertListEqual(read, ['piped\n'])
+        self.assertTrue(stat.S_ISFIFO(os.stat(fifo_path).st_mode))
+
+    def test_to_file_mode(self):
+        path = os.path.join(self.tempdir, 'out.txt')
+        umask = os.umask(0o027)
+        try:
+            DataStream(['a']).to_file(path)
+            self.assertEqual(os.umask(0o027), 0o027)
+        finally:
+            os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o640)
+
+    def test_to_file_each_row(self):
+        path = os.path.join(self.tempdir, 'out.txt')
+
+        def trickle():
+            for row in ['a', 'b']:
+                yield row
+                with open(path) as written:
+                    self.assertEqual(written.read(), 'a\n' if row == 'a' else 'a\nb\n')
+
+        DataStream(trickle()).to_file(path, append=True, linesep='\n', chunk_rows=1, buffer_size=0)
+
+    def test_to_sqlite(self):
+        path = os.path.join(self.tempdir, 'people.db')
+        people = [Datum({'name': 'brad', 'age': '25'}), Datum({'name': 'amy', 'age': '31'}),
+                  Datum({'name': 'gatsby', 'age': '7'})]
+        stats = DataStream(people).to_sqlite(path, 'people', batch_size=2)
+        DictStream([{'name': 'max', 'age': '3'}]).to_sqlite(path, 'people')
+        DataStream([('yoda', '900')]).to_sqlite(path, 'people', columns=['name', 'age'])
+
+        connection = sqlite3.connect(path)
+        rows = connection.execute('SELECT name, age FROM people').fetchall()
+        connection.close()
+        self.assertEqual(stats.rows, 3)
+        self.assertEqual(len(rows), 5)
+        self.assertIn(('max', '3'), rows)
+        self.assertIn(('yoda', '900'), rows)
+
+
+class FileSourceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.lines = ['line {}'.format(num) for num in range(20000)]
+        self.text = '\n'.join(self.lines + ['']).encode()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as target:
+            target.write(data)
+        return path
+
+    def test_from_file_compressed(self):
+        paths = [self.write('lines.txt.gz', gzip.compress(self.text)),
+                 self.write('lines.bz2', bz2.compress(self.text))]
+        if lzma is not None:
+            paths.append(self.write('lines.xz', lzma.compress(self.text)))
+        for path in paths:
+            lines = DataStream.from_file(path).map(str.rstrip).to_list()
+            self.assertListEqual(lines, self.lines)
+        self.assertEqual(DataStream.from_files(paths).count(), len(paths) * len(self.lines))
+
+    def test_from_file_magic_bytes(self):
+        path = self.write('lines', gzip.compress(self.text))
+        self.assertListEqual(DataStream.from_file(path).map(str.rstrip).to_list(), self.lines)
+        self.assertEqual(DataStream.from_file(self.write('plain', self.text)).count(), len(self.lines))
+        self.assertListEqual(DataStream.from_file(self.write('packed', bz2.compress(self.text))).take(1).to_list(),
+                             ['line 0\n'])
+        self.assertListEqual(DataStream.from_file(self.write('empty', bz2.compress(b''))).to_list(), [])
+
+        # plain text that happens to start like a bz2 header
+        path = self.write('counts', b'BZh,count\nBZh9,3\n')
+        self.assertListEqual(DataStream.from_file(path).to_list(), ['BZh,count\n', 'BZh9,3\n'])
+        self.assertListEqual(DataStream.from_file(path, mode='bytes').to_list(), [b'BZh,count\n', b'BZh9,3\n'])
+        self.assertListEqual(DataStream.from_csv(path).map(vars).to_list(), [{'BZh': 'BZh9', 'count': '3'}])
+
+    def test_from_pipe(self):
+        path = os.path.join(self.tempdir, 'fifo')
+        os.mkfifo(path)
+
+        def read(open_stream):
+            writer = threading.Thread(target=lambda: self.write('fifo', b'name,age\namy,31\n'))
+            writer.start()
+            rows = open_stream().to_list()
+            writer.join()
+            return rows
+
+        self.assertListEqual(read(lambda: DataStream.from_file(path)), ['name,age\n', 'amy,31\n'])
+        self.assertListEqual(read(lambda: DataStream.from_file(path, mode='bytes')), [b'name,age\n', b'amy,31\n'])
+        self.assertListEqual(read(lambda: DataStream.from_files([path])), ['name,age\n', 'amy,31\n'])
+        self.assertListEqual(read(lambda: DataStream.from_csv(path).map(vars)), [{'name': 'amy', 'age': '31'}])
+        self.assertListEqual(sorted(read(lambda: PartitionedStream.from_file(path, 2, 1))), ['amy,31\n', 'name,age\n'])
+
+    def test_from_csv_compressed(self):
+        with open('test_set_1.csv', 'rb') as source:
+            path = self.write('people.csv.bz2', bz2.compress(source.read()))
+        compressed = DataStream.from_csv(path).map(vars).to_list()
+        self.assertListEqual(compressed, DataStream.from_csv('test_set_1.csv').map(vars).to_list())
+
+    def test_from_file_bytes(self):
+        path = self.write('lines.txt', self.text)
+        lines = DataStream.from_file(path, mode='bytes').to_list()
+        self.assertListEqual(lines, [line.encode() + b'\n' for line in self.lines])
+        views = DataStream.from_file(path, mode='memoryview').take_now(2)
+        self.assertListEqual([bytes(view) for view in views], [b'line 0\n', b'line 1\n'])
+        self.assertListEqual(DataStream(views).decode().to_list(), ['line 0\n', 'line 1\n'])
+
+        offset = len(b''.join(lines[:10]))
+        self.assertEqual(next(DataStream.from_file(path, mode='bytes', offset=offset)), b'line 10\n')
+        self.assertEqual(next(DataStream.from_file(path, offset=offset)), 'line 10\n')
+        self.assertEqual(DataStream.from_file(self.write('empty', b''), mode='memoryview').count(), 0)
+        self.assertEqual(DataStream.from_file(self.write('unterminated', b'a\nb'), mode='bytes').to_list(),
+                         [b'a\n', b'b'])
+
+        gzip_path = self.write('lines.gz', gzip.compress(self.text))
+        self.assertEqual(next(DataStream.from_file(gzip_path, mode='bytes')), b'line 0\n')
+        self.assertRaises(ValueError, DataStream.from_file(gzip_path, mode='memoryview').execute)
+        self.assertRaises(ValueError, DataStream.from_file, path, mode='lines')
+
+    def test_from_files_parallel(self):
+        shards = [['shard {} line {}'.format(shard, num) for num in range(3000)] for shard in range(6)]
+        for i, lines in enumerate(shards):
+            data = '\n'.join(lines + ['']).encode()
+            self.write('shard-{}.txt{}'.format(i, '.gz' if i % 2 else ''), gzip.compress(data) if i % 2 else data)
+        pattern = os.path.join(self.tempdir, 'shard-*')
+        everything = [line for lines in shards for line in lines]
+
+        self.assertListEqual(DataStream.from_files(pattern).map(str.rstrip).to_list(), everything)
+        ordered = DataStream.from_files([pattern], parallel=3, ordered=True).map(str.rstrip).to_list()
+        self.assertListEqual(ordered, everything)
+        unordered = DataStream.from_files(pattern, parallel=3, mode='bytes').decode().map(str.rstrip).to_list()
+        self.assertListEqual(sorted(unordered), sorted(everything))
+        self.assertEqual(DataStream.from_files(os.path.join(self.tempdir, 'nothing-*'), parallel=2).count(), 0)
+
+    def test_from_files_closes(self):
+        paths = [self.write('lines-{}.txt.gz'.format(i), gzip.compress(self.text)) for i in range(4)]
+        threads = threading.active_count()
+        for ordered in (True, False):
+            stream = DataStream.from_files(paths, parallel=2, ordered=ordered, max_pending=1)
+            self.assertEqual(len(stream.take_now(10)), 10)
+            del stream
+            gc.collect()
+            self.assertEqual(threading.active_count(), threads)
+
+        stream = DataStream.from_files(paths + [os.path.join(self.tempdir, 'missing.txt')], parallel=2)
+        self.assertRaises(IOError, stream.execute)
+
+    def test_from_files_dropped_unread(self):
+        paths = [self.write('lines-{}.txt'.format(i), self.text) for i in range(4)]
+        threads = threading.active_count()
+        stream = DataStream.from_files(paths, parallel=2, ordered=False)
+        del stream
+        gc.collect()
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_from_file_opens_lazily(self):
+        stream = DataStream.from_file(os.path.join(self.tempdir, 'missing.txt'))
+        self.assertRaises(IOError, stream.execute)
+
+    def test_follow(self):
+        path = self.write('app.log', b'skipped\n')
+        offset_path = os.path.join(self.tempdir, 'app.log.offset')
+
+        def append(data, target=path):
+            with open(target, 'ab') as log:
+                log.write(data)
+
+        stream = DataStream.follow(path, poll_interval=0.01, offset_path=offset_path, idle_timeout=0.5)
+        append(b'one\ntw')
+        self.assertEqual(next(stream), 'one\n')
+        append(b'o\nthree\n')
+        self.assertListEqual(list(stream.take_now(2)), ['two\n', 'three\n'])
+
+        os.rename(path, path + '.1')
+        append(b'four\nfive', path + '.1')
+        append(b'six\n')
+        self.assertListEqual(list(stream.take_now(3)), ['four\n', 'five', 'six\n'])
+
+        with open(path, 'wb') as log:
+            log.write(b'7\n')
+        self.assertEqual(next(stream), '7\n')
+        append(b'8\n')
+        self.assertEqual(next(stream), '8\n')
+        del stream
+        gc.collect()
+
+        append(b'9\n')
+        resumed = DataStream.follow(path, poll_interval=0.01, offset_path=offset_path, idle_timeout=0.2)
+        self.assertListEqual(resumed.to_list(), ['8\n', '9\n'])
+        self.assertListEqual(DataStream.follow(path, offset_path=offset_path, idle_timeout=0.1).to_list(), [])
+        self.assertListEqual(DataStream.follow(path, from_end=False, mode='bytes', idle_timeout=0.1).to_list(),
+                             [b'7\n', b'8\n', b'9\n'])
+
+    def test_from_file_corrupt(self):
+        path = self.write('lines.gz', gzip.compress(self.text)[:-100])
+        self.assertRaises(EOFError, DataStream.from_file(path).execute)
+
+
+class JsonLinesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.people = [{'name': 'amy', 'age': 31, 'tags': ['a']}, {'name': 'brad', 'age': 25, 'tags': []}] * 1500
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_round_trip(self):
+        for backend in ('json', 'auto'):
+            path = os.path.join(self.tempdir, 'people-{}.jsonl.gz'.format(backend))
+            self.assertListEqual(DictStream(self.people).to_jsonl(path, backend=backend), [path])
+            self.assertListEqual(DictStream.from_jsonl(path, backend=backend).to_list(), self.people)
+            self.assertListEqual(DataStream.from_jsonl(path, backend=backend).map(vars).to_list(), self.people)
+
+        path = os.path.join(self.tempdir, 'records.jsonl')
+        Person = record_type(['name', 'age'])
+        DataStream([Datum({'name': 'amy'}), Person('brad', 25)]).to_jsonl(path, backend='json')
+        with open(path) as written:
+            self.assertListEqual(written.read().splitlines(), ['{"name":"amy"}', '{"name":"brad","age":25}'])
+
+    def test_fields(self):
+        lines = ['{"name": "amy", "age": 31, "extra": {"deep": [1, 2]}}', '', '{"name": "brad"}\n']
+        self.assertListEqual(DataStream.from_jsonl(lines, fields=['name', 'age'], record=tuple).to_list(),
+                             [('amy', 31), ('brad', None)])
+        people = DataStream.from_jsonl(lines, fields=['name'], record='slots', chunk_size=1).to_list()
+        self.assertListEqual([person.name for person in people], ['amy', 'brad'])
+        self.assertListEqual(DictStream.from_jsonl(lines, fields=['age']).to_list(), [{'age': 31}, {'age': None}])
+        self.assertRaises(ValueError, DataStream.from_jsonl, lines, record=tuple)
+
+    def test_invalid_line(self):
+        lines = [b'{"a": 1}', b'{"a": 2}', b'1, 2', b'{"a": 4}']
+        with self.assertRaises(ValueError) as raised:
+            DataStream.from_jsonl(lines, backend='json').execute()
+        self.assertIn('line 3', str(raised.exception))
+
+        for backend in ('json', 'auto'):
+            lines = [b'{"a": [1\n', b'2]}, {"b": 1}\n']
+            with self.assertRaises(ValueError) as raised:
+                DataStream.from_jsonl(lines, backend=backend).execute()
+            self.assertIn('line 1', str(raised.exception))
+
+
+class BinaryFormatTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'rows.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_round_trip(self):
+        Person = record_type(['name', 'age'])
+        Single = record_type(['value'])
+        rows = [Person('amy', 31), Person('brad', 25), 'text', b'bytes', (1, 2.5), {'a': [1]}, None,
+                Single(7), bytearray(b'x' * 10000), Person('carl', None)] * 300
+        for compression in (None, 'zlib'):
+            stats = DataStream(rows).to_binary(self.path, batch_size=128, compression=compression)
+            self.assertEqual(stats.rows, len(rows))
+            self.assertListEqual(DataStream.from_binary(self.path).to_list(), rows)
+        with open(self.path, 'rb') as source:
+            self.assertEqual(DataStream.from_binary(source).count(), len(rows))
+
+    def test_records_keep_their_class(self):
+        First, Second = record_type(['x']), record_type(['x'])
+        DataStream([First(1)]).to_binary(self.path)
+        self.assertIs(type(DataStream.from_binary(self.path).to_list()[0]), First)
+        DataStream([Second(1)]).to_binary(self.path)
+        self.assertListEqual(DataStream.from_binary(self.path).to_list(), [Second(1)])
+
+        Pair = record_type(['left', 'right'])
+        staged = DataStream(range(3)).stage(2, 'process').map(lambda n: Pair(n, n)).to_list()
+        self.assertIs(type(staged[0]), Pair)
+        self.assertEqual(staged[0], Pair(0, 0))
+
+        script = ('from datastreams import DataStream, record_type; import sys; First = record_type(["x"]); '
+                  'DataStream([First(1), First(2)]).to_binary(sys.argv[1])')
+        subprocess.check_call([sys.executable, '-c', script, self.path], env=dict(os.environ, PYTHONPATH=parentdir))
+        rows = DataStream.from_binary(self.path).to_list()
+        self.assertEqual([row.x for row in rows], [1, 2])
+        self.assertIs(type(rows[0]), type(rows[1]))
+        self.assertIsNot(type(rows[0]), First)
+
+    def test_datum_and_file_objects(self):
+        with open(self.path, 'wb') as target:
+            DataStream([Datum({'a': 1}), Datum({'a': 2})]).to_binary(target)
+            DataStream([]).to_binary(target)
+        self.assertListEqual(DataStream.from_binary(self.path).map(vars).to_list(), [{'a': 1}, {'a': 2}])
+
+    def test_errors(self):
+        def broken():
+            yield 1
+            raise ValueError("broken source")
+
+        self.assertRaises(ValueError, DataStream(broken()).to_binary, self.path)
+        self.assertListEqual(os.listdir(self.tempdir), [])
+        self.assertRaises(ValueError, DataStream([1]).to_binary, self.path, compression='lz77')
+
+        DataStream(range(1000)).to_binary(self.path)
+        with open(self.path, 'rb') as source:
+            data = source.read()
+        with open(self.path, 'wb') as target:
+            target.write(data[:-10])
+        self.assertRaises(EOFError, DataStream.from_binary(self.path).execute)
+        with open(self.path, 'wb') as target:
+            target.write(b'not a binary stream')
+        self.assertRaises(ValueError, DataStream.from_binary(self.path).execute)
+
+
+class StdioTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stdin, self.stdout = sys.stdin, sys.stdout
+
+    def tearDown(self):
+        sys.stdin, sys.stdout = self.stdin, self.stdout
+
+    def test_from_stdin(self):
+        data = u'caf\u00e9\nb\n\nlast'.encode('utf-8')
+        sys.stdin = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+        self.assertListEqual(DataStream.from_stdin().to_list(), [u'caf\u00e9\n', 'b\n', '\n', 'last'])
+        sys.stdin = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+        self.assertListEqual(DataStream.from_stdin(mode='bytes', keepends=False).to_list(),
+                             [u'caf\u00e9'.encode('utf-8'), b'b', b'', b'last'])
+
+    def test_from_stdin_newlines(self):
+        from datastreams.sources import iter_stream_lines
+        data = b'x\r\ny\rz\n\r\nlast\r'
+        sys.stdin = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+        self.assertListEqual(DataStream.from_stdin().to_list(), ['x\n', 'y\n', 'z\n', '\n', 'last\n'])
+        # '\r\n' split between chunks is still one newline
+        self.assertListEqual(list(iter_stream_lines(io.BytesIO(data), keepends=False, chunk_size=2)),
+                             ['x', 'y', 'z', '', 'last'])
+        self.assertListEqual(list(iter_stream_lines(io.BytesIO(b'a\rb'), keepends=False)), ['a', 'b'])
+        sys.stdin = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+        self.assertListEqual(DataStream.from_stdin(mode='bytes').to_list(), [b'x\r\n', b'y\rz\n', b'\r\n', b'last\r'])
+
+    def test_pipe_to_stdout(self):
+        output = io.BytesIO()
+        sys.stdout = io.TextIOWrapper(output, encoding='utf-8')
+        stats = DataStream(['a', b'b', 3]).pipe_to_stdout(linesep='\n', chunk_rows=2)
+        self.assertEqual(stats.rows, 3)
+        self.assertEqual(output.getvalue(), b'a\nb\n3\n')
+
+    def test_cli(self):
+        env = dict(os.environ, PYTHONPATH=parentdir)
+
+        def run(args, data):
+            process = subprocess.Popen([sys.executable, '-m', 'datastreams'] + args, env=env,
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            output = process.communicate(data)[0]
+            self.assertEqual(process.returncode, 0)
+            return output
+
+        lines = b''.join(str(num).encode() + b'\n' for num in range(5000))
+        self.assertEqual(run([".filter(lambda line: line.endswith('7')).map(int)"], lines),
+                         b''.join(str(num).encode() + b'\n' for num in range(5000) if num % 10 == 7))
+        self.assertEqual(run(['-b', "stream.filter(lambda line: b'99' in line).count()"], lines), b'95\n')
+        self.assertEqual(run([], b'x\ny'), b'x\ny\n')
+
+        # like `python -m datastreams ... | head -1`
+        process = subprocess.Popen([sys.executable, '-m', 'datastreams', 'DataStream(range(10 ** 7))'], env=env,
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(process.stdout.readline(), b'0\n')
+        process.stdout.close()
+        self.assertEqual(process.wait(), 0)
+        self.assertEqual(process.stderr.read(), b'')
+        process.stderr.close()
+
+
+class StageTests(unittest.TestCase):
+
+    def test_process_stage(self):
+        stream = DataStream(range(1000)).stage(workers=3, kind='process').map(lambda n: (n, os.getpid())) \
+            .filter(lambda pair: pair[0] % 2 == 0)
+        rows = stream.to_list()
+        self.assertListEqual([n for n, pid in rows], list(range(0, 1000, 2)))
+        self.assertNotIn(os.getpid(), set(pid for n, pid in rows))
+
+        Pair = record_type(['left', 'right'])
+        pairs = DataStream(range(5)).stage(2, 'process').map(lambda n: Pair(n, n * 2)).stage(2).map(attrgetter('right'))
+        self.assertListEqual(pairs.to_list(), [0, 2, 4, 6, 8])
+
+    def test_thread_stages_overlap(self):
+        # rows 0-3 only get through a stage if its four workers run them at once, and the first stage only
+        # finishes row 39 once the second has started on row 0
+        first_workers, second_workers = threading.Barrier(4, timeout=10), threading.Barrier(4, timeout=10)
+        second_started = threading.Event()
+        overlapped = []
+
+        def first(row):
+            if row < 4:
+                first_workers.wait()
+            if row == 39:
+                overlapped.append(second_started.wait(10))
+            return row
+
+        def second(row):
+            second_started.set()
+            if row < 4:
+                second_workers.wait()
+            return row
+
+        stream = DataStream(range(40)).stage(4, batch_size=1).map(first).stage(4, batch_size=1).map(second)
+        self.assertListEqual(stream.to_list(), list(range(40)))
+        self.assertListEqual(overlapped, [True])
+        unordered = DataStream(range(100)).stage(4, batch_size=7, ordered=False).map(lambda n: n * 2).to_list()
+        self.assertListEqual(sorted(unordered), list(range(0, 200, 2)))
+
+    def test_shared_memory_transport(self):
+        blob = os.urandom(1 << 17)
+        Blob = record_type(['name', 'data'])
+        rows = DataStream(range(50)).map(lambda n: Blob('blob{}'.format(n), blob if n % 2 else bytearray(blob)))
+        stream = rows.stage(3, 'process', batch_size=4, transport='shared_memory') \
+            .map(lambda row: (row.name, bytes(row.data[:4]), len(row.data), row.data))
+        result = stream.to_list()
+        self.assertListEqual([row[:3] for row in result],
+                             [('blob{}'.format(n), blob[:4], len(blob)) for n in range(50)])
+        self.assertTrue(all(row[3] == blob for row in result))
+        self.assertListEqual(DataStream(['small']).stage(1, 'process', transport='shared_memory').to_list(), ['small'])
+        self.assertRaises(ValueError, DataStream([]).stage, kind='process', transport='carrier pigeon')
+
+        stream = DataStream(range(10000)).map(lambda n: blob).stage(2, 'process', batch_size=1, transport='shared_memory')
+        self.assertEqual(len(stream.take(2).to_list()), 2)
+        del stream
+        gc.collect()
+        self.assertListEqual([name for name in os.listdir(tempfile.gettempdir() if not os.path.isdir('/dev/shm')
+                                                          else '/dev/shm') if name.startswith('datastreams-')], [])
+
+    def test_stage_keeps_stream_class(self):
+        stream = DictStream([{'name': 'amy'}, {'name': 'brad'}]).stage(2).map(lambda row: row)
+        self.assertIsInstance(stream, DictStream)
+        self.assertListEqual(stream.get('name').to_list(), ['amy', 'brad'])
+        self.assertListEqual(DataSet(range(3)).stage().map(lambda n: n + 1).to_list(), [1, 2, 3])
+
+    def test_stage_errors_and_early_exit(self):
+        failing = DataStream(range(10)).stage(2, 'process', batch_size=2).map(lambda n: 1 / (n - 5))
+        self.assertRaises(ZeroDivisionError, failing.to_list)
+
+        def broken():
+            yield 1
+            raise ValueError("broken source")
+
+        self.assertRaises(ValueError, DataStream(broken()).stage(2).map(lambda n: n).to_list)
+        self.assertRaises(ValueError, DataStream(range(3)).stage, kind='fiber')
+
+        threads = threading.active_count()
+        self.assertListEqual(DataStream(range(100000)).stage(2, 'process').map(lambda n: n).take(3).to_list(),
+                             [0, 1, 2])
+        gc.collect()
+        self.assertListEqual(multiprocessing.active_children(), [])
+        deadline = time.time() + 10
+        while threading.active_count() > threads and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(threading.active_count(), threads)
+
+
+class PartitionedStreamTests(unittest.TestCase):
+
+    def test_narrow_operations(self):
+        stream = PartitionedStream(list(range(1000)), partitions=4, workers=4)
+        rows = stream.map(lambda n: (n, os.getpid())).filter(lambda pair: pair[0] % 3 == 0).to_list()
+        self.assertListEqual([n for n, pid in rows], list(range(0, 1000, 3)))
+        self.assertNotIn(os.getpid(), set(pid for n, pid in rows))
+        self.assertListEqual(PartitionedStream(['a b', 'c'], 2, 2).concat_map(str.split).map_method('upper').to_list(),
+                             ['A', 'B', 'C'])
+        self.assertEqual(stream.filter(lambda n: n % 2).count(), 500)
+        self.assertListEqual(PartitionedStream(list(range(5)), 3, 1).map(lambda n: n * 2).to_list(), [0, 2, 4, 6, 8])
+
+        dealt = PartitionedStream((n for n in range(100)), partitions=3, workers=3, batch_size=7)
+        self.assertListEqual(sorted(dealt.map(lambda n: n + 1).to_list()), list(range(1, 101)))
+        self.assertListEqual(sorted(dealt.repartition(5).to_list()), list(range(100)))
+
+    def test_shuffles_match_local_results(self):
+        rng = random.Random(47)
+        words = [rng.choice(['the', 'cat', 'and', 'hat', 'bat', 'sat']) for _ in range(5000)]
+        stream = PartitionedStream(words, partitions=4, workers=3, batch_size=100)
+        self.assertDictEqual(stream.count_frequency().to_dict(), DataStream(words).count_frequency().to_dict())
+        self.assertSetEqual(set(stream.dedupe().to_list()), set(words))
+        self.assertEqual(stream.dedupe().count(), 6)
+        groups = stream.group_by_fn(lambda word: word[0]).to_dict()
+        local_groups = DataStream(words).group_by_fn(lambda word: word[0]).to_dict()
+        self.assertSetEqual(set(groups), set(local_groups))
+        for key, rows in local_groups.items():
+            self.assertListEqual(sorted(groups[key]), sorted(rows))
+
+    def test_aggregate_by_and_map_partitions(self):
+        stream = PartitionedStream(list(range(100)), partitions=4, workers=4)
+        sums = stream.aggregate_by(lambda n: n % 3, 0, lambda total, n: total + n, lambda a, b: a + b).to_dict()
+        self.assertDictEqual(sums, DataStream(range(100)).aggregate_by(lambda n: n % 3, 0, lambda total, n: total + n,
+                                                                       lambda a, b: a + b).to_dict())
+        self.assertListEqual(stream.map_partitions(lambda rows: [sum(rows)]).to_list(), [300, 925, 1550, 2175])
+
+    def test_sort_by(self):
+        rng = random.Random(47)
+        numbers = [rng.randint(0, 10000) for _ in range(3000)]
+        stream = PartitionedStream(numbers, partitions=4, workers=4)
+        self.assertListEqual(stream.sort_by(lambda n: n).to_list(), sorted(numbers, reverse=True))
+        self.assertListEqual(stream.sort_by(lambda n: -n, descending=False).take(10).to_list(),
+                             sorted(numbers, reverse=True)[:10])
+        self.assertListEqual(PartitionedStream([], 3, 3).sort_by(lambda n: n).to_list(), [])
+        self.assertListEqual(PartitionedStream([1] * 10, 3, 3).sort_by(lambda n: n).to_list(), [1] * 10)
+
+    def test_joins(self):
+        left = [Datum({'name': name, 'age': age}) for name, age in [('amy', 30), ('brad', 40), ('cat', 50)]]
+        right = [Datum({'name': name, 'pet': pet}) for name, pet in [('amy', 'dog'), ('amy', 'cat'), ('dan', 'fish')]]
+
+        def summary(joined):
+            return sorted((getattr(row, 'name', None), getattr(row, 'age', None), getattr(row, 'pet', None))
+                          for row in joined)
+
+        stream = PartitionedStream(left, partitions=3, workers=3)
+        for how in ['left', 'right', 'inner', 'outer']:
+            self.assertListEqual(summary(stream.join(how, 'name', right)),
+                                 summary(DataStream(left).join(how, 'name', right)))
+        self.assertListEqual(summary(stream.join('inner', 'name', PartitionedStream(right, 2, 2))),
+                             [('amy', 30, 'cat'), ('amy', 30, 'dog')])
+        self.assertRaises(ValueError, stream.join, 'sideways', 'name', right)
+
+    def test_from_file_ranges(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        lines = ['line {}\n'.format('x' * (n % 13)) for n in range(1000)]
+        path = os.path.join(workdir, 'lines.txt')
+        with open(path, 'w') as f:
+            f.writelines(lines)
+        for partitions in [1, 3, 7, 2000]:
+            self.assertListEqual(PartitionedStream.from_file(path, partitions, workers=3).to_list(), lines)
+        self.assertListEqual(PartitionedStream.from_file(path, 4, 4, mode='bytes').take(2).to_list(),
+                             [b'line \n', b'line x\n'])
+
+        compressed = os.path.join(workdir, 'lines.txt.gz')
+        with gzip.open(compressed, 'wt') as f:
+            f.writelines(lines)
+        self.assertEqual(PartitionedStream.from_file(compressed, 3, 3).count(), 1000)
+        self.assertListEqual(sorted(PartitionedStream.from_files([path, compressed], 2, 2).to_list()),
+                             sorted(lines * 2))
+
+    def test_spill_files_are_removed(self):
+        spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spill_dir)
+        stream = PartitionedStream(iter(range(100)), partitions=3, workers=3, spill_dir=spill_dir)
+        counts = stream.map(lambda n: n % 10).count_frequency()
+        self.assertTrue(os.listdir(spill_dir))
+        self.assertDictEqual(counts.to_dict(), dict((n, 10) for n in range(10)))
+        del stream, counts
+        gc.collect()
+        self.assertListEqual(os.listdir(spill_dir), [])
+        self.assertListEqual(multiprocessing.active_children(), [])
+
+        failing = PartitionedStream(list(range(10)), 2, 2).map(lambda n: 1 / (n - 5))
+        self.assertRaises(ZeroDivisionError, failing.to_list)
+
+
+@unittest.skipUnless(cloudpickle, "needs cloudpickle to send lambdas to workers")
+class RemoteStageTests(unittest.TestCase):
+
+    def start_worker(self, authkey=None):
+        # workers run in processes of their own, like on other machines, so they don't inherit this one's sockets
+        args = [sys.executable, '-m', 'datastreams.worker', '--host', '127.0.0.1', '--port', '0']
+        env = dict(os.environ, PYTHONPATH=parentdir, DATASTREAMS_AUTHKEY=authkey or '')
+        process = subprocess.Popen(args, env=env, stdout=subprocess.PIPE)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.terminate)
+        self.addCleanup(process.stdout.close)
+        return process.stdout.readline().decode().split()[-1]
+
+    def unused_address(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        return ('127.0.0.1', port)
+
+    def test_remote_stage(self):
+        workers = [self.start_worker(), self.start_worker()]
+        offset = 3
+        stream = DataStream(range(1000)).remote(workers * 2, batch_size=50).map(lambda n: (n + offset, os.getpid())) \
+            .filter(lambda pair: pair[0] % 2 == 0)
+        rows = stream.to_list()
+        self.assertListEqual([n for n, pid in rows], list(range(4, 1003, 2)))
+        self.assertNotIn(os.getpid(), set(pid for n, pid in rows))
+
+        Pair = record_type(['left', 'right'])
+        pairs = DataStream(range(5)).remote(workers[:1]).map(lambda n: Pair(n, n * 2)).map(attrgetter('right'))
+        self.assertListEqual(pairs.to_list(), [0, 2, 4, 6, 8])
+        unordered = DataStream(range(100)).remote(workers, batch_size=7, ordered=False).map(lambda n: n * 2)
+        self.assertListEqual(sorted(unordered.to_list()), list(range(0, 200, 2)))
+        self.assertIsInstance(DictStream([{'a': 1}]).remote(workers).map(lambda row: row), DictStream)
+
+    def test_worker_failures_are_retried(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        marker = os.path.join(workdir, 'crashed')
+
+        def crash_once(n):
+            if n == 13 and not os.path.exists(marker):
+                open(marker, 'w').close()
+                os._exit(1)
+            return n * 2
+
+        workers = [self.start_worker(), self.unused_address(), self.start_worker()]
+        stream = DataStream(range(100)).remote(workers, batch_size=10, retries=2).map(crash_once)
+        self.assertListEqual(stream.to_list(), list(range(0, 200, 2)))
+        self.assertTrue(os.path.exists(marker))
+
+        from datastreams.remotestreams import RemoteError
+        dead = DataStream(range(10)).remote([self.unused_address()], retries=1).map(lambda n: n)
+        self.assertRaises(RemoteError, dead.to_list)
+        failing = DataStream(range(10)).remote([self.start_worker()], batch_size=2).map(lambda n: 1 / (n - 5))
+        self.assertRaises(ZeroDivisionError, failing.to_list)
+        self.assertRaises(ValueError, DataStream([]).remote, [])
+
+    def test_rejected_steps_are_not_retried(self):
+        missing = os.path.join(tempfile.gettempdir(), 'datastreams-missing', 'steps')
+
+        class Unloadable(object):
+            # loading it on the worker raises an OSError, which mustn't be mistaken for a dropped connection
+            def __reduce__(self):
+                return open, (missing,)
+
+        # retried, it would fail with a RemoteError once every attempt had
+        stream = DataStream(range(10)).remote([self.start_worker()], retries=3).map(Unloadable())
+        self.assertRaises(IOError, stream.to_list)
+
+    def test_authkey(self):
+        from datastreams.remotestreams import RemoteError
+        worker = self.start_worker(authkey='secret')
+        self.assertListEqual(DataStream(range(3)).remote([worker], authkey='secret').map(lambda n: n + 1).to_list(),
+                             [1, 2, 3])
+        self.assertRaises(RemoteError, DataStream(range(3)).remote([worker]).map(lambda n: n).to_list)
+        self.assertRaises(RemoteError, DataStream(range(3)).remote([worker], authkey='guess').map(lambda n: n).to_list)
+        # refused outright rather than retried, which would fail once every attempt had
+        keyless = DataStream(range(3)).remote([self.start_worker()], authkey='secret', retries=3).map(lambda n: n)
+        with self.assertRaises(RemoteError) as raised:
+            keyless.to_list()
+        self.assertIn("didn't ask for the authkey", str(raised.exception))
+
+    def test_workers_reachable_from_other_hosts_need_an_authkey(self):
+        from datastreams.remotestreams import RemoteError, WorkerServer
+        self.assertRaises(RemoteError, WorkerServer, ('0.0.0.0', 0))
+        for options in (dict(authkey='secret'), dict(insecure=True)):
+            WorkerServer(('0.0.0.0', 0), **options).server_close()
+        WorkerServer(('127.0.0.1', 0)).server_close()
+
+        env = dict(os.environ, PYTHONPATH=parentdir, DATASTREAMS_AUTHKEY='')
+        process = subprocess.Popen([sys.executable, '-m', 'datastreams.worker', '--host', '', '--port', '0'], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, errors = process.communicate()
+        self.assertEqual(process.returncode, 2)
+        self.assertIn(b'--insecure', errors)
+
+
+@unittest.skipUnless(pyspark, "needs pyspark")
+class RddStreamTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.context = pyspark.SparkContext('local[2]', 'datastreams tests', environment={'PYTHONPATH': parentdir})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.context.stop()
+
+    def stream(self, rows):
+        from datastreams.rddstreams import RddStream
+        return RddStream(self.context.parallelize(rows, 2))
+
+    def test_aggregations(self):
+        words = ['the', 'cat', 'and', 'the', 'hat', 'the']
+        self.assertDictEqual(self.stream(words).count_frequency().to_dict(), {'the': 3, 'cat': 1, 'and': 1, 'hat': 1})
+        self.assertDictEqual(dict((key, sorted(group)) for key, group in self.stream(words).group_by_fn(len).to_list()),
+                             {3: sorted(words)})
+        counts = self.stream(words).aggregate_by(len, 0, lambda total, word: total + 1, lambda a, b: a + b)
+        self.assertDictEqual(counts.to_dict(), {3: 6})
+        self.assertListEqual(self.stream(list(range(10))).map_partitions(lambda rows: [sum(rows)]).to_list(), [10, 35])
+        self.assertListEqual(self.stream(list(range(10))).reverse().to_list(), list(range(9, -1, -1)))
+        self.assertEqual(self.stream(words).dedupe(lambda word: word[0]).count(), 4)
+
+    def test_joins(self):
+        left = [Datum({'name': name, 'age': age}) for name, age in [('amy', 30), ('brad', 40)]]
+        right = [Datum({'name': name, 'pet': pet}) for name, pet in [('amy', 'dog'), ('amy', 'cat'), ('dan', 'fish')]]
+
+        def summary(joined):
+            return sorted((getattr(row, 'name', None), getattr(row, 'age', None), getattr(row, 'pet', None))
+                          for row in joined.to_list())
+
+        for how in ['left', 'right', 'inner', 'outer']:
+            self.assertListEqual(summary(self.stream(left).join(how, 'name', self.stream(right))),
+                                 summary(DataStream(left).join(how, 'name', right)))
+
+
 class DataSetTests(unittest.TestCase):
+    def test_list_not_copied(self):
+        rows = [1, 2, 3]
+        self.assertIs(DataSet(rows)._source, rows)
+
+    def test_slice_view(self):
+        dataset = DataSet(range(10))
+        sliced = dataset[2:9:3]
+        self.assertEqual(len(sliced), 3)
+        self.assertEqual(sliced, [2, 5, 8])
+        self.assertEqual(sliced[-1], 8)
+        self.assertEqual(sliced[::-1], [8, 5, 2])
+        self.assertEqual(dataset[8:2:-2], [8, 6, 4])
+        self.assertEqual(dataset[20:], [])
+        self.assertRaises(IndexError, lambda: sliced[3])
+
+    def test_reverse(self):
+        reversed_set = DataSet(range(5)).reverse()
+        self.assertListEqual(reversed_set.to_list(), [4, 3, 2, 1, 0])
+        self.assertListEqual(reversed_set.take_now(2).to_list(), [4, 3])
+
+    def test_count(self):
+        self.assertEqual(DataSet(range(10)).count(), 10)
+
+    def test_to_list_copies(self):
+        dataset = DataSet(range(3))
+        as_list = dataset.to_list()
+        as_list.append(3)
+        self.assertEqual(len(dataset), 3)
+        self.assertListEqual(dataset.to_list(), [0, 1, 2])
+
     def test_map(self):
         stream2 = DataSet(range(10)) \
             .take_now(5) \
@@ -363,6 +1564,64 @@ class DataSetTests(unittest.TestCase):
         self.assertEqual(5, next(stream2))
 
 
+class PersistentDataSetTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.path = os.path.join(self.workdir, 'rows.bin')
+
+    def test_random_access(self):
+        Person = record_type(['name', 'age'])
+        people = DataStream(range(2500)).map(lambda n: Person('person{}'.format(n), n % 90)).persist(self.path, 100)
+        self.assertIsInstance(people, DataSet)
+        self.assertEqual(len(people), 2500)
+        self.assertEqual(people.count(), 2500)
+        self.assertEqual(people[0].name, 'person0')
+        self.assertEqual(people[1234].name, 'person1234')
+        self.assertEqual(people[-1].name, 'person2499')
+        self.assertRaises(IndexError, lambda: people[2500])
+        self.assertListEqual([person.name for person in people[998:1003:2]], ['person998', 'person1000', 'person1002'])
+        self.assertListEqual([person.age for person in people.reverse().take_now(2)], [69, 68])
+        self.assertListEqual(people.map(attrgetter('age')).filter(lambda age: age == 89).to_list(), [89] * 27)
+        self.assertEqual(sum(1 for _ in people), 2500)
+        people.close()
+
+    def test_reopen(self):
+        DataStream(range(10)).persist(self.path, batch_size=3, compression='zlib').close()
+        script = 'from datastreams import PersistentDataSet; rows = PersistentDataSet({!r}); print(len(rows), rows[7])'
+        output = subprocess.check_output([sys.executable, '-c', script.format(self.path)],
+                                         env=dict(os.environ, PYTHONPATH=parentdir))
+        self.assertEqual(output.split(), [b'10', b'7'])
+        self.assertListEqual(DataStream.from_binary(self.path).to_list(), list(range(10)))
+        self.assertListEqual(PersistentDataSet(self.path).to_list(), list(range(10)))
+
+        self.assertListEqual(DataStream([]).persist(self.path).to_list(), [])
+        DataStream(range(3)).to_binary(self.path)
+        self.assertRaises(ValueError, PersistentDataSet, self.path)
+
+    def test_keeps_set_class(self):
+        people = DictStream([{'name': 'amy', 'age': 31}, {'name': 'brad'}]).persist(self.path)
+        self.assertIsInstance(people, PersistentDataSet)
+        self.assertIsInstance(people, DictSet)
+        self.assertListEqual(people.map(people.attrgetter('age')).to_list(), [31, None])
+        self.assertIsInstance(people.reverse(), DictSet)
+        self.assertIsInstance(people.take(1), DictStream)
+        people.close()
+
+    def test_concatenated(self):
+        DataStream(range(2500)).persist(self.path, batch_size=1000).close()
+        other_path = os.path.join(self.workdir, 'other.bin')
+        DataStream(range(3)).to_binary(other_path)
+        joined_path = os.path.join(self.workdir, 'joined.bin')
+        with open(joined_path, 'wb') as joined:
+            for path in (self.path, other_path, self.path):
+                with open(path, 'rb') as part:
+                    shutil.copyfileobj(part, joined)
+        self.assertListEqual(DataStream.from_binary(joined_path).to_list(), list(range(2500)) + [0, 1, 2] +
+                             list(range(2500)))
+
+
 class FilterRadixTests(unittest.TestCase):
 
     def test_radix_eq(self):
@@ -408,6 +1667,23 @@ class DictStreamTests(unittest.TestCase):
         grouped = stream.group_by('name')
         self.assertEqual(len(grouped), 2)
 
+    def test_dictstream_assign_delete(self):
+        original = {'name': 'brad', 'age': 25}
+        brad = next(DictStream([original]).assign(age=lambda row: 26).delete('name'))
+        self.assertDictEqual(brad, {'age': 26})
+        self.assertDictEqual(original, {'name': 'brad', 'age': 25})
+
+        next(DictStream([original]).delete('age', inplace=True))
+        self.assertDictEqual(original, {'name': 'brad'})
+
+    def test_dictstream_get(self):
+        stream = DictStream([{'name': 'brad'}, {}])
+        self.assertListEqual(stream.get('name', 'nobody').to_list(), ['brad', 'nobody'])
+
+    def test_dictstream_map_method(self):
+        stream = DictStream([{'greet': lambda name: 'hi ' + name}])
+        self.assertListEqual(stream.map_method('greet', 'brad').to_list(), ['hi brad'])
+
     def test_join_basic(self):
         streama = DictStream([{'name': 'brad', 'age': 25}, {'name': 'bradley', 'age': 22}])
         streamb = DictStream([{'name': 'brad', 'num': 21}, {'name': 'cooper', 'num': 22}])